@@ -0,0 +1,117 @@
+# مقایسه تأخیر هندلرها: اتصال جدید sqlite3 در هر فراخوانی روی event loop
+# در برابر استخر اتصال db.Database
+#
+#   python benchmarks/bench_db.py --rate 300 --duration 10
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db import Database
+
+
+def setup_db(path, users):
+    with sqlite3.connect(path) as conn:
+        conn.execute('''CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, balance REAL DEFAULT 0
+        )''')
+        conn.execute('''CREATE TABLE support_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, message TEXT,
+            direction TEXT, created_at TEXT
+        )''')
+        conn.executemany(
+            "INSERT INTO users (user_id, first_name, last_name) VALUES (?, ?, ?)",
+            ((i, f"name{i}", f"family{i}") for i in range(users))
+        )
+
+
+async def legacy_handler(path, user_id):
+    # همان الگوی قبلی bot.py
+    with sqlite3.connect(path) as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        c.fetchone()
+    with sqlite3.connect(path) as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO support_messages (user_id, message, direction, created_at) VALUES (?, ?, ?, ?)",
+            (user_id, "hello", "user_to_admin", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+        conn.commit()
+
+
+async def pooled_handler(db, user_id):
+    await db.fetchone("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    await db.execute(
+        "INSERT INTO support_messages (user_id, message, direction, created_at) VALUES (?, ?, ?, ?)",
+        (user_id, "hello", "user_to_admin", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+
+
+async def drive(handler, rate, duration, users):
+    latencies = []
+    tasks = []
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    start = time.perf_counter()
+
+    async def one(i, scheduled):
+        await handler(i % users)
+        # تأخیر از لحظه‌ای که آپدیت باید پردازش می‌شد
+        latencies.append(time.perf_counter() - scheduled)
+
+    for i in range(total):
+        scheduled = start + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(i, scheduled)))
+
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(name, latencies):
+    print(
+        f"{name:<8} n={len(latencies):<6} "
+        f"p50={percentile(latencies, 50) * 1000:8.2f}ms "
+        f"p95={percentile(latencies, 95) * 1000:8.2f}ms "
+        f"p99={percentile(latencies, 99) * 1000:8.2f}ms"
+    )
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        setup_db(path, args.users)
+
+        latencies = await drive(lambda u: legacy_handler(path, u), args.rate, args.duration, args.users)
+        report("legacy", latencies)
+
+        db = Database(path, pool_size=args.pool_size)
+        try:
+            latencies = await drive(lambda u: pooled_handler(db, u), args.rate, args.duration, args.users)
+            report("pooled", latencies)
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=int, default=300, help="updates per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--pool-size", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
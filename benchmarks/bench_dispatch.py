@@ -0,0 +1,111 @@
+# هزینه انتخاب هندلر: زنجیره if/elif قبلی handle_callback در برابر router.Router
+#
+#   python benchmarks/bench_dispatch.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from router import Router
+
+ADMIN_ID = 123456789
+
+EXACT = [
+    "register", "check_membership", "submit_content", "my_profile", "edit_profile", "back_to_main",
+    "support", "check_balance", "toggle_bot", "view_users", "manage_balances", "view_support",
+    "cancel_reply", "broadcast_message", "private_message", "job_list", "edit_first_name",
+    "edit_last_name", "edit_group_leader", "edit_card_or_wallet", "edit_sheba", "reset_approved_count",
+]
+ADMIN = {"toggle_bot", "view_users", "manage_balances", "view_support", "broadcast_message",
+         "private_message", "job_list", "reset_approved_count"}
+PREFIXES = ["job_status_", "job_cancel_", "reply_", "approve_", "reject_"]
+
+
+def chain(data, user_id):
+    # بازسازی زنجیره قبلی؛ خروجی فقط نام شاخه است
+    if data == "register":
+        return "register"
+    elif data == "check_membership":
+        return "check_membership"
+    elif data == "submit_content":
+        return "submit_content"
+    elif data == "my_profile":
+        return "my_profile"
+    elif data == "edit_profile":
+        return "edit_profile"
+    elif data == "back_to_main":
+        return "back_to_main"
+    elif data == "support":
+        return "support"
+    elif data == "check_balance":
+        return "check_balance"
+    elif data == "toggle_bot" and user_id == ADMIN_ID:
+        return "toggle_bot"
+    elif data == "view_users" and user_id == ADMIN_ID:
+        return "view_users"
+    elif data == "manage_balances" and user_id == ADMIN_ID:
+        return "manage_balances"
+    elif data == "view_support" and user_id == ADMIN_ID:
+        return "view_support"
+    elif data == "cancel_reply":
+        return "cancel_reply"
+    elif data == "broadcast_message" and user_id == ADMIN_ID:
+        return "broadcast_message"
+    elif data == "private_message" and user_id == ADMIN_ID:
+        return "private_message"
+    elif data == "job_list" and user_id == ADMIN_ID:
+        return "job_list"
+    elif data.startswith("job_status_") and user_id == ADMIN_ID:
+        return "job_status_"
+    elif data.startswith("job_cancel_") and user_id == ADMIN_ID:
+        return "job_cancel_"
+    elif data.startswith("reply_"):
+        return "reply_"
+    elif data.startswith("approve_") or data.startswith("reject_"):
+        return "approve_"
+    elif data == "edit_first_name":
+        return "edit_first_name"
+    elif data == "edit_last_name":
+        return "edit_last_name"
+    elif data == "edit_group_leader":
+        return "edit_group_leader"
+    elif data == "edit_card_or_wallet":
+        return "edit_card_or_wallet"
+    elif data == "edit_sheba":
+        return "edit_sheba"
+    elif data == "reset_approved_count" and user_id == ADMIN_ID:
+        return "reset_approved_count"
+    return None
+
+
+def build_router():
+    router = Router([ADMIN_ID])
+    for key in EXACT:
+        router.add(key, key, admin=key in ADMIN)
+    for prefix in PREFIXES:
+        router.add_prefix(prefix, prefix, admin=True)
+    return router
+
+
+def main():
+    router = build_router()
+    cases = {
+        "first (register)": "register",
+        "middle (cancel_reply)": "cancel_reply",
+        "prefix (approve_42)": "approve_42",
+        "last (reset_approved_count)": "reset_approved_count",
+        "unknown": "no_such_callback",
+    }
+    number = 1000000
+    print(f"{'case':<30}{'if/elif (ns)':>14}{'router (ns)':>14}")
+    for name, data in cases.items():
+        env = {"chain": chain, "resolve": router.resolve, "data": data, "user_id": ADMIN_ID}
+        t_chain = min(timeit.repeat("chain(data, user_id)", globals=env, number=number, repeat=5))
+        t_router = min(timeit.repeat("resolve(data, user_id)", globals=env, number=number, repeat=5))
+        print(f"{name:<30}{t_chain / number * 1e9:>14.1f}{t_router / number * 1e9:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
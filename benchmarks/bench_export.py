@@ -0,0 +1,71 @@
+# زمان و حداکثر RSS خروجی CSV بر حسب تعداد ردیف‌ها (هر اندازه در یک پردازه جدا)
+#
+#   python benchmarks/bench_export.py --rows 10000 100000 300000
+
+import argparse
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def populate(path, rows):
+    with sqlite3.connect(path) as conn:
+        conn.execute('''CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, card_or_wallet TEXT,
+            sheba_number TEXT, group_leader_name TEXT, balance REAL DEFAULT 0,
+            approved_count INTEGER DEFAULT 0, registered_at TEXT
+        )''')
+        conn.executemany(
+            "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((i, f"نام{i}", f"خانوادگی{i}", "6037" + str(i).zfill(12), "IR" + str(i).zfill(24),
+              f"سرگروه{i % 50}", i * 1000.0, i % 300, "2025-01-01 12:00:00") for i in range(rows))
+        )
+
+
+def run_one(path, compress):
+    from export import export_table
+
+    start = time.perf_counter()
+    with sqlite3.connect(path) as conn:
+        out, count = export_table(conn, "users", compress)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(out)
+    os.remove(out)
+    # ru_maxrss در لینوکس بر حسب KiB است
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{count}\t{elapsed:.3f}\t{peak}\t{size}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 300000])
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_one(args.child, args.gzip)
+        return
+
+    print(f"{'rows':>10}{'seconds':>10}{'peak RSS (MiB)':>16}{'file (MiB)':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = os.path.join(tmp, f"bench_{rows}.db")
+            populate(path, rows)
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", path]
+            if args.gzip:
+                cmd.append("--gzip")
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.split()
+            count, elapsed, peak, size = int(out[0]), float(out[1]), int(out[2]), int(out[3])
+            print(f"{count:>10}{elapsed:>10.2f}{peak / 1024:>16.1f}{size / 1048576:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
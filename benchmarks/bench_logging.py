@@ -0,0 +1,78 @@
+# هزینه لاگ کردن روی thread فراخوان (event loop) در حالت‌های مختلف:
+#   sync-fstring: تنظیم قبلی (FileHandler و StreamHandler همزمان، پیام f-string)
+#   sync-lazy:    همان handlerها با چرخش فایل و پیام %-style
+#   queue-lazy:   QueueHandler/QueueListener با قالب‌بندی در thread listener
+#   queue-sample: queue-lazy با نمونه‌برداری ۱ از ۱۰۰ برای لاگ هر گیرنده
+#
+#   python benchmarks/bench_logging.py --records 100000
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logs import LOG_FORMAT, LogSampler, setup_logging, stop_listener
+
+
+def setup_old(path):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in (logging.FileHandler(path, encoding='utf-8'), logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def run(mode, records, directory):
+    path = os.path.join(directory, f"{mode}.log")
+    listener = None
+    if mode == "sync-fstring":
+        setup_old(path)
+    else:
+        listener = setup_logging(path=path, use_queue=mode.startswith("queue"))
+    logger = logging.getLogger("bench")
+    sampler = LogSampler(logger, 100 if mode == "queue-sample" else 1)
+
+    start = time.perf_counter()
+    if mode == "sync-fstring":
+        for user_id in range(records):
+            logger.info(f"Broadcast sent to user {user_id}")
+    else:
+        for user_id in range(records):
+            sampler.log(logging.INFO, "Broadcast sent to user %s", user_id)
+    caller = time.perf_counter() - start
+    if listener is not None:
+        stop_listener(listener)
+    total = time.perf_counter() - start
+    for handler in logging.getLogger().handlers:
+        handler.close()
+    lines = sum(1 for _ in open(path, encoding="utf-8"))
+    return caller, total, lines
+
+
+def main(args):
+    directory = tempfile.mkdtemp()
+    # خروجی کنسول به devnull می‌رود تا ترمینال زمان‌ها را تحت تأثیر قرار ندهد
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+    try:
+        results = [(mode, *run(mode, args.records, directory))
+                   for mode in ("sync-fstring", "sync-lazy", "queue-lazy", "queue-sample")]
+    finally:
+        sys.stderr = stderr
+    baseline = results[0][1]
+    for mode, caller, total, lines in results:
+        print(f"{mode:<13} caller={caller / args.records * 1e6:6.2f}us/record "
+              f"({args.records / caller:9,.0f} records/s, {baseline / caller:5.1f}x) "
+              f"until written={total:.2f}s lines={lines}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100000)
+    main(parser.parse_args())
@@ -0,0 +1,52 @@
+# هزینه ثبت هر نمونه متریک (هدف: کمتر از ۱ میکروثانیه) و زمان ساخت خروجی /metrics
+#
+#   python benchmarks/bench_metrics.py --samples 1000000
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metrics import Registry
+
+
+def per_sample(fn, samples):
+    start = time.perf_counter()
+    for _ in range(samples):
+        fn()
+    return (time.perf_counter() - start) / samples
+
+
+def main(args):
+    registry = Registry()
+    counter = registry.counter("bench_total", "Bench counter", ["route"])
+    histogram = registry.histogram("bench_seconds", "Bench histogram", ["type", "route"])
+    child = histogram.labels("callback", "rq_approve")
+
+    empty = per_sample(lambda: None, args.samples)
+    results = {
+        "counter.labels().inc()": per_sample(lambda: counter.labels("start").inc(), args.samples),
+        "histogram.labels().observe()": per_sample(lambda: histogram.labels("callback", "rq_approve").observe(0.0042), args.samples),
+        "child.observe()": per_sample(lambda: child.observe(0.0042), args.samples),
+    }
+    ok = True
+    for name, seconds in results.items():
+        cost = (seconds - empty) * 1e6
+        ok = ok and cost < 1.0
+        print(f"{name:<30} {cost:.3f}us per sample")
+
+    for route in range(200):
+        histogram.labels("callback", f"route_{route}").observe(0.01)
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"render: {len(text.splitlines())} lines in {(time.perf_counter() - start) * 1000:.2f}ms")
+    print("OK" if ok else "SLOW")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=1000000)
+    sys.exit(main(parser.parse_args()))
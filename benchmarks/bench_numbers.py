@@ -0,0 +1,69 @@
+# زمان بررسی تکراری بودن شماره‌های یک لیست جدید وقتی میلیون‌ها شماره قبلاً
+# در submission_numbers ثبت شده است
+#
+#   python benchmarks/bench_numbers.py --stored 2000000 --list-size 100
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phones import duplicate_stats, init_number_tables
+
+
+def setup_db(path, stored, per_list):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE submissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, content TEXT,
+        content_type TEXT, submitted_at TEXT, status TEXT DEFAULT 'pending'
+    )''')
+    init_number_tables(conn.cursor())
+    lists = stored // per_list
+    with conn:
+        conn.executemany(
+            "INSERT INTO submissions (id, user_id, content_type, status) VALUES (?, ?, 'text', ?)",
+            ((i, i % 1000, ("pending", "approved", "rejected")[i % 3]) for i in range(1, lists + 1))
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO submission_numbers (number, submission_id, user_id) VALUES (?, ?, ?)",
+            ((989000000000 + (i * 7919) % 1000000000, i // per_list + 1, (i // per_list + 1) % 1000)
+             for i in range(stored))
+        )
+    return conn
+
+
+def main(args):
+    path = os.path.join(tempfile.mkdtemp(), "numbers.db")
+    start = time.perf_counter()
+    conn = setup_db(path, args.stored, args.list_size)
+    print(f"stored {args.stored} numbers in {time.perf_counter() - start:.1f}s")
+
+    rng = random.Random(1)
+    timings = []
+    for _ in range(args.rounds):
+        # نیمی از شماره‌ها از قبل موجودند
+        numbers = {989000000000 + (rng.randrange(args.stored) * 7919) % 1000000000 for _ in range(args.list_size // 2)}
+        numbers |= {989900000000 + rng.randrange(10 ** 8) for _ in range(args.list_size - len(numbers))}
+        start = time.perf_counter()
+        stats = duplicate_stats(conn, 1, numbers)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    per_number = timings[len(timings) // 2] / args.list_size * 1e6
+    print(f"list={args.list_size} p50={timings[len(timings) // 2] * 1000:.2f}ms "
+          f"p95={timings[int(len(timings) * 0.95)] * 1000:.2f}ms per-number={per_number:.1f}us "
+          f"last={stats}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stored", type=int, default=2000000)
+    parser.add_argument("--list-size", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,100 @@
+# زمان یک run تسویه برای تعداد زیادی کاربر دارای موجودی، با یک قطع عمدی در
+# وسط run و ادامه آن تا بررسی شود هیچ کاربری دو بار یا جا افتاده پرداخت نشود.
+#
+#   python benchmarks/bench_payout.py --users 50000 --batch-size 1000
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import payout
+from db import Database
+from ledger import init_ledger_tables, reconcile
+from payout import init_payout_tables, process_run, start_run
+
+
+def setup_db(path, users):
+    with sqlite3.connect(path) as conn:
+        conn.execute('''CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, card_or_wallet TEXT,
+            sheba_number TEXT, group_leader_name TEXT, balance REAL DEFAULT 0, approved_count INTEGER DEFAULT 0
+        )''')
+        # از هر پنج کاربر یکی موجودی صفر دارد
+        conn.executemany(
+            "INSERT INTO users (user_id, first_name, last_name, card_or_wallet, sheba_number, balance) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((i, f"name{i}", f"family{i}", f"6037{i:012d}", f"IR{i:024d}", 0 if i % 5 == 0 else 1000 + i)
+             for i in range(1, users * 5 // 4 + 1))
+        )
+        init_ledger_tables(conn.cursor())
+        init_payout_tables(conn.cursor())
+
+
+async def main(args):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "payout.db")
+    setup_db(path, args.users)
+    db = Database(path, wal=True)
+    expected = (await db.fetchone("SELECT COUNT(*), SUM(balance) FROM users WHERE balance > 0"))
+
+    run_id, _ = await db.run(start_run, 1, args.batch_size)
+    files = os.path.join(directory, "files")
+
+    # قطع run بعد از نیمی از دسته‌ها با خطا در نوشتن فایل
+    write_batch_file = payout.write_batch_file
+    crash_at = max(1, expected[0] // args.batch_size // 2)
+
+    def crashing_write(conn, run_id, batch_no, path):
+        if batch_no == crash_at:
+            raise OSError("simulated crash")
+        return write_batch_file(conn, run_id, batch_no, path)
+
+    # ارسال ساختگی: هر دسته باید دقیقاً یک بار تحویل شود
+    delivered = []
+
+    async def deliver(batch_no, path):
+        delivered.append(batch_no)
+
+    payout.write_batch_file = crashing_write
+    start = time.perf_counter()
+    try:
+        await process_run(db, run_id, files, deliver=deliver)
+    except OSError:
+        pass
+    payout.write_batch_file = write_batch_file
+
+    resumed_id, created = await db.run(start_run, 1, args.batch_size)
+    batches, users, amount = await process_run(db, resumed_id, files, deliver=deliver)
+    elapsed = time.perf_counter() - start
+    paths = [payout.batch_path(files, resumed_id, batch_no) for batch_no in range(1, batches + 1)]
+
+    paid_rows = sum(sum(1 for _ in open(p, encoding="utf-8-sig")) - 1 for p in paths)
+    remaining = (await db.fetchone("SELECT COUNT(*) FROM users WHERE balance > 0"))[0]
+    drift = await db.run(reconcile, False)
+    db.close()
+
+    print(f"payable={expected[0]} paid={users} rows_in_files={paid_rows} batches={len(paths)} "
+          f"amount={amount:,.0f} elapsed={elapsed:.2f}s")
+    ok = (
+        resumed_id == run_id and not created
+        and users == paid_rows == expected[0]
+        and amount == expected[1]
+        and remaining == 0
+        and delivered == list(range(1, batches + 1))
+        and not drift
+    )
+    print("OK" if ok else "MISMATCH")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50000, help="number of payable users")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,79 @@
+# مقایسه اعتبارسنجی لیست شماره‌ها: حلقه خط به خط در برابر check_list
+# (نرمال‌سازی روی کل متن، یک findall و حذف تکراری با set)
+#
+#   python benchmarks/bench_validation.py --sizes 100 10000
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phones import check_list
+
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹", "0123456789")
+
+
+def per_line(text):
+    # روش خط به خط: برای هر خط جداگانه تبدیل ارقام، حذف جداکننده‌ها و تطبیق
+    numbers = set()
+    valid = invalid = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        digits = re.sub(r"[\s\-().]", "", line.translate(_DIGITS))
+        match = re.match(r"^(?:\+?98|0098|0)?(9\d{9})$", digits)
+        if match:
+            valid += 1
+            numbers.add(int("98" + match.group(1)))
+        else:
+            invalid += 1
+    return {"valid": len(numbers), "duplicates": valid - len(numbers), "invalid": invalid}
+
+
+def make_list(size, rng):
+    formats = ["0912{:07d}", "+98 912 {:03d} {:04d}", "۰۹۱۲{:07d}", "912-{:07d}"]
+    lines = []
+    for _ in range(size):
+        n = rng.randrange(10 ** 7)
+        fmt = rng.choice(formats)
+        if "{:03d}" in fmt:
+            lines.append(fmt.format(n // 10000, n % 10000))
+        elif fmt.startswith("۰"):
+            lines.append(fmt.format(n).translate(str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")))
+        else:
+            lines.append(fmt.format(n))
+        if rng.random() < 0.05:
+            lines.append("invalid line")
+        if rng.random() < 0.05:
+            lines.append(lines[-1])
+    return "\n".join(lines)
+
+
+def bench(fn, text, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn(text)
+    return (time.perf_counter() - start) / rounds, result
+
+
+def main(args):
+    rng = random.Random(1)
+    for size in args.sizes:
+        text = make_list(size, rng)
+        rounds = max(5, 200000 // size)
+        slow, expected = bench(per_line, text, rounds)
+        fast, result = bench(check_list, text, rounds)
+        same = all(result[k] == expected[k] for k in expected)
+        print(f"lines={size:<6} per-line={slow * 1000:8.3f}ms check_list={fast * 1000:8.3f}ms "
+              f"speedup={slow / fast:4.1f}x valid={result['valid']} match={same}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000])
+    main(parser.parse_args())
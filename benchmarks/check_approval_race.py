@@ -0,0 +1,110 @@
+# بررسی همزمانی تأیید شماره‌ها: هر شماره چند بار به صورت موازی تأیید/رد می‌شود
+# (تکی و گروهی) و در پایان approved_count کاربران باید دقیقاً برابر مجموع
+# تأییدهای موفق و موجودی برابر جمع دفتر باشد. در صورت مغایرت با کد خروج 1 تمام می‌شود.
+#
+#   python benchmarks/check_approval_race.py --submissions 500 --attempts 8
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db import Database
+from ledger import init_ledger_tables, reconcile
+from submissions import approve_submission, reject_submission, review_batch
+
+
+def setup_db(path, users, submissions):
+    with sqlite3.connect(path) as conn:
+        conn.execute('''CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY, group_leader_name TEXT,
+            balance REAL DEFAULT 0, approved_count INTEGER DEFAULT 0
+        )''')
+        conn.execute('''CREATE TABLE submissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, content TEXT,
+            content_type TEXT, submitted_at TEXT, status TEXT DEFAULT 'pending'
+        )''')
+        conn.execute('''CREATE TABLE submission_details (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, submission_id INTEGER, approved_items INTEGER
+        )''')
+        conn.executemany("INSERT INTO users (user_id) VALUES (?)", ((i,) for i in range(users)))
+        init_ledger_tables(conn.cursor(), default_rate=10)
+        conn.executemany(
+            "INSERT INTO submissions (user_id, content, content_type) VALUES (?, 'x', 'text')",
+            ((i % users,) for i in range(submissions))
+        )
+
+
+async def main(args):
+    path = os.path.join(tempfile.mkdtemp(), "race.db")
+    setup_db(path, args.users, args.submissions)
+    db = Database(path, pool_size=args.pool_size, wal=True)
+    rng = random.Random(args.seed)
+    # مجموع مورد انتظار بر اساس تلاش‌هایی که واقعاً موفق شدند
+    expected = {}
+
+    async def approve_one(submission_id):
+        items = rng.randint(50, 100)
+        user_id = await db.run(approve_submission, submission_id, items)
+        if user_id is not None:
+            expected[user_id] = expected.get(user_id, 0) + items
+            return 1
+        return 0
+
+    async def reject_one(submission_id):
+        return 1 if await db.run(reject_submission, submission_id) is not None else 0
+
+    async def approve_batch(submission_ids):
+        items = rng.randint(50, 100)
+        processed = await db.run(review_batch, submission_ids, "approved", items)
+        for _, user_id in processed:
+            expected[user_id] = expected.get(user_id, 0) + items
+        return len(processed)
+
+    tasks = []
+    ids = list(range(1, args.submissions + 1))
+    for submission_id in ids:
+        for _ in range(args.attempts):
+            tasks.append(approve_one(submission_id))
+        if rng.random() < 0.2:
+            tasks.append(reject_one(submission_id))
+    for _ in range(args.submissions // 10):
+        tasks.append(approve_batch(rng.sample(ids, 10)))
+    rng.shuffle(tasks)
+
+    changed = sum(await asyncio.gather(*tasks))
+
+    approved = (await db.fetchone("SELECT COUNT(*) FROM submissions WHERE status = 'approved'"))[0]
+    rejected = (await db.fetchone("SELECT COUNT(*) FROM submissions WHERE status = 'rejected'"))[0]
+    details = (await db.fetchone("SELECT COUNT(*) FROM submission_details"))[0]
+    counts = dict(await db.fetchall("SELECT user_id, approved_count FROM users WHERE approved_count > 0"))
+    balances = dict(await db.fetchall("SELECT user_id, balance FROM users WHERE balance != 0"))
+    drift = await db.run(reconcile, False)
+    db.close()
+
+    print(f"attempts={len(tasks)} changed={changed} approved={approved} rejected={rejected} details={details}")
+    ok = (
+        changed == args.submissions
+        and approved + rejected == args.submissions
+        and details == approved
+        and counts == expected
+        and balances == {user_id: count * 10 for user_id, count in expected.items()}
+        and not drift
+    )
+    print("OK" if ok else "MISMATCH: approved_count or balance differs from successful approvals")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--attempts", type=int, default=8, help="parallel approvals per submission")
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,167 @@
+# جایگزین محلی Client در Pyrogram و سازنده آپدیت‌های ساختگی برای اجرای
+# هندلرهای bot.py بدون اتصال به تلگرام (استفاده در benchmarks/loadtest.py)
+
+import asyncio
+import itertools
+import random
+from collections import Counter, deque
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+from pyrogram import StopPropagation
+from pyrogram.errors import FloodWait, QueryIdInvalid
+
+# نام جریانی که فراخوانی‌های API در آن انجام می‌شوند؛ فراخوانی‌های workerهای
+# صف خروجی (که خارج از جریان‌ها ساخته شده‌اند) با None ثبت می‌شوند
+CURRENT_FLOW = ContextVar("current_flow", default=None)
+
+# متدهایی که می‌توانند FloodWait بگیرند
+FLOOD_METHODS = {"send_message", "send_photo", "send_document", "edit_message_text", "edit_message_reply_markup"}
+
+
+class FakeClient:
+    # هر فراخوانی latency (به علاوه jitter تصادفی) ثانیه طول می‌کشد و با
+    # احتمال flood_rate خطای FloodWait(flood_wait) می‌گیرد. تعداد فراخوانی‌ها
+    # به تفکیک (جریان، متد) شمرده و آخرین record_limit فراخوانی نگه داشته می‌شود.
+
+    def __init__(self, latency=0.05, jitter=0.0, flood_rate=0.0, flood_wait=1, member_status="member",
+                 record_limit=10000, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.member_status = member_status
+        self.calls = Counter()
+        self.error_replies = Counter()
+        self.flood_waits = 0
+        self.repeated_answers = 0
+        self.recent = deque(maxlen=record_limit)
+        self._rng = random.Random(seed)
+        self._message_ids = itertools.count(1)
+
+    async def _api(self, method, chat_id, **kwargs):
+        flow = CURRENT_FLOW.get()
+        self.calls[flow, method] += 1
+        self.recent.append((method, chat_id, kwargs))
+        text = kwargs.get("text") or kwargs.get("caption") or ""
+        if text.startswith("❌"):
+            self.error_replies[flow] += 1
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if method in FLOOD_METHODS and self.flood_rate and self._rng.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWait(value=self.flood_wait)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._api("send_message", chat_id, text=text, **kwargs)
+        return FakeMessage(self, chat_id, chat_id, text=text, message_id=next(self._message_ids))
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        await self._api("send_photo", chat_id, photo=photo, **kwargs)
+        return FakeMessage(self, chat_id, chat_id, photo=photo, message_id=next(self._message_ids))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await self._api("send_document", chat_id, **kwargs)
+        return FakeMessage(self, chat_id, chat_id, message_id=next(self._message_ids))
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        await self._api("edit_message_text", chat_id, text=text, **kwargs)
+        return FakeMessage(self, chat_id, chat_id, text=text, message_id=message_id)
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        await self._api("edit_message_reply_markup", chat_id, reply_markup=reply_markup)
+        return FakeMessage(self, chat_id, chat_id, message_id=message_id)
+
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        await self._api("answer_callback_query", None, text=text, show_alert=show_alert)
+        return True
+
+    async def get_chat_member(self, chat_id, user_id):
+        await self._api("get_chat_member", chat_id, user_id=user_id)
+        return SimpleNamespace(status=self.member_status)
+
+    def buttons(self, chat_id, prefix):
+        # callback_data دکمه‌هایی که با prefix شروع می‌شوند در پیام‌های ارسال‌شده
+        # به chat_id، از جدیدترین پیام (مثلاً دکمه‌های تأیید لیست‌ها برای ادمین)
+        for method, target, kwargs in reversed(self.recent):
+            markup = kwargs.get("reply_markup")
+            if target != chat_id or markup is None:
+                continue
+            for row in markup.inline_keyboard:
+                for button in row:
+                    if button.callback_data and button.callback_data.startswith(prefix):
+                        yield button.callback_data
+
+    def stats(self):
+        methods = Counter()
+        for (_, method), count in self.calls.items():
+            methods[method] += count
+        return dict(methods)
+
+
+class FakeMessage:
+
+    def __init__(self, client, chat_id, user_id, text=None, photo=None, command=None, message_id=0):
+        self._client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=user_id)
+        self.text = text
+        self.photo = SimpleNamespace(file_id=photo) if photo else None
+        self.command = command
+
+    async def reply(self, text, **kwargs):
+        return await self._client.send_message(self.chat.id, text, **kwargs)
+
+    async def reply_document(self, document, **kwargs):
+        return await self._client.send_document(self.chat.id, document, **kwargs)
+
+    async def edit_text(self, text, **kwargs):
+        return await self._client.edit_message_text(self.chat.id, self.id, text, **kwargs)
+
+    async def edit_reply_markup(self, reply_markup=None):
+        return await self._client.edit_message_reply_markup(self.chat.id, self.id, reply_markup)
+
+    def stop_propagation(self):
+        raise StopPropagation
+
+
+class FakeCallbackQuery:
+
+    def __init__(self, client, user_id, data, message, query_id):
+        self._client = client
+        self.id = str(query_id)
+        self.from_user = SimpleNamespace(id=user_id)
+        self.data = data
+        self.message = message
+        self.answered = False
+
+    async def answer(self, text=None, show_alert=None, **kwargs):
+        # مثل تلگرام، پاسخ دوم به یک callback با QUERY_ID_INVALID رد می‌شود
+        if self.answered:
+            self._client.repeated_answers += 1
+            raise QueryIdInvalid()
+        self.answered = True
+        return await self._client.answer_callback_query(self.id, text=text, show_alert=show_alert)
+
+    def stop_propagation(self):
+        raise StopPropagation
+
+
+class UpdateFactory:
+    # ساخت Message و CallbackQuery ساختگی در چت خصوصی هر کاربر
+
+    def __init__(self, client):
+        self.client = client
+        self._ids = itertools.count(1)
+
+    def message(self, user_id, text=None, photo=None):
+        command = text[1:].split() if text and text.startswith("/") else None
+        return FakeMessage(self.client, user_id, user_id, text=text, photo=photo, command=command,
+                           message_id=next(self._ids))
+
+    def callback(self, user_id, data):
+        # پیامی که دکمه‌اش زده شده؛ پیام قبلی ربات در همان چت
+        message = FakeMessage(self.client, user_id, user_id, message_id=next(self._ids))
+        return FakeCallbackQuery(self.client, user_id, data, message, next(self._ids))
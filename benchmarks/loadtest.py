@@ -0,0 +1,336 @@
+# آزمون بار bot.py بدون تلگرام: هندلرهای واقعی (با middleware محدودیت نرخ،
+# routerها، استخر پایگاه داده و صف خروجی) با یک Client ساختگی و آپدیت‌های
+# ساختگی اجرا می‌شوند. جریان‌ها (start، ثبت‌نام، ارسال لیست، پشتیبانی و پنل
+# ادمین) با نرخ ثابت و نسبت‌های --mix شروع می‌شوند و برای هر جریان
+# throughput، صدک‌های تأخیر کل جریان و رقابت روی استخر پایگاه داده گزارش می‌شود.
+# پایگاه داده و bot.log در یک پوشه موقت ساخته می‌شوند. watchdog در طول اجرا
+# توقف‌های event loop را می‌شمارد؛ با --strict دسترسی همزمان به پایگاه داده
+# روی thread event loop خطا می‌دهد و اجرا با کد خروج 1 تمام می‌شود.
+#
+#   python benchmarks/loadtest.py --rate 50 --duration 30 --latency 0.05 --flood-rate 0.01
+#   python benchmarks/loadtest.py --strict --duration 10
+
+import argparse
+import asyncio
+import importlib
+import itertools
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from pyrogram import StopPropagation
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fakes import CURRENT_FLOW, FakeClient, UpdateFactory
+from ratelimit import SendRateLimiter
+
+DEFAULT_MIX = "start=2,registration=1,submission=3,support=2,admin=0.5"
+
+# شناسه کاربران تازه در جریان ثبت‌نام (جدا از کاربران ثبت‌نام‌شده 1..users)
+NEW_USER_BASE = 10 ** 9
+
+
+class FlowStats:
+
+    def __init__(self):
+        self.latencies = []
+        self.updates = 0
+        self.limited = 0
+        self.exceptions = 0
+        self.db_waits = []
+        self.db_times = []
+
+
+def load_bot(workdir):
+    # bot.py پایگاه داده و فایل لاگ را با مسیر نسبی می‌سازد
+    os.chdir(workdir)
+    return importlib.import_module("bot")
+
+
+def seed(bot, users, channels):
+    bot.init_db()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with bot.db.connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, first_name, last_name, card_or_wallet, sheba_number, "
+            "group_leader_name, registered_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((i, f"name{i}", f"family{i}", "6037991234567890", "IR" + "0" * 24, f"leader{i % 50}", now)
+             for i in range(1, users + 1))
+        )
+    for i in range(channels):
+        bot.add_required_channel(f"-100{i:010d}", f"channel{i}", f"https://t.me/channel{i}")
+
+
+def instrument_db(db, stats):
+    # زمان انتظار هر کوئری برای thread آزاد استخر و زمان اجرای آن، به تفکیک
+    # جریانی که کوئری را فرستاده (نوشتن‌های دسته‌ای db.write شامل نمی‌شوند)
+    run_sync = db._run_sync
+
+    async def submit(label, fn, args):
+        flow = stats.get(CURRENT_FLOW.get())
+        queued = time.perf_counter()
+        times = []
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return run_sync(label, fn, args)
+            finally:
+                times.append((started - queued, time.perf_counter() - started))
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(db._executor, timed)
+        finally:
+            if flow is not None and times:
+                flow.db_waits.append(times[0][0])
+                flow.db_times.append(times[0][1])
+
+    db._submit = submit
+
+
+async def dispatch_message(bot, client, message):
+    # همان ترتیب Pyrogram: middleware گروه -1 برای غیر ادمین، سپس اولین هندلر
+    # گروه 0 (دستورها یا handle_message)
+    if message.from_user.id != bot.ADMIN_ID:
+        try:
+            await bot.limit_messages(client, message)
+        except StopPropagation:
+            return False
+    commands = {"start": bot.start}
+    if message.from_user.id == bot.ADMIN_ID:
+        commands["admin"] = bot.admin_panel
+    handler = commands.get(message.command[0]) if message.command else bot.handle_message
+    if handler is not None:
+        await handler(client, message)
+    return True
+
+
+async def dispatch_callback(bot, client, callback_query):
+    if callback_query.from_user.id != bot.ADMIN_ID:
+        try:
+            await bot.limit_callbacks(client, callback_query)
+        except StopPropagation:
+            return False
+    await bot.handle_callback(client, callback_query)
+    return True
+
+
+def numbers_list(rng, count):
+    return "\n".join(f"0912{rng.randrange(10 ** 7):07d}" for _ in range(count))
+
+
+class Flows:
+    # هر جریان دنباله آپدیت‌های یک کاربر است؛ نتیجه: تعداد آپدیت‌ها و
+    # تعداد آپدیت‌های محدودشده
+
+    def __init__(self, bot, client, users, seed):
+        self.bot = bot
+        self.client = client
+        self.updates = UpdateFactory(client)
+        self.rng = random.Random(seed)
+        self._users = itertools.cycle(range(1, users + 1))
+        self._new_users = itertools.count(NEW_USER_BASE)
+        self._reviewed = set()
+
+    async def _run(self, steps):
+        sent = limited = 0
+        for kind, user_id, payload in steps:
+            if kind == "message":
+                ok = await dispatch_message(self.bot, self.client, self.updates.message(user_id, payload))
+            else:
+                ok = await dispatch_callback(self.bot, self.client, self.updates.callback(user_id, payload))
+            sent += 1
+            if not ok:
+                limited += 1
+                break
+        return sent, limited
+
+    async def start(self):
+        return await self._run([("message", next(self._users), "/start")])
+
+    async def registration(self):
+        user_id = next(self._new_users)
+        return await self._run([
+            ("message", user_id, "/start"),
+            ("callback", user_id, "register"),
+            ("message", user_id, f"name{user_id}"),
+            ("message", user_id, f"family{user_id}"),
+            ("message", user_id, "leader"),
+            ("message", user_id, "6037991234567890"),
+            ("message", user_id, "IR" + "0" * 24),
+        ])
+
+    async def submission(self):
+        user_id = next(self._users)
+        return await self._run([
+            ("callback", user_id, "submit_content"),
+            ("message", user_id, numbers_list(self.rng, self.rng.randint(60, 90))),
+        ])
+
+    async def support(self):
+        user_id = next(self._users)
+        return await self._run([
+            ("callback", user_id, "support"),
+            ("message", user_id, f"سلام، سؤال شماره {self.rng.randrange(1000)}"),
+        ])
+
+    async def admin(self):
+        admin_id = self.bot.ADMIN_ID
+        steps = [
+            ("message", admin_id, "/admin"),
+            ("callback", admin_id, "view_users"),
+            ("callback", admin_id, "view_support"),
+            ("callback", admin_id, "review_queue"),
+        ]
+        # تأیید جدیدترین لیستی که اعلانش برای ادمین ارسال شده است
+        for data in self.client.buttons(admin_id, "accept_"):
+            if data not in self._reviewed:
+                self._reviewed.add(data)
+                steps.append(("callback", admin_id, data))
+                break
+        return await self._run(steps)
+
+
+async def drive(flows, mix, rate, duration, stats, seed):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    rng = random.Random(seed)
+    tasks = []
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    start = time.perf_counter()
+
+    async def one(name, scheduled):
+        CURRENT_FLOW.set(name)
+        flow = stats[name]
+        try:
+            sent, limited = await getattr(flows, name)()
+            flow.updates += sent
+            flow.limited += limited
+        except Exception as e:
+            flow.exceptions += 1
+            logging.getLogger(__name__).error("Flow %s failed: %r", name, e)
+        # تأخیر از لحظه‌ای که جریان باید شروع می‌شد
+        flow.latencies.append(time.perf_counter() - scheduled)
+
+    for i in range(total):
+        scheduled = start + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        name = rng.choices(names, weights)[0]
+        tasks.append(asyncio.ensure_future(one(name, scheduled)))
+
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(stats, client, elapsed):
+    print(
+        f"{'flow':<13}{'n':>6}{'err':>6}{'lim':>6}{'flows/s':>9}{'upd/s':>8}"
+        f"{'p50':>10}{'p95':>10}{'p99':>10}{'q/flow':>8}{'db p95':>10}{'wait p95':>10}{'wait%':>7}"
+    )
+    for name, flow in stats.items():
+        if not flow.latencies:
+            continue
+        n = len(flow.latencies)
+        errors = flow.exceptions + client.error_replies[name]
+        waits, times = flow.db_waits or [0.0], flow.db_times or [0.0]
+        # سهم انتظار برای استخر از کل زمان پایگاه داده (انتظار + اجرا)
+        busy = sum(waits) + sum(times)
+        print(
+            f"{name:<13}{n:>6}{errors:>6}{flow.limited:>6}{n / elapsed:>9.1f}{flow.updates / elapsed:>8.1f}"
+            f"{percentile(flow.latencies, 50) * 1000:>8.1f}ms"
+            f"{percentile(flow.latencies, 95) * 1000:>8.1f}ms"
+            f"{percentile(flow.latencies, 99) * 1000:>8.1f}ms"
+            f"{len(flow.db_times) / n:>8.1f}"
+            f"{percentile(times, 95) * 1000:>8.2f}ms"
+            f"{percentile(waits, 95) * 1000:>8.2f}ms"
+            f"{(sum(waits) / busy * 100 if busy else 0):>6.0f}%"
+        )
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name.startswith("_") or not hasattr(Flows, name):
+            raise SystemExit(f"unknown flow: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def main(bot, args):
+    client = FakeClient(latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate,
+                        flood_wait=args.flood_wait, seed=args.seed)
+    bot.outbox.client = client
+    bot.broadcaster.client = client
+    bot.outbox.limiter = SendRateLimiter(args.send_rate, args.chat_rate)
+    mix = parse_mix(args.mix)
+    stats = {name: FlowStats() for name in mix}
+    instrument_db(bot.db, stats)
+    bot.db.strict = args.strict
+    bot.watchdog.threshold = args.stall_threshold
+
+    bot.watchdog.start()
+    bot.state_store.start()
+    await bot.outbox.start()
+    try:
+        elapsed = await drive(Flows(bot, client, args.users, args.seed), mix, args.rate, args.duration, stats,
+                              args.seed)
+    finally:
+        await bot.outbox.stop()
+        bot.watchdog.stop()
+
+    print(f"rate={args.rate}/s duration={args.duration}s elapsed={elapsed:.1f}s latency={args.latency * 1000:.0f}ms "
+          f"flood_rate={args.flood_rate} pool={bot.DB_POOL_SIZE}")
+    report(stats, client, elapsed)
+    print("api calls:", ", ".join(f"{method}={count}" for method, count in sorted(client.stats().items())))
+    print("flood waits injected:", client.flood_waits)
+    print("repeated callback answers:", client.repeated_answers)
+    print("outbox:", ", ".join(f"{key}={value}" for key, value in bot.outbox.stats().items()))
+    print(f"event loop stalls > {args.stall_threshold * 1000:.0f}ms: {bot.watchdog.stalls}")
+    print("sync DB calls on the event loop thread:", bot.db.sync_on_loop)
+    return 1 if args.strict and bot.db.sync_on_loop else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=50, help="flows started per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="relative weight of each flow")
+    parser.add_argument("--users", type=int, default=10000, help="registered users to seed")
+    parser.add_argument("--channels", type=int, default=1, help="required channels (get_chat_member calls)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Telegram API call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, seconds")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability of FloodWait per send")
+    parser.add_argument("--flood-wait", type=int, default=1, help="seconds requested by injected FloodWait")
+    parser.add_argument("--send-rate", type=float, default=25, help="outbox global messages per second")
+    parser.add_argument("--chat-rate", type=float, default=1, help="outbox messages per second per chat")
+    parser.add_argument("--stall-threshold", type=float, default=0.1, help="watchdog threshold, seconds")
+    parser.add_argument("--strict", action="store_true", help="fail on sync DB calls on the event loop thread")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(tmp)
+        logging.getLogger().setLevel(args.log_level)
+        seed(bot, args.users, args.channels)
+        try:
+            status = asyncio.run(main(bot, args))
+        finally:
+            bot.db.close()
+            os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(status)
@@ -1,11 +1,34 @@
 import sqlite3
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.enums import ParseMode
+import asyncio
+import io
 import logging
+import os
 from datetime import datetime
 import signal
 import sys
+import time
+
+from broadcast import BroadcastManager, format_job_status, init_broadcast_tables
+from cache import TTLCache
+from db import Database, ensure_column
+from export import EXPORTS, export_table
+from ledger import (balance_as_of, init_ledger_tables, reconcile_loop, set_balance, set_rate,
+                    snapshot_loop)
+from logs import setup_logging
+from loopwatch import LoopWatchdog
+from metrics import REGISTRY, serve as serve_metrics
+from outbox import PRIORITY_ADMIN, PRIORITY_NOTICE, Outbox, init_outbox_tables
+from payout import init_payout_tables, process_run, start_run
+from profiling import Profiler
+from phones import check_list, delete_submission, format_duplicate_stats, init_number_tables, store_submission
+from ratelimit import FloodGuard
+from router import Router
+from state import MemoryStateStore, SQLiteStateStore
+from submissions import approve_submission, reject_submission, review_batch
+from support import add_message, close_ticket, fetch_thread, fetch_tickets, init_support_tables
 
 # Bot configuration
 API_ID=1234567
@@ -13,53 +36,247 @@ API_HASH='API_HASH'
 BOT_TOKEN='TOKEN'
 ADMIN_ID=123456789
 
+# Database configuration
+DB_PATH='bot_db.db'
+DB_POOL_SIZE=4
+# Optional storage tuning: WAL journaling, pragmas (None = SQLite default) and
+# group-committed writes through a background writer thread
+DB_WAL_MODE=False
+DB_SYNCHRONOUS=None         # e.g. 'NORMAL' with WAL
+DB_CACHE_SIZE=None          # pages, or negative KiB (e.g. -20000)
+DB_MMAP_SIZE=None           # bytes
+DB_BATCH_WRITES=False
+DB_BATCH_WINDOW=0.005       # seconds
+
+# Broadcast configuration (Telegram allows ~30 msg/s overall and ~1 msg/s per chat)
+BROADCAST_GLOBAL_RATE=25
+BROADCAST_PER_CHAT_RATE=1
+BROADCAST_CONCURRENCY=8
+BROADCAST_CHUNK_SIZE=200
+
+# Outbound queue: all messages to users and the admin go through one queue with
+# priority lanes (admin replies > approval notices > broadcasts) under the rates above.
+# FloodWait and transient errors are retried; durable mode keeps queued messages in
+# SQLite so they are still sent after a restart.
+OUTBOX_WORKERS=8
+OUTBOX_MAX_RETRIES=5
+OUTBOX_DURABLE=False
+
+# Membership check caching (seconds / entries)
+CHANNELS_CACHE_TTL=600
+MEMBERSHIP_CACHE_TTL=300
+MEMBERSHIP_NEGATIVE_CACHE_TTL=30
+MEMBERSHIP_CACHE_SIZE=50000
+
+# Bot on/off flag is kept in memory; set an interval (seconds) to re-check the
+# database when several processes share it
+BOT_STATUS_REFRESH_INTERVAL=None
+
+# Conversation state: 'memory' or 'sqlite' (survives restarts)
+STATE_BACKEND='memory'
+STATE_TTL=3600              # seconds
+STATE_MAX_ENTRIES=100000
+STATE_SWEEP_INTERVAL=60     # seconds
+STATE_RETRY_DELAY=1         # seconds; first retry after a failed 'sqlite' write, doubled up to the max
+STATE_MAX_RETRY_DELAY=60    # seconds
+
+# Admin user list page size (kept well under Telegram's 4096-character limit)
+USERS_PAGE_SIZE=20
+
+# Support tickets per page in the admin inbox and messages per page in a user's thread
+SUPPORT_PAGE_SIZE=10
+SUPPORT_THREAD_PAGE_SIZE=10
+
+# Review queue: when enabled, new submissions are not sent to the admin one by one;
+# the admin gets at most one "queue has items" notice per interval instead
+REVIEW_QUEUE_MODE=False
+REVIEW_PAGE_SIZE=10
+REVIEW_NOTIFY_INTERVAL=300  # seconds
+
+# Balance accrual: each approved item credits the user's balance at the default rate
+# (seeded once into the item_rates table; change it later with /rate). 0 keeps
+# balances fully manual. A periodic job checks users.balance against the ledger.
+ITEM_RATE=0                        # toman per approved item
+BALANCE_RECONCILE_INTERVAL=3600    # seconds; 0 disables
+BALANCE_SNAPSHOT_INTERVAL=86400    # seconds; bounds the ledger tail read by /balance_at
+
+# Text lists must hold this many valid, distinct numbers; others are rejected on submit
+MIN_LIST_NUMBERS=50
+MAX_LIST_NUMBERS=100
+
+# Anti-flood limits for non-admin users: a general per-user token bucket, per-action
+# quotas as (limit, period in seconds) and a global cap on notifications sent to the admin
+RATE_LIMIT_USER_RATE=1          # updates per second
+RATE_LIMIT_USER_BURST=10
+RATE_LIMIT_QUOTAS={
+    "submission": (20, 3600),   # lists per hour
+    "support": (5, 60),         # support messages per minute
+}
+ADMIN_NOTIFY_RATE=1             # notifications per second
+ADMIN_NOTIFY_BURST=20
+
+# Payout runs (/payout): users with a positive balance are settled in bank-file batches
+PAYOUT_BATCH_SIZE=1000
+PAYOUT_DIR="payouts"
+
+# Logging: size-rotated log file plus console. With LOG_ASYNC, records are queued and
+# formatted/written by a background thread instead of on the event loop.
+LOG_LEVEL=logging.INFO
+LOG_FILE='bot.log'
+LOG_MAX_BYTES=10*1024*1024
+LOG_BACKUP_COUNT=5
+LOG_ASYNC=True
+BROADCAST_LOG_SAMPLE=100    # log one of every N per-recipient broadcast results (1 logs all)
+
+# Runtime profiling (/profile or the admin panel button): cProfile on the event loop,
+# asyncio slow-callback warnings above PROFILE_SLOW_CALLBACK seconds, loop lag and the
+# slowest SQL, sent back as a document. Nothing is hooked while no session is running.
+PROFILE_DEFAULT_SECONDS=30
+PROFILE_MAX_SECONDS=600
+PROFILE_SLOW_CALLBACK=0.1
+
+# Event loop watchdog: loop lag is measured every WATCHDOG_INTERVAL seconds and the loop
+# thread's stack is logged when it stalls longer than WATCHDOG_THRESHOLD (None disables).
+# With WATCHDOG_STRICT, synchronous db.connection() use on the loop thread raises instead
+# of logging a warning (for load tests and development).
+WATCHDOG_INTERVAL=0.1
+WATCHDOG_THRESHOLD=0.5
+WATCHDOG_STRICT=False
+
+# Metrics: Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics (None disables the endpoint)
+METRICS_HOST="127.0.0.1"
+METRICS_PORT=None
+
 # Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+setup_logging(
+    level=LOG_LEVEL,
+    path=LOG_FILE,
+    max_bytes=LOG_MAX_BYTES,
+    backup_count=LOG_BACKUP_COUNT,
+    use_queue=LOG_ASYNC
 )
 logger = logging.getLogger(__name__)
 
 # Initialize bot
 app = Client("my_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 
+# Shared connection pool; queries run on the pool's threads, not on the event loop
+db = Database(
+    DB_PATH,
+    pool_size=DB_POOL_SIZE,
+    wal=DB_WAL_MODE,
+    synchronous=DB_SYNCHRONOUS,
+    cache_size=DB_CACHE_SIZE,
+    mmap_size=DB_MMAP_SIZE,
+    batch_writes=DB_BATCH_WRITES,
+    batch_window=DB_BATCH_WINDOW,
+    strict=WATCHDOG_STRICT
+)
+
+outbox = Outbox(
+    app,
+    db,
+    durable=OUTBOX_DURABLE,
+    global_rate=BROADCAST_GLOBAL_RATE,
+    per_chat_rate=BROADCAST_PER_CHAT_RATE,
+    workers=OUTBOX_WORKERS,
+    max_retries=OUTBOX_MAX_RETRIES
+)
+
+broadcaster = BroadcastManager(
+    app,
+    db,
+    global_rate=BROADCAST_GLOBAL_RATE,
+    per_chat_rate=BROADCAST_PER_CHAT_RATE,
+    concurrency=BROADCAST_CONCURRENCY,
+    chunk_size=BROADCAST_CHUNK_SIZE,
+    outbox=outbox,
+    log_sample=BROADCAST_LOG_SAMPLE
+)
+
+flood_guard = FloodGuard(
+    user_rate=RATE_LIMIT_USER_RATE,
+    user_burst=RATE_LIMIT_USER_BURST,
+    quotas=RATE_LIMIT_QUOTAS,
+    admin_notify_rate=ADMIN_NOTIFY_RATE,
+    admin_notify_burst=ADMIN_NOTIFY_BURST
+)
+
+# عمل مربوط به هر state برای سهمیه‌های FloodGuard
+STATE_ACTIONS = {
+    "waiting_for_content": "submission",
+    "waiting_for_support": "support",
+}
+
+# تسویه حساب در حال اجرا (فقط یک run در هر زمان)
+payout_task = None
+
+# جلسه پروفایل‌گیری در حال اجرا
+profile_task = None
+
+# زمان آخرین اعلان صف بررسی به ادمین (time.monotonic)
+last_review_notice = float("-inf")
+
+# لیست کانال‌های اجباری و نتایج عضویت (user_id, channel_id) -> bool
+channels_cache = TTLCache(maxsize=1, ttl=CHANNELS_CACHE_TTL)
+membership_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+
 # State management
-user_states = {}
+if STATE_BACKEND == 'sqlite':
+    state_store = SQLiteStateStore(db, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES, sweep_interval=STATE_SWEEP_INTERVAL,
+                                   retry_delay=STATE_RETRY_DELAY, max_retry_delay=STATE_MAX_RETRY_DELAY)
+else:
+    state_store = MemoryStateStore(ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES, sweep_interval=STATE_SWEEP_INTERVAL)
+
+# Metrics (زمان handlerها بر اساس کلید مسیر در routerها ثبت می‌شود)
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Handler latency by update type and route", ["type", "route"])
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Unhandled handler errors by update type and route", ["type", "route"])
+RATE_LIMITED = REGISTRY.counter("bot_rate_limited_total", "Updates dropped by the anti-flood middleware", ["type"])
+REGISTRY.gauge("state_store_entries", "Conversation states held in memory", function=lambda: len(state_store))
+REGISTRY.gauge("state_store_approx_bytes", "Approximate memory used by conversation states",
+               function=lambda: state_store.stats()["approx_bytes"])
+REGISTRY.counter("state_store_expired_total", "Conversation states removed after STATE_TTL", function=lambda: state_store.expired)
+REGISTRY.counter("state_store_evicted_total", "Conversation states evicted to stay under STATE_MAX_ENTRIES",
+                 function=lambda: state_store.evicted)
+if isinstance(state_store, SQLiteStateStore):
+    REGISTRY.counter("state_store_write_errors_total", "Failed writes of conversation states to the database",
+                     function=lambda: state_store.write_errors)
+REGISTRY.gauge("membership_cache_entries", "Cached channel membership results", function=lambda: len(membership_cache))
+REGISTRY.counter("membership_cache_hits_total", "Membership cache hits", function=lambda: membership_cache.stats()["hits"])
+REGISTRY.counter("membership_cache_misses_total", "Membership cache misses", function=lambda: membership_cache.stats()["misses"])
+REGISTRY.counter("membership_cache_evictions_total", "Membership cache entries evicted to stay under maxsize",
+                 function=lambda: membership_cache.stats()["evictions"])
+REGISTRY.gauge("outbound_queue_size", "Messages waiting in the outbound queue", function=lambda: outbox.stats()["queued"])
+
+watchdog = LoopWatchdog(interval=WATCHDOG_INTERVAL, threshold=WATCHDOG_THRESHOLD or 0)
+
+# پروفایل‌گیری موقت؛ تعداد آپدیت‌ها از شمارش نمونه‌های bot_handler_seconds خوانده می‌شود
+profiler = Profiler(
+    count_updates=lambda: sum(count for count, _ in HANDLER_SECONDS.collect().values()),
+    slow_callback=PROFILE_SLOW_CALLBACK,
+    watchdog=watchdog if WATCHDOG_THRESHOLD else None
+)
 
 def set_user_state(user_id, state, data=None):
-    user_states[user_id] = {
-        'state': state,
-        'data': data or {},
-        'timestamp': datetime.now()
-    }
-    logger.info(f"Set state for user {user_id}: {state}")
+    state_store.set(user_id, state, data)
+    logger.info("Set state for user %s: %s", user_id, state)
 
 def get_state_data(user_id):
-    if user_id in user_states:
-        return user_states[user_id].get('data', {})
-    return {}
+    entry = state_store.get(user_id)
+    return entry.data if entry else {}
 
 def get_user_state(user_id):
-    if user_id in user_states:
-        # Remove expired states (1 hour timeout)
-        if (datetime.now() - user_states[user_id]['timestamp']).seconds > 3600:
-            del user_states[user_id]
-            return None
-        return user_states[user_id]['state']
-    return None
+    # وضعیت‌های منقضی‌شده (پس از STATE_TTL) None برمی‌گردانند
+    entry = state_store.get(user_id)
+    return entry.state if entry else None
 
 def clear_user_state(user_id):
-    if user_id in user_states:
-        del user_states[user_id]
-        logger.info(f"Cleared state for user {user_id}")
+    if state_store.clear(user_id):
+        logger.info("Cleared state for user %s", user_id)
 
 def init_db():
     try:
-        with sqlite3.connect('bot_db.db') as conn:
+        with db.connection() as conn:
             c = conn.cursor()
             
             # جدول کاربران (بدون تغییر)
@@ -108,6 +325,8 @@ def init_db():
                 id INTEGER PRIMARY KEY DEFAULT 1,
                 is_active BOOLEAN DEFAULT 1
             )''')
+            # شمارنده نسخه برای تشخیص تغییر وضعیت توسط پردازه‌های دیگر
+            ensure_column(conn, "bot_status", "version", "INTEGER DEFAULT 0")
             
             # جدول کانال‌های اجباری (بدون تغییر)
             c.execute('''CREATE TABLE IF NOT EXISTS required_channels (
@@ -117,67 +336,137 @@ def init_db():
                 invite_link TEXT
             )''')
             
+            # جداول ارسال همگانی (job و وضعیت تحویل هر کاربر)
+            init_broadcast_tables(c)
+            
+            # صف پایدار پیام‌های خروجی
+            init_outbox_tables(c)
+            
+            # جدول نرخ آیتم‌ها و دفتر تراکنش‌های موجودی
+            init_ledger_tables(c, ITEM_RATE)
+            
+            # جداول تسویه حساب
+            init_payout_tables(c)
+            
+            # ایندکس شماره‌های لیست‌ها برای تشخیص تکراری‌ها
+            init_number_tables(c)
+            
+            # تیکت‌های پشتیبانی و ایندکس گفتگوی هر کاربر
+            init_support_tables(c)
+            
             # ایجاد ایندکس‌ها
             c.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON submissions(user_id)')
-            c.execute('CREATE INDEX IF NOT EXISTS idx_support_user_id ON support_messages(user_id)')
             c.execute('CREATE INDEX IF NOT EXISTS idx_submission_details ON submission_details(submission_id)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_submissions_status_submitted ON submissions(status, submitted_at)')
+            # تعداد پیشنهادی اعتبارسنجی برای تأیید لیست‌های متنی
+            ensure_column(conn, "submissions", "suggested_items", "INTEGER")
             
             # مقداردهی اولیه bot_status
             c.execute("INSERT OR IGNORE INTO bot_status (id, is_active) VALUES (1, 1)")
-            conn.commit()
+            c.execute("SELECT is_active, version FROM bot_status WHERE id = 1")
+            bot_status.set(*c.fetchone())
+            
+            # بازیابی وضعیت گفتگوهای نیمه‌تمام
+            if isinstance(state_store, SQLiteStateStore):
+                state_store.load(conn)
     except sqlite3.Error as e:
-        logger.error(f"Database initialization error: {e}")
+        logger.error("Database initialization error: %s", e)
         raise
 
 def add_required_channel(channel_id, channel_name, invite_link):
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute(
+        with db.connection() as conn:
+            conn.execute(
                 "INSERT OR REPLACE INTO required_channels (channel_id, channel_name, invite_link) VALUES (?, ?, ?)",
                 (channel_id, channel_name, invite_link)
             )
-            conn.commit()
-            logger.info(f"Added required channel: {channel_name} ({channel_id})")
+        channels_cache.clear()
+        logger.info("Added required channel: %s (%s)", channel_name, channel_id)
     except sqlite3.Error as e:
-        logger.error(f"Error adding required channel: {e}")
+        logger.error("Error adding required channel: %s", e)
 
 # مثال: اضافه کردن کانال
 # add_required_channel("-1001234567890", "YourChannel", "https://t.me/YourChannel")
 
+async def get_required_channels():
+    channels = channels_cache.get("channels")
+    if channels is None:
+        channels = await db.fetchall("SELECT channel_id, channel_name, invite_link FROM required_channels")
+        channels_cache.set("channels", channels)
+    return channels
+
+async def is_channel_member(client, channel_id, user_id):
+    key = (user_id, channel_id)
+    cached = membership_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    try:
+        member = await client.get_chat_member(int(channel_id), user_id)
+        is_member = member.status not in ["left", "kicked"]
+    except Exception as e:
+        # خطاها کش نمی‌شوند تا در درخواست بعدی دوباره بررسی شوند
+        logger.error("Error checking membership for channel %s: %s", channel_id, e)
+        return False
+    
+    membership_cache.set(key, is_member, None if is_member else MEMBERSHIP_NEGATIVE_CACHE_TTL)
+    return is_member
+
+async def invalidate_membership(user_id):
+    for channel_id, _, _ in await get_required_channels():
+        membership_cache.pop((user_id, channel_id))
+
 async def check_membership(client, user_id):
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT channel_id, channel_name, invite_link FROM required_channels")
-            channels = c.fetchall()
+        channels = await get_required_channels()
+        if not channels:
+            return True, None, None
         
-        for channel_id, channel_name, invite_link in channels:
-            try:
-                member = await client.get_chat_member(int(channel_id), user_id)
-                if member.status in ["left", "kicked"]:
-                    return False, channel_name, invite_link
-            except Exception as e:
-                logger.error(f"Error checking membership for channel {channel_id}: {e}")
+        # بررسی همه کانال‌ها به صورت همزمان؛ اولین کانالی که عضو نیست گزارش می‌شود
+        results = await asyncio.gather(*(
+            is_channel_member(client, channel_id, user_id) for channel_id, _, _ in channels
+        ))
+        for (channel_id, channel_name, invite_link), is_member in zip(channels, results):
+            if not is_member:
                 return False, channel_name, invite_link
         
         return True, None, None
     except sqlite3.Error as e:
-        logger.error(f"Database error in check_membership: {e}")
+        logger.error("Database error in check_membership: %s", e)
         return False, None, None
 
 # Check bot status
-def is_bot_active():
-    try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT is_active FROM bot_status WHERE id = 1")
-            result = c.fetchone()
-            return bool(result[0]) if result else True
-    except sqlite3.Error as e:
-        logger.error(f"Database error in is_bot_active: {e}")
+class BotStatus:
+    # وضعیت روشن/خاموش ربات در حافظه؛ یک بار در init_db بارگذاری و با
+    # handle_toggle_bot به‌روزرسانی می‌شود
 
-        return False
+    def __init__(self):
+        self.active = True
+        self.version = 0
+
+    def set(self, active, version):
+        if version != self.version or bool(active) != self.active:
+            logger.info("Bot status set: active=%s, version=%s", bool(active), version)
+        self.active = bool(active)
+        self.version = version
+
+    async def refresh(self):
+        try:
+            row = await db.fetchone("SELECT is_active, version FROM bot_status WHERE id = 1")
+            if row and row[1] != self.version:
+                self.set(*row)
+        except sqlite3.Error as e:
+            logger.error("Database error in bot status refresh: %s", e)
+
+    async def refresh_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh()
+
+bot_status = BotStatus()
+
+def is_bot_active():
+    return bot_status.active
     
 async def handle_reset_approved_count(client:Client, callback_query):
     await callback_query.message.reply(
@@ -185,55 +474,84 @@ async def handle_reset_approved_count(client:Client, callback_query):
         f"مثال: {callback_query.from_user.id}"
     )
     set_user_state(callback_query.from_user.id, "waiting_for_reset_approved")
-    await callback_query.answer()
 
 async def handle_reset_approved_count_process(client, message):
     try:
         user_id = int(message.text.strip())
         
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            # بررسی وجود کاربر
-            c.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-            if not c.fetchone():
-                await message.reply(f"❌ کاربر با شناسه {user_id} یافت نشد.")
-                return
-            
-            # صفر کردن تعداد تأیید شده‌ها
-            c.execute(
-                "UPDATE users SET approved_count = 0 WHERE user_id = ?",
-                (user_id,)
-            )
-            conn.commit()
+        # صفر کردن تعداد تأیید شده‌ها (rowcount صفر یعنی کاربر وجود ندارد)
+        _, updated = await db.execute(
+            "UPDATE users SET approved_count = 0 WHERE user_id = ?",
+            (user_id,)
+        )
+        if not updated:
+            await message.reply(f"❌ کاربر با شناسه {user_id} یافت نشد.")
+            return
         
         await message.reply(f"✅ تعداد تأیید شده‌های کاربر {user_id} با موفقیت صفر شد.")
         clear_user_state(message.from_user.id)
         
         # اطلاع‌رسانی به کاربر
         try:
-            await client.send_message(
+            await outbox.send_message(
                 user_id,
-                "🔄 تعداد تأیید شده‌های شما توسط ادمین صفر شد."
+                "🔄 تعداد تأیید شده‌های شما توسط ادمین صفر شد.",
+                priority=PRIORITY_ADMIN, wait=False
             )
-            logger.info(f"User {user_id} notified of approved count reset")
+            logger.info("User %s notified of approved count reset", user_id)
         except Exception as e:
-            logger.error(f"Error notifying user {user_id}: {e}")
+            logger.error("Error notifying user %s: %s", user_id, e)
             await message.reply(f"❌ خطا در ارسال پیام به کاربر {user_id}: {str(e)}")
         
     except ValueError:
         await message.reply("❌ فرمت نامعتبر. لطفاً یک ID معتبر وارد کنید (مثال: 12345)")
     except sqlite3.Error as e:
-        logger.error(f"Database error in reset approved count: {e}")
+        logger.error("Database error in reset approved count: %s", e)
         await message.reply("❌ خطای پایگاه داده.")
     except Exception as e:
-        logger.error(f"Error in reset approved count: {e}")
+        logger.error("Error in reset approved count: %s", e)
         await message.reply("❌ خطایی رخ داد.")
 
+# Rate limiting middleware: group -1 runs before every other handler; limited updates
+# stop here, so they cost no DB query and no admin notification
+@app.on_message(filters.private & ~filters.user(ADMIN_ID), group=-1)
+async def limit_messages(client, message):
+    user_id = message.from_user.id
+    action = STATE_ACTIONS.get(get_user_state(user_id))
+    if flood_guard.allow(user_id, action):
+        return
+    RATE_LIMITED.labels("message").inc()
+    logger.warning("Rate limited message from user %s (action: %s)", user_id, action)
+    if flood_guard.should_warn(user_id):
+        wait = flood_guard.retry_after(user_id, action)
+        await message.reply(f"⏳ تعداد درخواست‌های شما زیاد است. لطفاً {wait:.0f} ثانیه دیگر تلاش کنید.")
+    message.stop_propagation()
+
+@app.on_callback_query(~filters.user(ADMIN_ID), group=-1)
+async def limit_callbacks(client, callback_query):
+    user_id = callback_query.from_user.id
+    if flood_guard.allow(user_id):
+        return
+    RATE_LIMITED.labels("callback").inc()
+    logger.warning("Rate limited callback from user %s", user_id)
+    await callback_query.answer("⏳ لطفاً کمی صبر کنید.", show_alert=flood_guard.should_warn(user_id))
+    callback_query.stop_propagation()
+
+# Limits command: /limits
+@app.on_message(filters.command("limits") & filters.user(ADMIN_ID) & filters.private)
+@HANDLER_SECONDS.time("command", "limits")
+async def limits_command(client, message):
+    lines = ["🚦 محدودیت نرخ:"]
+    for name, counters in flood_guard.stats().items():
+        lines.append(f"{name}: " + ", ".join(f"{key}={value}" for key, value in counters.items()))
+    await message.reply("\n".join(lines))
+
 # Start command
 @app.on_message(filters.command("start") & filters.private)
+@HANDLER_SECONDS.time("command", "start")
 async def start(client, message):
     user_id = message.from_user.id
-    logger.info(f"Start command from user {user_id}")
+    logger.info("Start command from user %s", user_id)
     
     if not is_bot_active():
         await message.reply("❌ ربات در حال حاضر غیرفعال است.")
@@ -255,25 +573,44 @@ async def start(client, message):
         return
     
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            user = c.fetchone()
-            
-            if not user:
-                keyboard = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📝 ثبت نام", callback_data="register")]
-                ])
-                await message.reply(
-                    "👋 به ربات خوش آمدید! لطفاً ثبت نام کنید.",
-                    reply_markup=keyboard
-                )
-            else:
-                await show_main_menu(message)
+        user = await db.fetchone("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
+        
+        if not user:
+            keyboard = InlineKeyboardMarkup([
+                [InlineKeyboardButton("📝 ثبت نام", callback_data="register")]
+            ])
+            await message.reply(
+                "👋 به ربات خوش آمدید! لطفاً ثبت نام کنید.",
+                reply_markup=keyboard
+            )
+        else:
+            await show_main_menu(message)
     except sqlite3.Error as e:
-        logger.error(f"Database error in start: {e}")
+        logger.error("Database error in start: %s", e)
         await message.reply("❌ خطایی رخ داد. لطفاً دوباره تلاش کنید.")
 
+async def handle_check_membership(client, callback_query):
+    user_id = callback_query.from_user.id
+    
+    # کاربر اعلام کرده عضو شده است؛ نتایج کش‌شده قبلی معتبر نیستند
+    await invalidate_membership(user_id)
+    is_member, channel_name, _ = await check_membership(client, user_id)
+    if not is_member:
+        await callback_query.answer(f"❌ هنوز در کانال {channel_name} عضو نشده‌اید.", show_alert=True)
+        return
+    await callback_query.answer()
+    
+    clear_user_state(user_id)
+    if await db.fetchone("SELECT user_id FROM users WHERE user_id = ?", (user_id,)):
+        await show_main_menu(callback_query.message)
+    else:
+        await callback_query.message.reply(
+            "👋 به ربات خوش آمدید! لطفاً ثبت نام کنید.",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📝 ثبت نام", callback_data="register")]
+            ])
+        )
+
 # Main menu
 async def show_main_menu(message):
     keyboard = InlineKeyboardMarkup([
@@ -288,49 +625,108 @@ async def show_main_menu(message):
 
 # Admin panel
 @app.on_message(filters.command("admin") & filters.user(ADMIN_ID) & filters.private)
+@HANDLER_SECONDS.time("command", "admin")
 async def admin_panel(client, message):
-    logger.info(f"Admin command from {message.from_user.id}")
+    logger.info("Admin command from %s", message.from_user.id)
     await show_admin_panel(message)
 
 async def show_admin_panel(message):
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            
-            c.execute("SELECT COUNT(*) FROM users")
-            user_count = c.fetchone()[0]
-            
-            c.execute("SELECT is_active FROM bot_status WHERE id = 1")
-            bot_status = "آنلاین" if c.fetchone()[0] else "آفلاین"
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton(f"👥 کاربران ({user_count})", callback_data="view_users"),
-                InlineKeyboardButton(f"🤖 وضعیت ربات: {bot_status}", callback_data="toggle_bot")],
-
-                [InlineKeyboardButton("💸 مدیریت موجودی", callback_data="manage_balances"),
-                InlineKeyboardButton("🔄 صفر کردن تعداد تأیید شده‌ها", callback_data="reset_approved_count")],
-
-                [InlineKeyboardButton("📨 پیام‌های پشتیبانی", callback_data="view_support"),
-                InlineKeyboardButton("📢 ارسال پیام همگانی", callback_data="broadcast_message")],
-                [InlineKeyboardButton("📩 ارسال پیام شخصی", callback_data="private_message")]
-            ])
-            
-            await message.reply("🔧 پنل ادمین", reply_markup=keyboard)
+        user_count = (await db.fetchone("SELECT COUNT(*) FROM users"))[0]
+        status_text = "آنلاین" if is_bot_active() else "آفلاین"
+        
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"👥 کاربران ({user_count})", callback_data="view_users"),
+            InlineKeyboardButton(f"🤖 وضعیت ربات: {status_text}", callback_data="toggle_bot")],
+
+            [InlineKeyboardButton("💸 مدیریت موجودی", callback_data="manage_balances"),
+            InlineKeyboardButton("🔄 صفر کردن تعداد تأیید شده‌ها", callback_data="reset_approved_count")],
+
+            [InlineKeyboardButton("📨 پیام‌های پشتیبانی", callback_data="view_support"),
+            InlineKeyboardButton("📢 ارسال پیام همگانی", callback_data="broadcast_message")],
+            [InlineKeyboardButton("📩 ارسال پیام شخصی", callback_data="private_message"),
+            InlineKeyboardButton("📊 وضعیت ارسال‌ها", callback_data="job_list")],
+            [InlineKeyboardButton("🗂 صف بررسی", callback_data="review_queue"),
+            InlineKeyboardButton("⏹ توقف پروفایل" if profiling_active() else "⏱ پروفایل‌گیری", callback_data="profile_toggle")]
+        ])
+        
+        await message.reply("🔧 پنل ادمین", reply_markup=keyboard)
     except sqlite3.Error as e:
-        logger.error(f"Database error in admin panel: {e}")
+        logger.error("Database error in admin panel: %s", e)
         await message.reply("❌ خطای پایگاه داده.")
 
+async def run_profile(client, chat_id, seconds, updates=None):
+    try:
+        report, summary = await profiler.run(seconds, updates)
+        await client.send_document(
+            chat_id,
+            document=io.BytesIO(report.encode("utf-8")),
+            file_name=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+            caption=summary
+        )
+    except Exception as e:
+        logger.error("Profiling session failed: %s", e)
+        await outbox.send_message(chat_id, "❌ خطا در پروفایل‌گیری.", priority=PRIORITY_NOTICE)
+
+def profiling_active():
+    return profile_task is not None and not profile_task.done()
+
+def spawn_profile(client, chat_id, seconds, updates=None):
+    global profile_task
+    profile_task = asyncio.ensure_future(run_profile(client, chat_id, min(seconds, PROFILE_MAX_SECONDS), updates))
+
+# Profile command: /profile [seconds] | /profile updates <N> | /profile stop
+@app.on_message(filters.command("profile") & filters.user(ADMIN_ID) & filters.private)
+@HANDLER_SECONDS.time("command", "profile")
+async def profile_command(client, message):
+    args = message.command[1:]
+    if args and args[0] == "stop":
+        if not profiling_active():
+            await message.reply("ℹ️ پروفایل‌گیری فعال نیست.")
+            return
+        profiler.stop()
+        await message.reply("⏹ پروفایل‌گیری متوقف شد؛ گزارش ارسال می‌شود.")
+        return
+    if profiling_active():
+        await message.reply("⏳ یک پروفایل‌گیری در حال انجام است. /profile stop")
+        return
+    try:
+        if args and args[0] == "updates":
+            updates, seconds = int(args[1]), PROFILE_MAX_SECONDS
+        else:
+            updates, seconds = None, int(args[0]) if args else PROFILE_DEFAULT_SECONDS
+        if seconds <= 0 or (updates is not None and updates <= 0):
+            raise ValueError("non-positive")
+    except (ValueError, IndexError):
+        await message.reply(
+            "⏱ پروفایل‌گیری:\n"
+            "/profile [ثانیه]\n/profile updates <تعداد آپدیت>\n/profile stop\n"
+            f"مثال: /profile 60 (حداکثر {PROFILE_MAX_SECONDS} ثانیه)"
+        )
+        return
+    spawn_profile(client, message.chat.id, seconds, updates)
+    limit = f"{updates} آپدیت" if updates else f"{min(seconds, PROFILE_MAX_SECONDS)} ثانیه"
+    await message.reply(f"⏱ پروفایل‌گیری برای {limit} شروع شد.")
+    logger.info("Profiling started by admin %s (%s)", message.from_user.id, limit)
+
+async def handle_profile_toggle(client, callback_query):
+    if profiling_active():
+        profiler.stop()
+        await callback_query.message.reply("⏹ پروفایل‌گیری متوقف شد؛ گزارش ارسال می‌شود.")
+        return
+    spawn_profile(client, callback_query.message.chat.id, PROFILE_DEFAULT_SECONDS)
+    await callback_query.message.reply(f"⏱ پروفایل‌گیری برای {PROFILE_DEFAULT_SECONDS} ثانیه شروع شد. /profile stop")
+    logger.info("Profiling started by admin %s", callback_query.from_user.id)
+
 async def handle_broadcast_message(client, callback_query):
     await callback_query.message.reply("📢 لطفاً متن پیام همگانی را وارد کنید:")
     set_user_state(callback_query.from_user.id, "waiting_for_broadcast")
-    await callback_query.answer()
 
 async def handle_private_message(client, callback_query):
     await callback_query.message.reply(
         "📩 لطفاً شناسه کاربر (ID) یا نام کامل (نام و نام خانوادگی) را وارد کنید:"
     )
     set_user_state(callback_query.from_user.id, "waiting_for_private_user")
-    await callback_query.answer()
 
 async def handle_broadcast(client, message):
     admin_id = message.from_user.id
@@ -343,28 +739,16 @@ async def handle_broadcast(client, message):
             await message.reply("❌ متن پیام نمی‌تواند خالی باشد. لطفاً دوباره وارد کنید:")
             return
 
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT user_id FROM users")
-            users = c.fetchall()
-
-        success_count = 0
-        for user in users:
-            try:
-                await client.send_message(user[0], f"📢 اطلاعیه:\n\n{broadcast_text}")
-                success_count += 1
-                logger.info(f"Broadcast sent to user {user[0]}")
-            except Exception as e:
-                logger.error(f"Failed to send broadcast to user {user[0]}: {e}")
-
-        await message.reply(f"✅ پیام همگانی به {success_count} کاربر ارسال شد.")
+        # ارسال در پس‌زمینه انجام می‌شود و پیشرفت آن در یک پیام جداگانه به‌روزرسانی می‌شود
         clear_user_state(admin_id)
+        job_id = await broadcaster.start_job(message.chat.id, f"📢 اطلاعیه:\n\n{broadcast_text}")
+        await message.reply(f"✅ ارسال همگانی #{job_id} در صف قرار گرفت.")
 
     except sqlite3.Error as e:
-        logger.error(f"Database error in broadcast: {e}")
+        logger.error("Database error in broadcast: %s", e)
         await message.reply("❌ خطای پایگاه داده.")
     except Exception as e:
-        logger.error(f"Error in broadcast: {e}")
+        logger.error("Error in broadcast: %s", e)
         await message.reply("❌ خطا در ارسال پیام همگانی.")
 
 async def handle_private_user(client, message):
@@ -376,42 +760,41 @@ async def handle_private_user(client, message):
         user_input = message.text.strip()
         target_user_id = None
 
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
+        # بررسی اگر ورودی ID عددی است
+        try:
+            target_user_id = int(user_input)
+        except ValueError:
+            target_user_id = None
+
+        if target_user_id is not None:
+            if not await db.fetchone("SELECT user_id FROM users WHERE user_id = ?", (target_user_id,)):
+                await message.reply(f"❌ کاربر با شناسه {target_user_id} یافت نشد.")
+                return
+        else:
+            # جستجو بر اساس نام
+            name_parts = user_input.split()
+            if len(name_parts) < 2:
+                await message.reply("❌ لطفاً نام کامل (نام و نام خانوادگی) را وارد کنید.")
+                return
             
-            # بررسی اگر ورودی ID عددی است
-            try:
-                target_user_id = int(user_input)
-                c.execute("SELECT user_id FROM users WHERE user_id = ?", (target_user_id,))
-                if not c.fetchone():
-                    await message.reply(f"❌ کاربر با شناسه {target_user_id} یافت نشد.")
-                    return
-            except ValueError:
-                # جستجو بر اساس نام
-                name_parts = user_input.split()
-                if len(name_parts) < 2:
-                    await message.reply("❌ لطفاً نام کامل (نام و نام خانوادگی) را وارد کنید.")
-                    return
-                
-                first_name, last_name = name_parts[0], " ".join(name_parts[1:])
-                c.execute(
-                    "SELECT user_id FROM users WHERE first_name = ? AND last_name = ?",
-                    (first_name, last_name)
-                )
-                user = c.fetchone()
-                if not user:
-                    await message.reply(f"❌ کاربر با نام {user_input} یافت نشد.")
-                    return
-                target_user_id = user[0]
+            first_name, last_name = name_parts[0], " ".join(name_parts[1:])
+            user = await db.fetchone(
+                "SELECT user_id FROM users WHERE first_name = ? AND last_name = ?",
+                (first_name, last_name)
+            )
+            if not user:
+                await message.reply(f"❌ کاربر با نام {user_input} یافت نشد.")
+                return
+            target_user_id = user[0]
 
         await message.reply("📩 لطفاً متن پیام را وارد کنید:")
         set_user_state(admin_id, "waiting_for_private_message", {"target_user_id": target_user_id})
 
     except sqlite3.Error as e:
-        logger.error(f"Database error in private user: {e}")
+        logger.error("Database error in private user: %s", e)
         await message.reply("❌ خطای پایگاه داده.")
     except Exception as e:
-        logger.error(f"Error in private user: {e}")
+        logger.error("Error in private user: %s", e)
         await message.reply("❌ خطا در پردازش.")
 
 async def handle_private_message_send(client, message):
@@ -432,17 +815,17 @@ async def handle_private_message_send(client, message):
 
         # ارسال پیام به کاربر
         try:
-            await client.send_message(target_user_id, f"📩 پیام از ادمین:\n\n{message_text}")
+            await outbox.send_message(target_user_id, f"📩 پیام از ادمین:\n\n{message_text}", priority=PRIORITY_ADMIN)
             await message.reply(f"✅ پیام به کاربر {target_user_id} ارسال شد.")
-            logger.info(f"Private message sent to user {target_user_id}")
+            logger.info("Private message sent to user %s", target_user_id)
         except Exception as e:
-            logger.error(f"Failed to send private message to user {target_user_id}: {e}")
+            logger.error("Failed to send private message to user %s: %s", target_user_id, e)
             await message.reply(f"❌ خطا در ارسال پیام به کاربر {target_user_id}.")
 
         clear_user_state(admin_id)
 
     except Exception as e:
-        logger.error(f"Error in private message send: {e}")
+        logger.error("Error in private message send: %s", e)
         await message.reply("❌ خطا در ارسال پیام.")
 
 # Callback query handler
@@ -450,111 +833,68 @@ async def handle_private_message_send(client, message):
 async def handle_callback(client, callback_query):
     data = callback_query.data
     user_id = callback_query.from_user.id
+    route = None
     
     try:
-        await callback_query.answer()
+        route = callback_router.resolve(data, user_id)
+        # هر callback دقیقاً یک بار پاسخ می‌گیرد: اینجا، یا در خود handler برای
+        # مسیرهای answers=True
+        if route is None or not route.answers:
+            await callback_query.answer()
+        if route is None:
+            return
         
-        if not is_bot_active() and data != "toggle_bot":
+        # مدیریت ربات و ارسال‌های پس‌زمینه حتی در حالت آفلاین هم در دسترس است
+        if not route.offline and not is_bot_active():
+            if route.answers:
+                await callback_query.answer()
             return
 
-        if data == "register":
-            await handle_register(callback_query)
-        elif data == "submit_content":
-            await handle_submit_content(client, callback_query)
-        elif data == "my_profile":
-            await handle_my_profile(callback_query)
-        elif data == "edit_profile":
-            await handle_edit_profile(client, callback_query)
-        elif data == "back_to_main":
-            await show_main_menu(callback_query.message)
-        elif data == "support":
-            await handle_support_callback(client, callback_query)
-        elif data == "check_balance":
-            await handle_check_balance(client, callback_query)
-        elif data == "toggle_bot" and user_id == ADMIN_ID:
-            await handle_toggle_bot(client, callback_query)
-        elif data == "view_users" and user_id == ADMIN_ID:
-            await handle_view_users(client, callback_query)
-        elif data == "manage_balances" and user_id == ADMIN_ID:
-            await handle_manage_balances(client, callback_query)
-        elif data == "view_support" and user_id == ADMIN_ID:
-            await handle_view_support(client, callback_query)
-        elif data == "cancel_reply":
-            await handle_cancel_reply(client, callback_query)
-        elif data == "broadcast_message" and user_id == ADMIN_ID:
-            await handle_broadcast_message(client, callback_query)
-        elif data == "private_message" and user_id == ADMIN_ID:
-            await handle_private_message(client, callback_query)
-        elif data.startswith("reply_"):
-            await handle_reply_callback(client, callback_query)
-        elif data.startswith("approve_") or data.startswith("reject_"):
-            await handle_content_approval(client, callback_query)
-        elif data == "edit_first_name":
-            await callback_query.message.reply("✏️ لطفاً نام جدید خود را وارد کنید:")
-            set_user_state(user_id, "editing_first_name")
-        elif data == "edit_last_name":
-            await callback_query.message.reply("✏️ لطفاً نام خانوادگی جدید خود را وارد کنید:")
-            set_user_state(user_id, "editing_last_name")
-        elif data == "edit_group_leader":
-            await callback_query.message.reply("✏️ لطفاً نام سرگروه جدید خود را وارد کنید:")
-            set_user_state(user_id, "editing_group_leader")
-        elif data == "edit_card_or_wallet":
-            await callback_query.message.reply("💳 لطفاً شماره کارت یا آدرس کیف پول جدید خود را وارد کنید:")
-            set_user_state(user_id, "editing_card_or_wallet")
-        elif data == "edit_sheba":
-            await callback_query.message.reply("🏦 لطفاً شماره شبا جدید خود را وارد کنید:")
-            set_user_state(user_id, "editing_sheba")
-        elif data == "reset_approved_count" and user_id == ADMIN_ID:
-            await handle_reset_approved_count(client, callback_query)
+        start = time.perf_counter()
+        try:
+            await route.handler(client, callback_query)
+        finally:
+            HANDLER_SECONDS.labels("callback", route.key).observe(time.perf_counter() - start)
 
     except Exception as e:
-        logger.error(f"Error in callback {data}: {e}")
+        HANDLER_ERRORS.labels("callback", route.key if route else "").inc()
+        logger.error("Error in callback %s: %s", data, e)
 
 async def handle_edit_profile(client, callback_query):
     user_id = callback_query.from_user.id
     
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            user = c.fetchone()
-            
-            if not user:
-                await callback_query.message.reply("❌ شما هنوز ثبت نام نکرده‌اید!")
-                return
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("✏️ ویرایش نام", callback_data="edit_first_name")],
-                [InlineKeyboardButton("✏️ ویرایش نام خانوادگی", callback_data="edit_last_name")],
-                [InlineKeyboardButton("✏️ ویرایش نام سرگروه", callback_data="edit_group_leader")],
-                [InlineKeyboardButton("💳 ویرایش شماره کارت یا آدرس کیف پول", callback_data="edit_card_or_wallet")],
-                [InlineKeyboardButton("🏦 ویرایش شماره شبا", callback_data="edit_sheba")],
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")]
-            ])
-            
-            await callback_query.message.reply("✏️ لطفاً بخشی که می‌خواهید ویرایش کنید را انتخاب کنید:", reply_markup=keyboard)
-            await callback_query.answer()
+        user = await db.fetchone("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
+        
+        if not user:
+            await callback_query.message.reply("❌ شما هنوز ثبت نام نکرده‌اید!")
+            return
+        
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("✏️ ویرایش نام", callback_data="edit_first_name")],
+            [InlineKeyboardButton("✏️ ویرایش نام خانوادگی", callback_data="edit_last_name")],
+            [InlineKeyboardButton("✏️ ویرایش نام سرگروه", callback_data="edit_group_leader")],
+            [InlineKeyboardButton("💳 ویرایش شماره کارت یا آدرس کیف پول", callback_data="edit_card_or_wallet")],
+            [InlineKeyboardButton("🏦 ویرایش شماره شبا", callback_data="edit_sheba")],
+            [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")]
+        ])
+        
+        await callback_query.message.reply("✏️ لطفاً بخشی که می‌خواهید ویرایش کنید را انتخاب کنید:", reply_markup=keyboard)
             
     except sqlite3.Error as e:
-        logger.error(f"Database error in edit profile: {e}")
+        logger.error("Database error in edit profile: %s", e)
         await callback_query.message.reply("❌ خطای پایگاه داده.")
-        await callback_query.answer()
 
 # Registration handlers
 async def handle_register(callback_query):
     user_id = callback_query.from_user.id
     
-    with sqlite3.connect('bot_db.db') as conn:
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        if c.fetchone():
-            await callback_query.message.reply("✅ شما قبلاً ثبت نام کرده‌اید!")
-            await show_main_menu(callback_query.message)
-        else:
-            await callback_query.message.reply("📝 لطفاً نام خود را وارد کنید:")
-            set_user_state(user_id, "waiting_for_first_name")
-    
-    await callback_query.answer()
+    if await db.fetchone("SELECT user_id FROM users WHERE user_id = ?", (user_id,)):
+        await callback_query.message.reply("✅ شما قبلاً ثبت نام کرده‌اید!")
+        await show_main_menu(callback_query.message)
+    else:
+        await callback_query.message.reply("📝 لطفاً نام خود را وارد کنید:")
+        set_user_state(user_id, "waiting_for_first_name")
 
 # Content submission handlers
 async def handle_submit_content(client, callback_query):
@@ -563,51 +903,49 @@ async def handle_submit_content(client, callback_query):
         await callback_query.message.reply("📤 لطفاً لیست شماره های خود را ارسال کنید.\n"
                                            "(توجه لیست شما باید شماره های سالم و چک شده باشد همچنین کمتر از 50 شماره و بیشتر از 100 شماره در یک لیست تایید نخواهد شد.)❌")
         set_user_state(user_id, "waiting_for_content")
-        await callback_query.answer()  # پاسخ به callback
     except Exception as e:
-        logger.error(f"Error in submit content callback: {e}")
-        # فقط اگر خطا مربوط به callback نباشد، پاسخ دهیم
-        if "QUERY_ID_INVALID" not in str(e):
-            try:
-                await callback_query.answer("❌ خطا در پردازش ارسال شماره", show_alert=True)
-            except Exception as inner_e:
-                logger.error(f"Failed to send error response for submit_content: {inner_e}")
+        logger.error("Error in submit content callback: %s", e)
+        try:
+            await callback_query.answer("❌ خطا در پردازش ارسال شماره", show_alert=True)
+        except Exception as inner_e:
+            logger.error("Failed to send error response for submit_content: %s", inner_e)
         # ارسال پیام خطا به کاربر
         try:
             await callback_query.message.reply("❌ خطایی رخ داد. لطفاً دوباره تلاش کنید.")
         except Exception as reply_e:
-            logger.error(f"Failed to reply to user {user_id}: {reply_e}")
+            logger.error("Failed to reply to user %s: %s", user_id, reply_e)
+        return
+    await callback_query.answer()  # پاسخ به callback
 
 # Profile handlers
 async def handle_my_profile(callback_query):
     user_id = callback_query.from_user.id
     
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            user = c.fetchone()
-            
-            if user:
-                profile_text = (
-                    f"📋 پروفایل\n\n"
-                    f"نام: {user[1]}\n"
-                    f"نام خانوادگی: {user[2]}\n"
-                    f"نام سرگروه: {user[5] or 'مشخص نشده'}\n"
-                    f"شماره کارت یا آدرس کیف پول: {user[3] or 'مشخص نشده'}\n"
-                    f"شماره شبا: {user[4] or 'مشخص نشده'}\n"
-                    f"موجودی: {user[6]:,.0f} تومان\n"
-                    f"تعداد شماره تایید شده: {user[7]}\n"
-                    f"تاریخ ثبت نام: {user[8]}"
-                )
-                await callback_query.message.reply(profile_text)
-            else:
-                await callback_query.message.reply("❌ کاربر یافت نشد.")
+        user = await db.fetchone(
+            "SELECT user_id, first_name, last_name, card_or_wallet, sheba_number, group_leader_name, "
+            "balance, approved_count, registered_at FROM users WHERE user_id = ?",
+            (user_id,)
+        )
+        
+        if user:
+            profile_text = (
+                f"📋 پروفایل\n\n"
+                f"نام: {user[1]}\n"
+                f"نام خانوادگی: {user[2]}\n"
+                f"نام سرگروه: {user[5] or 'مشخص نشده'}\n"
+                f"شماره کارت یا آدرس کیف پول: {user[3] or 'مشخص نشده'}\n"
+                f"شماره شبا: {user[4] or 'مشخص نشده'}\n"
+                f"موجودی: {user[6]:,.0f} تومان\n"
+                f"تعداد شماره تایید شده: {user[7]}\n"
+                f"تاریخ ثبت نام: {user[8]}"
+            )
+            await callback_query.message.reply(profile_text)
+        else:
+            await callback_query.message.reply("❌ کاربر یافت نشد.")
     except sqlite3.Error as e:
-        logger.error(f"Database error in profile: {e}")
+        logger.error("Database error in profile: %s", e)
         await callback_query.message.reply("❌ خطای پایگاه داده.")
-    
-    await callback_query.answer()
 
 # Support handlers
 async def handle_support_callback(client, callback_query):
@@ -615,108 +953,335 @@ async def handle_support_callback(client, callback_query):
         user_id = callback_query.from_user.id
         await callback_query.message.reply("💬 لطفاً پیام خود را برای پشتیبانی ارسال کنید:")
         set_user_state(user_id, "waiting_for_support")
-        await callback_query.answer()
     except Exception as e:
-        logger.error(f"Error in support callback: {e}")
+        logger.error("Error in support callback: %s", e)
         await callback_query.answer("❌ خطا در پردازش درخواست پشتیبانی", show_alert=True)
+        return
+    await callback_query.answer()
 
 # Balance handlers
 async def handle_check_balance(client, callback_query):
     user_id = callback_query.from_user.id
     
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-            balance = c.fetchone()
-            
-            if balance:
-                await callback_query.message.reply(f"💰 موجودی شما: {balance[0]:,.0f} تومان")
-            else:
-                await callback_query.message.reply("❌ کاربر یافت نشد.")
+        balance = await db.fetchone("SELECT balance FROM users WHERE user_id = ?", (user_id,))
+        
+        if balance:
+            await callback_query.message.reply(f"💰 موجودی شما: {balance[0]:,.0f} تومان")
+        else:
+            await callback_query.message.reply("❌ کاربر یافت نشد.")
     except sqlite3.Error as e:
-        logger.error(f"Database error in balance: {e}")
+        logger.error("Database error in balance: %s", e)
         await callback_query.message.reply("❌ خطای پایگاه داده.")
-    
-    await callback_query.answer()
 
 # Admin handlers
+def _toggle_bot_status(conn):
+    c = conn.cursor()
+    c.execute("UPDATE bot_status SET is_active = NOT is_active, version = version + 1 WHERE id = 1")
+    c.execute("SELECT is_active, version FROM bot_status WHERE id = 1")
+    return c.fetchone()
+
 async def handle_toggle_bot(client, callback_query):
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT is_active FROM bot_status WHERE id = 1")
-            current_status = c.fetchone()[0]
-            new_status = not current_status
-            
-            c.execute("UPDATE bot_status SET is_active = ? WHERE id = 1", (new_status,))
-            conn.commit()
-            
-            status_text = "آنلاین" if new_status else "آفلاین"
-            status_emoji = "🟢" if new_status else "🔴"
-            
-            # اطلاع به ادمین
-            await callback_query.message.reply(f"{status_emoji} ربات {status_text} شد!")
-            # await show_admin_panel(callback_query.message)
+        new_status, version = await db.run(_toggle_bot_status)
+        bot_status.set(new_status, version)
+        new_status = bot_status.active
+        
+        status_text = "آنلاین" if new_status else "آفلاین"
+        status_emoji = "🟢" if new_status else "🔴"
+        
+        # اطلاع به ادمین
+        await callback_query.message.reply(f"{status_emoji} ربات {status_text} شد!")
+        logger.info("Bot status changed to %s", status_text)
+        # await show_admin_panel(callback_query.message)
+        
+        # اطلاع به همه کاربران در پس‌زمینه؛ اطلاعیه قبلی (اگر هنوز در حال ارسال است) لغو می‌شود
+        try:
+            notification_text = (
+                f"{status_emoji} ربات {status_text} شد!\n\n"
+                f"در حال حاضر ربات {'آماده به کار است' if new_status else 'موقتاً غیرفعال شده است'}."
+            )
+            await broadcaster.cancel_kind("bot_status")
+            await broadcaster.start_job(callback_query.message.chat.id, notification_text, kind="bot_status")
+        except Exception as e:
+            logger.error("Error queueing status notifications: %s", e)
+            await outbox.send_message(ADMIN_ID, f"خطا در ارسال اطلاعیه به کاربران: {e}", priority=PRIORITY_NOTICE, wait=False)
+        return
             
-            # اطلاع به همه کاربران
-            try:
-                c.execute("SELECT user_id FROM users")
-                users = c.fetchall()
-                
-                notification_text = (
-                    f"{status_emoji} ربات {status_text} شد!\n\n"
-                    f"در حال حاضر ربات {'آماده به کار است' if new_status else 'موقتاً غیرفعال شده است'}."
-                )
-                
-                for user in users:
-                    try:
-                        await client.send_message(user[0], notification_text)
-                        logger.info(f"Notification sent to user {user[0]}")
-                    except Exception as e:
-                        logger.error(f"Failed to notify user {user[0]}: {e}")
-                        
-                logger.info(f"Bot status changed to {status_text}, notifications sent to {len(users)} users")
-                
-            except Exception as e:
-                logger.error(f"Error sending notifications: {e}")
-                await client.send_message(ADMIN_ID, f"خطا در ارسال اطلاعیه به کاربران: {e}")
-                
     except sqlite3.Error as e:
-        logger.error(f"Database error in toggle bot: {e}")
+        logger.error("Database error in toggle bot: %s", e)
         await callback_query.message.reply("❌ خطای پایگاه داده.")
-    
+
+async def handle_job_status(client, callback_query):
+    job_id = int(callback_query.data.rsplit("_", 1)[1])
+    status = await broadcaster.job_status(job_id)
+    if status is None:
+        await callback_query.answer("❌ این ارسال یافت نشد.", show_alert=True)
+        return
     await callback_query.answer()
+    await broadcaster.update_progress(job_id, callback_query.message.chat.id, callback_query.message.id)
+
+async def handle_job_cancel(client, callback_query):
+    job_id = int(callback_query.data.rsplit("_", 1)[1])
+    if await broadcaster.cancel_job(job_id):
+        await callback_query.answer("⛔ ارسال لغو شد.", show_alert=True)
+    else:
+        await callback_query.answer("❌ این ارسال در حال اجرا نیست.", show_alert=True)
+    await broadcaster.update_progress(job_id, callback_query.message.chat.id, callback_query.message.id)
+
+async def render_jobs_list():
+    # آخرین ارسال‌ها در یک پیام؛ (متن، کیبورد) یا None اگر ارسالی نیست. دکمه‌های
+    # لغو این پیام job_list_cancel_ هستند تا بعد از لغو کل فهرست دوباره ساخته شود
+    rows = await db.fetchall("SELECT id FROM broadcast_jobs ORDER BY id DESC LIMIT 5")
+    statuses = [status for status in [await broadcaster.job_status(job_id) for (job_id,) in rows] if status]
+    if not statuses:
+        return None
+    running = [status["id"] for status in statuses if status["status"] == "running"]
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"⛔ لغو #{job_id}", callback_data=f"job_list_cancel_{job_id}")]
+        for job_id in running
+    ]) if running else None
+    return "\n────────────────────\n".join(format_job_status(status) for status in statuses), keyboard
+
+async def handle_view_jobs(client, callback_query):
+    jobs = await render_jobs_list()
+    if jobs is None:
+        await callback_query.message.reply("❌ ارسال همگانی‌ای یافت نشد.")
+        return
+    text, keyboard = jobs
+    await callback_query.message.reply(text, reply_markup=keyboard)
+
+async def handle_job_list_cancel(client, callback_query):
+    # لغو از فهرست ارسال‌ها؛ به جای وضعیت یک ارسال، فهرست دوباره ساخته می‌شود
+    job_id = int(callback_query.data.rsplit("_", 1)[1])
+    if await broadcaster.cancel_job(job_id):
+        await callback_query.answer("⛔ ارسال لغو شد.", show_alert=True)
+    else:
+        await callback_query.answer("❌ این ارسال در حال اجرا نیست.", show_alert=True)
+    jobs = await render_jobs_list()
+    if jobs is not None:
+        text, keyboard = jobs
+        try:
+            await callback_query.message.edit_text(text, reply_markup=keyboard)
+        except Exception as e:
+            logger.error("Failed to update broadcast list after cancelling %s: %s", job_id, e)
+
+async def fetch_users_page(after_id=0, before_id=None):
+    # صفحه‌بندی keyset روی user_id؛ یک ردیف اضافه برای تشخیص وجود صفحه بعد/قبل
+    if before_id is None:
+        rows = await db.fetchall(
+            "SELECT user_id, first_name, last_name, approved_count, balance FROM users "
+            "WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_id, USERS_PAGE_SIZE + 1)
+        )
+        has_more = len(rows) > USERS_PAGE_SIZE
+        rows = rows[:USERS_PAGE_SIZE]
+        return rows, after_id > 0, has_more
+    
+    rows = await db.fetchall(
+        "SELECT user_id, first_name, last_name, approved_count, balance FROM users "
+        "WHERE user_id < ? ORDER BY user_id DESC LIMIT ?",
+        (before_id, USERS_PAGE_SIZE + 1)
+    )
+    has_more = len(rows) > USERS_PAGE_SIZE
+    rows = rows[:USERS_PAGE_SIZE][::-1]
+    return rows, has_more, True
+
+def render_users_page(rows, has_prev, has_next):
+    lines = ["👥 لیست کاربران:\n"]
+    for user in rows:
+        lines.append(
+            f"🆔 ID: `{user[0]}`\n"
+            f"👤 نام: {user[1]} {user[2]}\n"
+            f"✅ تعداد تایید شده: {user[3]}\n"
+            f"💰 موجودی: {user[4]:,.0f} تومان\n"
+            f"────────────────────"
+        )
+    
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"users_prev_{rows[0][0]}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"users_page_{rows[-1][0]}"))
+    keyboard = [nav] if nav else []
+    keyboard.append([InlineKeyboardButton("📄 دریافت فایل CSV همه کاربران", callback_data="users_csv")])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
 
 async def handle_view_users(client, callback_query):
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            # تغییر approved_numbers به approved_count
-            c.execute("SELECT user_id, first_name, last_name, approved_count, balance FROM users")
-            users = c.fetchall()
-            
-            if not users:
-                await callback_query.message.reply("❌ کاربری یافت نشد.")
-                return
-            
-            users_text = "👥 لیست کاربران:\n\n"
-            for user in users:
-                users_text += (
-                    f"🆔 ID: `{user[0]}`\n"
-                    f"👤 نام: {user[1]} {user[2]}\n"
-                    f"✅ تعداد تایید شده: {user[3]}\n"
-                    f"💰 موجودی: {user[4]:,.0f} تومان\n"
-                    f"────────────────────\n"
-                )
-            
-            await callback_query.message.reply(users_text)
+        # تغییر approved_numbers به approved_count
+        rows, has_prev, has_next = await fetch_users_page()
+        
+        if not rows:
+            await callback_query.message.reply("❌ کاربری یافت نشد.")
+            return
+        
+        text, keyboard = render_users_page(rows, has_prev, has_next)
+        await callback_query.message.reply(text, reply_markup=keyboard)
     except sqlite3.Error as e:
-        logger.error(f"Database error in view users: {e}")
+        logger.error("Database error in view users: %s", e)
         await callback_query.message.reply("❌ خطای پایگاه داده.")
-    
+
+async def handle_users_page(client, callback_query):
+    # users_page_<after_id> یا users_prev_<before_id>؛ همان پیام ویرایش می‌شود
+    direction, _, cursor = callback_query.data[len("users_"):].partition("_")
+    cursor = int(cursor)
+    try:
+        if direction == "prev":
+            rows, has_prev, has_next = await fetch_users_page(before_id=cursor)
+        else:
+            rows, has_prev, has_next = await fetch_users_page(after_id=cursor)
+        
+        if not rows:
+            await callback_query.answer("❌ کاربری یافت نشد.", show_alert=True)
+            return
+        
+        text, keyboard = render_users_page(rows, has_prev, has_next)
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+    except sqlite3.Error as e:
+        logger.error("Database error in users page: %s", e)
+        await callback_query.answer("❌ خطای پایگاه داده.", show_alert=True)
+        return
     await callback_query.answer()
 
+async def send_export(client, message, name, compress=False):
+    # فایل روی thread پایگاه داده به صورت جریانی ساخته و به عنوان document ارسال می‌شود
+    path = None
+    try:
+        await message.reply("⏳ در حال آماده‌سازی فایل...")
+        path, count = await db.run(export_table, name, compress)
+        extension = "csv.gz" if compress else "csv"
+        await client.send_document(
+            message.chat.id,
+            document=path,
+            file_name=f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+            caption=f"📄 {name}: {count} ردیف"
+        )
+        logger.info("Export %s with %s rows sent to admin", name, count)
+    except sqlite3.Error as e:
+        logger.error("Database error in export %s: %s", name, e)
+        await message.reply("❌ خطای پایگاه داده.")
+    except Exception as e:
+        logger.error("Error in export %s: %s", name, e)
+        await message.reply("❌ خطا در ساخت فایل خروجی.")
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+async def handle_users_csv(client, callback_query):
+    await send_export(client, callback_query.message, "users")
+
+# Export command: /export users|submissions|support [gzip]
+@app.on_message(filters.command("export") & filters.user(ADMIN_ID) & filters.private)
+@HANDLER_SECONDS.time("command", "export")
+async def export_command(client, message):
+    args = message.command[1:]
+    if not args or args[0] not in EXPORTS:
+        await message.reply(
+            "📄 خروجی گرفتن از داده‌ها:\n"
+            f"/export {'|'.join(EXPORTS)} [gzip]\n"
+            "مثال: /export submissions gzip"
+        )
+        return
+    await send_export(client, message, args[0], compress=len(args) > 1 and args[1] in ("gzip", "gz"))
+
+# Rate command: /rate <amount> [group leader name]
+@app.on_message(filters.command("rate") & filters.user(ADMIN_ID) & filters.private)
+@HANDLER_SECONDS.time("command", "rate")
+async def rate_command(client, message):
+    args = message.command[1:]
+    try:
+        rate = float(args[0])
+        if rate < 0:
+            raise ValueError("negative")
+    except (IndexError, ValueError):
+        rates = await db.fetchall("SELECT group_leader_name, rate FROM item_rates ORDER BY group_leader_name")
+        lines = [f"{name or 'پیش‌فرض'}: {rate:,.0f} تومان" for name, rate in rates]
+        await message.reply(
+            "💵 نرخ هر آیتم تأییدشده:\n" + "\n".join(lines) +
+            "\n\nتغییر نرخ: /rate مبلغ [نام سرگروه]\nمثال: /rate 1500"
+        )
+        return
+    group_leader_name = " ".join(args[1:])
+    try:
+        await db.run(set_rate, rate, group_leader_name)
+        logger.info("Item rate for '%s' set to %s", group_leader_name, rate)
+        await message.reply(f"✅ نرخ {group_leader_name or 'پیش‌فرض'} به {rate:,.0f} تومان تغییر کرد.")
+    except sqlite3.Error as e:
+        logger.error("Database error in rate command: %s", e)
+        await message.reply("❌ خطای پایگاه داده.")
+
+# Historical balance: /balance_at <user_id> <YYYY-MM-DD>
+@app.on_message(filters.command("balance_at") & filters.user(ADMIN_ID) & filters.private)
+@HANDLER_SECONDS.time("command", "balance_at")
+async def balance_at_command(client, message):
+    args = message.command[1:]
+    try:
+        target_user_id = int(args[0])
+        # پایان روز داده‌شده
+        when = datetime.strptime(args[1], "%Y-%m-%d").strftime("%Y-%m-%d 23:59:59")
+    except (IndexError, ValueError):
+        await message.reply("📅 موجودی در یک تاریخ:\n/balance_at شناسه_کاربر YYYY-MM-DD\nمثال: /balance_at 12345 2024-05-01")
+        return
+    try:
+        balance = await db.run(balance_as_of, target_user_id, when)
+        await message.reply(f"💰 موجودی کاربر {target_user_id} در پایان {args[1]}: {balance:,.0f} تومان")
+    except sqlite3.Error as e:
+        logger.error("Database error in balance_at: %s", e)
+        await message.reply("❌ خطای پایگاه داده.")
+
+async def run_payout(client, chat_id, run_id, admin_id):
+    # admin_id ادمینی که تسویه را شروع کرده و در تراکنش‌های payout دفتر ثبت می‌شود.
+    # فایل هر دسته بلافاصله بعد از ثبت ارسال می‌شود؛ بعد از ری‌استارت فقط
+    # دسته‌های ارسال‌نشده دوباره فرستاده می‌شوند
+    async def deliver(batch_no, path):
+        await client.send_document(
+            chat_id,
+            document=path,
+            file_name=os.path.basename(path),
+            caption=f"🏦 تسویه #{run_id} — دسته {batch_no}"
+        )
+
+    try:
+        batches, users, amount = await process_run(db, run_id, PAYOUT_DIR, admin_id=admin_id, deliver=deliver)
+        logger.info("Payout run %s finished: %s users, %.0f toman in %s batches", run_id, users, amount, batches)
+        await outbox.send_message(
+            chat_id,
+            f"✅ تسویه #{run_id} انجام شد.\n👥 کاربران: {users}\n💰 مبلغ کل: {amount:,.0f} تومان\n📄 فایل‌ها: {batches}",
+            priority=PRIORITY_NOTICE
+        )
+    except Exception as e:
+        logger.error("Payout run %s failed: %s", run_id, e)
+        await outbox.send_message(chat_id, f"❌ تسویه #{run_id} متوقف شد. با /payout از همان‌جا ادامه پیدا می‌کند.", priority=PRIORITY_NOTICE)
+
+def spawn_payout(client, chat_id, run_id, admin_id):
+    global payout_task
+    payout_task = asyncio.ensure_future(run_payout(client, chat_id, run_id, admin_id))
+
+# Payout command: /payout [batch size]
+@app.on_message(filters.command("payout") & filters.user(ADMIN_ID) & filters.private)
+@HANDLER_SECONDS.time("command", "payout")
+async def payout_command(client, message):
+    if payout_task is not None and not payout_task.done():
+        await message.reply("⏳ یک تسویه در حال انجام است.")
+        return
+    args = message.command[1:]
+    try:
+        batch_size = int(args[0]) if args else PAYOUT_BATCH_SIZE
+        if batch_size <= 0:
+            raise ValueError("non-positive")
+    except ValueError:
+        await message.reply("🏦 تسویه حساب کاربران دارای موجودی:\n/payout [تعداد هر دسته]\nمثال: /payout 500")
+        return
+    try:
+        run_id, created = await db.run(start_run, message.from_user.id, batch_size)
+    except sqlite3.Error as e:
+        logger.error("Database error in payout: %s", e)
+        await message.reply("❌ خطای پایگاه داده.")
+        return
+    await message.reply(f"🏦 تسویه #{run_id} {'شروع شد' if created else 'از ادامه نیمه‌تمام شروع شد'}...")
+    spawn_payout(client, message.chat.id, run_id, admin_id=message.from_user.id)
+
 async def handle_manage_balances(client, callback_query):
     await callback_query.message.reply(
         "💸 لطفاً ID کاربر و مبلغ جدید را به این فرمت وارد کنید:\n"
@@ -724,46 +1289,110 @@ async def handle_manage_balances(client, callback_query):
         "(شناسه کاربر و مبلغ به تومان)"
     )
     set_user_state(callback_query.from_user.id, "waiting_for_balance_update")
-    await callback_query.answer()
+
+def render_tickets_page(rows, has_next, total, status, after_id):
+    title = "📨 تیکت‌های باز" if status == "open" else "🗄 تیکت‌های بسته"
+    lines = [f"{title} ({total}):\n"]
+    keyboard = []
+    for ticket_id, user_id, first_name, last_name, messages, last_activity in rows:
+        lines.append(
+            f"🎫 #{ticket_id} — {first_name or 'ناشناس'} {last_name or ''} (ID: {user_id})\n"
+            f"💬 {messages} پیام | ⏰ {last_activity}"
+        )
+        keyboard.append([InlineKeyboardButton(f"📜 #{ticket_id} — {user_id}", callback_data=f"thread_{user_id}_0")])
+    
+    nav = []
+    if after_id:
+        nav.append(InlineKeyboardButton("🔝 جدیدترین‌ها", callback_data=f"tickets_{status}_0"))
+    if has_next:
+        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"tickets_{status}_{rows[-1][0]}"))
+    if nav:
+        keyboard.append(nav)
+    other = "closed" if status == "open" else "open"
+    keyboard.append([InlineKeyboardButton(
+        "🗄 تیکت‌های بسته" if other == "closed" else "📨 تیکت‌های باز",
+        callback_data=f"tickets_{other}_0"
+    )])
+    if not rows:
+        lines.append("❌ تیکتی یافت نشد.")
+    return "\n────────────────────\n".join(lines), InlineKeyboardMarkup(keyboard)
 
 async def handle_view_support(client, callback_query):
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("""
-                SELECT user_id, message, direction, created_at 
-                FROM support_messages 
-                ORDER BY created_at DESC 
-                LIMIT 10
-            """)
-            messages = c.fetchall()
-            
-            if not messages:
-                await callback_query.message.reply("❌ پیام پشتیبانی یافت نشد.")
-                return
-            
-            messages_text = "📨 آخرین پیام‌های پشتیبانی:\n\n"
-            for msg in messages:
-                direction = "👤 کاربر به ادمین" if msg[2] == "user_to_admin" else "👨‍💼 ادمین به کاربر"
-                messages_text += (
-                    f"🆔 کاربر: {msg[0]}\n"
-                    f"📝 {direction}\n"
-                    f"⏰ زمان: {msg[3]}\n"
-                    f"📩 پیام: {msg[1]}\n"
-                    f"────────────────────\n"
-                )
-            
-            await callback_query.message.reply(messages_text)
+        rows, has_next, total = await db.run(fetch_tickets, "open", 0, SUPPORT_PAGE_SIZE)
+        text, keyboard = render_tickets_page(rows, has_next, total, "open", 0)
+        await callback_query.message.reply(text, reply_markup=keyboard)
     except sqlite3.Error as e:
-        logger.error(f"Database error in view support: {e}")
+        logger.error("Database error in view support: %s", e)
         await callback_query.message.reply("❌ خطای پایگاه داده.")
+
+async def handle_tickets_page(client, callback_query):
+    # tickets_<status>_<after_id>؛ همان پیام ویرایش می‌شود
+    _, status, after_id = callback_query.data.split("_")
+    after_id = int(after_id)
+    try:
+        rows, has_next, total = await db.run(fetch_tickets, status, after_id, SUPPORT_PAGE_SIZE)
+        text, keyboard = render_tickets_page(rows, has_next, total, status, after_id)
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+        await callback_query.answer()
+    except sqlite3.Error as e:
+        logger.error("Database error in tickets page: %s", e)
+        await callback_query.answer("❌ خطای پایگاه داده.", show_alert=True)
+
+def render_thread(user_id, rows, has_older, ticket_id):
+    status = f"🎫 تیکت باز #{ticket_id}" if ticket_id else "🗄 بدون تیکت باز"
+    lines = [f"📜 گفتگوی کاربر {user_id} ({status}):\n"]
+    for _, text, direction, created_at in rows:
+        sender = "👤 کاربر" if direction == "user_to_admin" else "👨‍💼 ادمین"
+        lines.append(f"{sender} — ⏰ {created_at}\n{text}")
+    if not rows:
+        lines.append("❌ پیامی یافت نشد.")
     
-    await callback_query.answer()
+    keyboard = []
+    if has_older:
+        keyboard.append([InlineKeyboardButton("◀️ پیام‌های قدیمی‌تر", callback_data=f"thread_{user_id}_{rows[0][0]}")])
+    actions = [InlineKeyboardButton("💬 پاسخ", callback_data=f"reply_{user_id}")]
+    if ticket_id:
+        actions.append(InlineKeyboardButton("✅ بستن تیکت", callback_data=f"ticket_close_{ticket_id}"))
+    keyboard.append(actions)
+    # متن طولانی به اندازه محدودیت پیام تلگرام کوتاه می‌شود
+    return "\n────────────────────\n".join(lines)[:4000], InlineKeyboardMarkup(keyboard)
+
+async def handle_thread(client, callback_query):
+    # thread_<user_id>_<before_id>؛ صفحه اول پیام جدید است و صفحه‌های قدیمی‌تر همان را ویرایش می‌کنند
+    _, user_id, before_id = callback_query.data.split("_")
+    user_id, before_id = int(user_id), int(before_id)
+    try:
+        rows, has_older, ticket_id = await db.run(fetch_thread, user_id, before_id, SUPPORT_THREAD_PAGE_SIZE)
+        text, keyboard = render_thread(user_id, rows, has_older, ticket_id)
+        if before_id:
+            await callback_query.message.edit_text(text, reply_markup=keyboard)
+        else:
+            await callback_query.message.reply(text, reply_markup=keyboard)
+        await callback_query.answer()
+    except sqlite3.Error as e:
+        logger.error("Database error in support thread: %s", e)
+        await callback_query.answer("❌ خطای پایگاه داده.", show_alert=True)
+
+async def handle_ticket_close(client, callback_query):
+    ticket_id = int(callback_query.data[len("ticket_close_"):])
+    try:
+        user_id = await db.run(close_ticket, ticket_id)
+        if user_id is None:
+            await callback_query.answer("❌ این تیکت قبلاً بسته شده است.", show_alert=True)
+            return
+        logger.info("Support ticket %s of user %s closed", ticket_id, user_id)
+        await callback_query.message.edit_reply_markup(InlineKeyboardMarkup([
+            [InlineKeyboardButton("💬 پاسخ", callback_data=f"reply_{user_id}")]
+        ]))
+        await callback_query.answer(f"✅ تیکت #{ticket_id} بسته شد.")
+    except sqlite3.Error as e:
+        logger.error("Database error closing ticket %s: %s", ticket_id, e)
+        await callback_query.answer("❌ خطای پایگاه داده.", show_alert=True)
 
 async def handle_cancel_reply(client, callback_query):
     clear_user_state(callback_query.from_user.id)
     await callback_query.message.reply("❌ پاسخ دادن لغو شد.")
-    await callback_query.answer()
 
 # Reply to support handlers
 async def handle_reply_callback(client, callback_query):
@@ -780,10 +1409,11 @@ async def handle_reply_callback(client, callback_query):
                 [InlineKeyboardButton("❌ لغو", callback_data="cancel_reply")]
             ])
         )
-        await callback_query.answer()
     except Exception as e:
-        logger.error(f"Error in reply callback: {e}")
+        logger.error("Error in reply callback: %s", e)
         await callback_query.answer("❌ خطا در پردازش درخواست", show_alert=True)
+        return
+    await callback_query.answer()
 
 # Approve/Reject handlers
 async def handle_content_approval(client, callback_query):
@@ -794,63 +1424,117 @@ async def handle_content_approval(client, callback_query):
 
         if admin_id != ADMIN_ID:
             await callback_query.answer("❌ شما مجاز به انجام این عملیات نیستید.", show_alert=True)
-            logger.warning(f"Unauthorized approval attempt by user {admin_id}")
+            logger.warning("Unauthorized approval attempt by user %s", admin_id)
             return
 
-        with sqlite3.connect("bot_db.db") as conn:
-            c = conn.cursor()
-            c.execute("SELECT user_id, content, content_type, status FROM submissions WHERE id = ?", (submission_id,))
-            submission = c.fetchone()
+        submission = await db.fetchone(
+            "SELECT user_id, content, content_type, status, suggested_items FROM submissions WHERE id = ?",
+            (submission_id,)
+        )
 
-            if not submission:
-                await callback_query.answer("❌ شماره یافت نشد.", show_alert=True)
-                logger.warning(f"Submission {submission_id} not found")
-                return
+        if not submission:
+            await callback_query.answer("❌ شماره یافت نشد.", show_alert=True)
+            logger.warning("Submission %s not found", submission_id)
+            return
 
-            user_id, content, content_type, status = submission
+        user_id, content, content_type, status, suggested_items = submission
 
-            if status != "pending":
-                await callback_query.answer(f"❌ این شماره قبلاً {status} شده است.", show_alert=True)
-                logger.warning(f"Attempt to modify non-pending submission {submission_id}")
-                return
+        if status != "pending":
+            await callback_query.answer(f"❌ این شماره قبلاً {status} شده است.", show_alert=True)
+            logger.warning("Attempt to modify non-pending submission %s", submission_id)
+            return
 
-            if action == "approve":
-                # درخواست تعداد آیتم‌های تأییدشده
-                await callback_query.message.reply(
-                    "✅ لطفاً تعداد آیتم‌های تأییدشده را وارد کنید:\n"
-                    "مثال: 90"
-                )
-                set_user_state(admin_id, "waiting_for_approval_details", {"submission_id": submission_id, "user_id": user_id})
-                await callback_query.answer()
+        if action == "accept" and suggested_items is not None:
+            # تأیید با تعداد پیشنهادی اعتبارسنجی، بدون مرحله ورود عدد
+            await complete_approval(
+                client, callback_query.message, admin_id, submission_id, user_id, content_type, content, suggested_items
+            )
+            await callback_query.answer()
+            return
+
+        if action in ("approve", "accept"):
+            # درخواست تعداد آیتم‌های تأییدشده
+            hint = f"پیشنهاد: {suggested_items}" if suggested_items is not None else "مثال: 90"
+            await callback_query.message.reply(
+                "✅ لطفاً تعداد آیتم‌های تأییدشده را وارد کنید:\n"
+                f"{hint}"
+            )
+            # ردیف شماره در state نگه داشته می‌شود تا بعد از تأیید دوباره خوانده نشود
+            set_user_state(admin_id, "waiting_for_approval_details", {
+                "submission_id": submission_id,
+                "user_id": user_id,
+                "content_type": content_type,
+                "content": content
+            })
+            await callback_query.answer()
+            return
+
+        elif action == "reject":
+            # به‌روزرسانی وضعیت شماره
+            if await db.run(reject_submission, submission_id) is None:
+                await callback_query.answer("❌ این شماره قبلاً بررسی شده است.", show_alert=True)
+                logger.warning("Submission %s was already reviewed", submission_id)
                 return
+            logger.info("Submission %s rejected for user %s", submission_id, user_id)
+
+            # اطلاع به کاربر
+            try:
+                if content_type == "text":
+                    await outbox.send_message(user_id, f"❌ لیست شما رد شد:\n\n{content}", priority=PRIORITY_NOTICE, wait=False)
+                else:
+                    await outbox.send_photo(user_id, photo=content, caption="❌ عکس شما رد شد!", priority=PRIORITY_NOTICE, wait=False)
+                logger.info("User %s notified of rejection for submission %s", user_id, submission_id)
+            except Exception as e:
+                logger.error("Failed to notify user %s of rejection: %s", user_id, e)
+                await outbox.send_message(ADMIN_ID, f"❌ خطا در اطلاع‌رسانی به کاربر {user_id} برای رد شماره {submission_id}", priority=PRIORITY_NOTICE, wait=False)
 
-            elif action == "reject":
-                # به‌روزرسانی وضعیت شماره
-                c.execute("UPDATE submissions SET status = 'rejected' WHERE id = ?", (submission_id,))
-                conn.commit()
-                logger.info(f"Submission {submission_id} rejected for user {user_id}")
-
-                # اطلاع به کاربر
-                try:
-                    if content_type == "text":
-                        await client.send_message(user_id, f"❌ لیست شما رد شد:\n\n{content}")
-                    else:
-                        await client.send_photo(user_id, photo=content, caption="❌ عکس شما رد شد!")
-                    logger.info(f"User {user_id} notified of rejection for submission {submission_id}")
-                except Exception as e:
-                    logger.error(f"Failed to notify user {user_id} of rejection: {e}")
-                    await client.send_message(ADMIN_ID, f"❌ خطا در اطلاع‌رسانی به کاربر {user_id} برای رد شماره {submission_id}")
-
-                await callback_query.message.edit_text(f"❌ لیست کاربر {user_id} رد شد (ID: {submission_id})")
-                await callback_query.answer("❌ شماره رد شد.", show_alert=True)
+            await callback_query.message.edit_text(f"❌ لیست کاربر {user_id} رد شد (ID: {submission_id})")
+            await callback_query.answer("❌ شماره رد شد.", show_alert=True)
 
     except sqlite3.Error as e:
-        logger.error(f"Database error in approval process: {e}")
+        logger.error("Database error in approval process: %s", e)
         await callback_query.answer("❌ خطای پایگاه داده.", show_alert=True)
     except Exception as e:
-        logger.error(f"Error in approval process: {e}")
+        logger.error("Error in approval process: %s", e)
         await callback_query.answer("❌ خطا در پردازش.", show_alert=True)
 
+async def complete_approval(client, message, admin_id, submission_id, user_id, content_type, content, approved_items):
+    if await db.run(approve_submission, submission_id, approved_items, admin_id) is None:
+        clear_user_state(admin_id)
+        await message.reply(f"❌ این شماره قبلاً بررسی شده است (ID: {submission_id})")
+        logger.warning("Submission %s was already reviewed", submission_id)
+        return
+    logger.info("Submission %s approved with %s items for user %s", submission_id, approved_items, user_id)
+
+    # اطلاع به کاربر
+    try:
+        if content_type == "text":
+            await outbox.send_message(
+                user_id,
+                f"✅ لیست شما تأیید شد:\n\n{content}\n\nتعداد تأییدشده: {approved_items}",
+                priority=PRIORITY_NOTICE, wait=False
+            )
+        else:
+            await outbox.send_photo(
+                user_id,
+                photo=content,
+                caption=f"✅ عکس شما تأیید شد!\n\nتعداد تأییدشده: {approved_items}",
+                priority=PRIORITY_NOTICE, wait=False
+            )
+        logger.info("User %s notified of approval for submission %s", user_id, submission_id)
+    except Exception as e:
+        logger.error("Failed to notify user %s: %s", user_id, e)
+        await outbox.send_message(ADMIN_ID, f"❌ خطا در اطلاع‌رسانی به کاربر {user_id}", priority=PRIORITY_NOTICE, wait=False)
+
+    # ارسال پیام جدید به ادمین
+    try:
+        await message.reply(
+            f"✅ لیست کاربر {user_id} تأیید شد (ID: {submission_id})\nتعداد تأییدشده: {approved_items}",
+            reply_markup=None
+        )
+    except Exception as e:
+        logger.error("Failed to send admin message: %s", e)
+
 async def handle_approval_details(client, message):
     admin_id = message.from_user.id
     state = get_user_state(admin_id)
@@ -876,65 +1560,199 @@ async def handle_approval_details(client, message):
             await message.reply("❌ فرمت نامعتبر. لطفاً یک عدد معتبر وارد کنید (مثال: 90):")
             return
 
-        with sqlite3.connect("bot_db.db") as conn:
-            c = conn.cursor()
-            # به‌روزرسانی وضعیت شماره
-            c.execute("UPDATE submissions SET status = 'approved' WHERE id = ?", (submission_id,))
-            # ذخیره تعداد آیتم‌های تأییدشده (بدون total_items)
-            c.execute(
-                "INSERT INTO submission_details (submission_id, approved_items) VALUES (?, ?)",
-                (submission_id, approved_items)
-            )
-            # به‌روزرسانی تعداد کل تأییدشده‌های کاربر
-            c.execute(
-                "UPDATE users SET approved_count = approved_count + ? WHERE user_id = ?",
-                (approved_items, user_id)
+        if "content_type" in state_data:
+            content_type = state_data["content_type"]
+            content = state_data["content"]
+        else:
+            # وضعیت‌های ذخیره‌شده قبل از نگه‌داشتن ردیف در state
+            content_type, content = await db.fetchone(
+                "SELECT content_type, content FROM submissions WHERE id = ?",
+                (submission_id,)
             )
-            conn.commit()
-            logger.info(f"Submission {submission_id} approved with {approved_items} items for user {user_id}")
+        await complete_approval(client, message, admin_id, submission_id, user_id, content_type, content, approved_items)
+        clear_user_state(admin_id)
 
-        # دریافت نوع شماره و شماره
-        c.execute("SELECT content_type, content FROM submissions WHERE id = ?", (submission_id,))
-        content_type, content = c.fetchone()
+    except sqlite3.Error as e:
+        logger.error("Database error in approval details: %s", e)
+        await message.reply("❌ خطای پایگاه داده.")
+    except Exception as e:
+        logger.error("Error in approval details: %s", e)
+        await message.reply("❌ خطا در پردازش.")
 
-        # اطلاع به کاربر
-        try:
-            if content_type == "text":
-                await client.send_message(
-                    user_id,
-                    f"✅ لیست شما تأیید شد:\n\n{content}\n\nتعداد تأییدشده: {approved_items}"
-                )
-            else:
-                await client.send_photo(
-                    user_id,
-                    photo=content,
-                    caption=f"✅ عکس شما تأیید شد!\n\nتعداد تأییدشده: {approved_items}"
-                )
-            logger.info(f"User {user_id} notified of approval for submission {submission_id}")
-        except Exception as e:
-            logger.error(f"Failed to notify user {user_id}: {e}")
-            await client.send_message(ADMIN_ID, f"❌ خطا در اطلاع‌رسانی به کاربر {user_id}")
+# Review queue handlers
+async def fetch_review_page(after_id=0):
+    # صفحه‌بندی keyset روی (submitted_at, id) با ایندکس submissions(status, submitted_at)
+    rows = await db.fetchall(
+        "SELECT s.id, s.user_id, u.first_name, u.last_name, s.content_type, s.content "
+        "FROM submissions s LEFT JOIN users u ON u.user_id = s.user_id "
+        "WHERE s.status = 'pending' AND (s.submitted_at, s.id) > "
+        "(COALESCE((SELECT submitted_at FROM submissions WHERE id = ?), ''), ?) "
+        "ORDER BY s.submitted_at, s.id LIMIT ?",
+        (after_id, after_id, REVIEW_PAGE_SIZE + 1)
+    )
+    total = (await db.fetchone("SELECT COUNT(*) FROM submissions WHERE status = 'pending'"))[0]
+    return rows[:REVIEW_PAGE_SIZE], len(rows) > REVIEW_PAGE_SIZE, total
+
+def render_review_page(rows, has_next, total, selected, after_id):
+    lines = [f"🗂 صف بررسی ({total} لیست در انتظار):\n"]
+    keyboard = []
+    for submission_id, user_id, first_name, last_name, content_type, content in rows:
+        if content_type == "text":
+            numbers = content.splitlines()
+            preview = f"📝 {len(numbers)} خط: {numbers[0][:30] if numbers else ''}"
+        else:
+            preview = "📸 عکس"
+        lines.append(f"#{submission_id} — {first_name or 'ناشناس'} {last_name or ''} (ID: {user_id})\n{preview}")
+        mark = "☑️" if submission_id in selected else "⬜️"
+        keyboard.append([
+            InlineKeyboardButton(f"{mark} #{submission_id}", callback_data=f"rq_toggle_{submission_id}"),
+            InlineKeyboardButton("👁 مشاهده", callback_data=f"rq_view_{submission_id}")
+        ])
+    
+    nav = []
+    if after_id:
+        nav.append(InlineKeyboardButton("🔝 ابتدای صف", callback_data="rq_first"))
+    if has_next:
+        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"rq_next_{rows[-1][0]}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton(f"✅ تأیید ({len(selected)})", callback_data="rq_approve"),
+        InlineKeyboardButton(f"❌ رد ({len(selected)})", callback_data="rq_reject")
+    ])
+    if not rows:
+        lines.append("✅ لیستی در انتظار بررسی نیست.")
+    return "\n\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def show_review_page(callback_query, after_id, selected, edit=True):
+    rows, has_next, total = await fetch_review_page(after_id)
+    # انتخاب‌ها در state ادمین نگه داشته می‌شوند تا بین صفحه‌ها حفظ شوند
+    set_user_state(callback_query.from_user.id, "reviewing_queue", {"after_id": after_id, "selected": sorted(selected)})
+    text, keyboard = render_review_page(rows, has_next, total, set(selected), after_id)
+    if edit:
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+    else:
+        await callback_query.message.reply(text, reply_markup=keyboard)
+
+def get_review_selection(admin_id):
+    if get_user_state(admin_id) not in ("reviewing_queue", "waiting_for_bulk_approval"):
+        return 0, set()
+    data = get_state_data(admin_id)
+    return data.get("after_id", 0), set(data.get("selected", []))
+
+async def handle_review_queue(client, callback_query):
+    try:
+        await show_review_page(callback_query, 0, set(), edit=False)
+    except sqlite3.Error as e:
+        logger.error("Database error in review queue: %s", e)
+        await callback_query.message.reply("❌ خطای پایگاه داده.")
 
-        # ارسال پیام جدید به ادمین
-        try:
-            await message.reply(
-                f"✅ لیست کاربر {user_id} تأیید شد (ID: {submission_id})\nتعداد تأییدشده: {approved_items}",
-                reply_markup=None
+async def handle_review_action(client, callback_query):
+    data = callback_query.data
+    admin_id = callback_query.from_user.id
+    after_id, selected = get_review_selection(admin_id)
+    # پیام خطا به صورت alert در تنها پاسخ این callback نشان داده می‌شود
+    alert = None
+    
+    try:
+        if data.startswith("rq_toggle_"):
+            submission_id = int(data[len("rq_toggle_"):])
+            selected ^= {submission_id}
+            await show_review_page(callback_query, after_id, selected)
+        elif data.startswith("rq_next_"):
+            await show_review_page(callback_query, int(data[len("rq_next_"):]), selected)
+        elif data == "rq_first":
+            await show_review_page(callback_query, 0, selected)
+        elif data.startswith("rq_view_"):
+            submission_id = int(data[len("rq_view_"):])
+            row = await db.fetchone("SELECT content_type, content FROM submissions WHERE id = ?", (submission_id,))
+            if not row:
+                alert = "❌ شماره یافت نشد."
+            elif row[0] == "text":
+                await callback_query.message.reply(f"📨 لیست #{submission_id}:\n\n{row[1]}")
+            else:
+                await outbox.send_photo(callback_query.message.chat.id, photo=row[1], caption=f"📸 #{submission_id}", priority=PRIORITY_ADMIN)
+        elif not selected:
+            alert = "❌ هیچ لیستی انتخاب نشده است."
+        elif data == "rq_approve":
+            set_user_state(admin_id, "waiting_for_bulk_approval", {"after_id": after_id, "selected": sorted(selected)})
+            await callback_query.message.reply(
+                f"✅ تعداد آیتم‌های تأییدشده برای هر یک از {len(selected)} لیست انتخاب‌شده را وارد کنید:\n"
+                "مثال: 90"
             )
-        except Exception as e:
-            logger.error(f"Failed to send admin message: {e}")
+        elif data == "rq_reject":
+            processed = await db.run(review_batch, sorted(selected), "rejected", None, admin_id)
+            await notify_review_results(client, processed, "rejected", None)
+            await callback_query.message.reply(f"❌ {len(processed)} لیست رد شد.")
+            await show_review_page(callback_query, after_id, set())
+    except sqlite3.Error as e:
+        logger.error("Database error in review action %s: %s", data, e)
+        alert = "❌ خطای پایگاه داده."
+    
+    if alert:
+        await callback_query.answer(alert, show_alert=True)
+    else:
+        await callback_query.answer()
 
+async def handle_bulk_approval(client, message):
+    admin_id = message.from_user.id
+    _, selected = get_review_selection(admin_id)
+    
+    try:
+        approved_items = int(message.text.strip())
+        if approved_items < 0:
+            raise ValueError("negative")
+    except ValueError:
+        await message.reply("❌ فرمت نامعتبر. لطفاً یک عدد معتبر وارد کنید (مثال: 90):")
+        return
+    
+    try:
+        processed = await db.run(review_batch, sorted(selected), "approved", approved_items, admin_id)
         clear_user_state(admin_id)
-
+        logger.info("Bulk approved %s submissions with %s items each", len(processed), approved_items)
+        await message.reply(f"✅ {len(processed)} لیست تأیید شد (تعداد تأییدشده هر لیست: {approved_items}).")
+        await notify_review_results(client, processed, "approved", approved_items)
     except sqlite3.Error as e:
-        logger.error(f"Database error in approval details: {e}")
+        logger.error("Database error in bulk approval: %s", e)
         await message.reply("❌ خطای پایگاه داده.")
-    except Exception as e:
-        logger.error(f"Error in approval details: {e}")
-        await message.reply("❌ خطا در پردازش.")
+
+async def notify_review_results(client, processed, status, approved_items):
+    # یک پیام برای هر کاربر، به جای یک پیام برای هر لیست
+    by_user = {}
+    for submission_id, user_id in processed:
+        by_user.setdefault(user_id, []).append(submission_id)
+    
+    for user_id, submission_ids in by_user.items():
+        ids_text = "، ".join(f"#{submission_id}" for submission_id in submission_ids)
+        if status == "approved":
+            text = f"✅ {len(submission_ids)} لیست شما تأیید شد ({ids_text})\nتعداد تأییدشده هر لیست: {approved_items}"
+        else:
+            text = f"❌ {len(submission_ids)} لیست شما رد شد ({ids_text})"
+        try:
+            await outbox.send_message(user_id, text, priority=PRIORITY_NOTICE, wait=False)
+        except Exception as e:
+            logger.error("Failed to notify user %s of review results: %s", user_id, e)
+
+async def notify_review_queue(client):
+    # در حالت صف بررسی، به جای هر لیست حداکثر هر REVIEW_NOTIFY_INTERVAL ثانیه یک اعلان
+    global last_review_notice
+    now = time.monotonic()
+    if now - last_review_notice < REVIEW_NOTIFY_INTERVAL:
+        return
+    last_review_notice = now
+    total = (await db.fetchone("SELECT COUNT(*) FROM submissions WHERE status = 'pending'"))[0]
+    await outbox.send_message(
+        ADMIN_ID,
+        f"📥 {total} لیست در صف بررسی است.",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🗂 صف بررسی", callback_data="review_queue")]
+        ]),
+        priority=PRIORITY_NOTICE,
+        wait=False
+    )
 
 # Message handlers
-@app.on_message(filters.private & ~filters.command(["start", "admin"]))
+@app.on_message(filters.private & ~filters.command(["start", "admin", "export", "rate", "balance_at", "payout", "limits", "profile"]))
 async def handle_message(client, message):
     if not is_bot_active():
         await message.reply("❌ ربات در حال حاضر غیرفعال است.")
@@ -946,58 +1764,19 @@ async def handle_message(client, message):
     if not state:
         return
     
+    route = None
     try:
-        # Registration states
-        if state == "waiting_for_first_name":
-            await handle_first_name(message)
-        elif state == "waiting_for_last_name":
-            await handle_last_name(message)
-        elif state == "waiting_for_group_leader":
-            await handle_group_leader(message)
-        elif state == "waiting_for_card_or_wallet":
-            await handle_card_or_wallet(message)
-        elif state == "waiting_for_sheba":
-            await handle_sheba_number(message)
-        
-        # Edit states
-        elif state == "editing_first_name":
-            await handle_first_name(message, edit_mode=True)
-        elif state == "editing_last_name":
-            await handle_last_name(message, edit_mode=True)
-        elif state == "editing_group_leader":
-            await handle_group_leader(message, edit_mode=True)
-        elif state == "editing_card_or_wallet":
-            await handle_card_or_wallet(message, edit_mode=True)
-        elif state == "editing_sheba":
-            await handle_sheba_number(message, edit_mode=True)
-        
-        # Content submission
-        elif state == "waiting_for_content":
-            await handle_content_submission(client, message)
-        
-        # Support messages
-        elif state == "waiting_for_support":
-            await handle_support_message(client, message)
-        
-        # Admin states
-        elif user_id == ADMIN_ID:
-            if state == "waiting_for_balance_update":
-                await handle_balance_update(client, message)
-            elif state == "waiting_for_reply":
-                await handle_admin_reply(client, message)
-            elif state == "waiting_for_broadcast":
-                await handle_broadcast(client, message)
-            elif state == "waiting_for_private_user":
-                await handle_private_user(client, message)
-            elif state == "waiting_for_private_message":
-                await handle_private_message_send(client, message)
-            elif state == "waiting_for_approval_details":
-                await handle_approval_details(client, message)
-            elif state == "waiting_for_reset_approved":
-                await handle_reset_approved_count_process(client, message)
+        route = state_router.resolve(state, user_id)
+        if route is not None:
+            start = time.perf_counter()
+            try:
+                await route.handler(client, message)
+            finally:
+                HANDLER_SECONDS.labels("message", route.key).observe(time.perf_counter() - start)
 
     except Exception as e:
-        logger.error(f"Error in message handler for user {user_id}, state {state}: {e}")
+        HANDLER_ERRORS.labels("message", route.key if route else "").inc()
+        logger.error("Error in message handler for user %s, state %s: %s", user_id, state, e)
         await message.reply("❌ خطایی رخ داد. لطفاً دوباره تلاش کنید.")
 
         
@@ -1009,26 +1788,21 @@ async def handle_first_name(message, edit_mode=False):
         return
     
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            
-            if edit_mode:
-                c.execute(
-                    "UPDATE users SET first_name = ? WHERE user_id = ?",
-                    (first_name, message.from_user.id))
-                conn.commit()
-                await message.reply("✅ نام شما با موفقیت به‌روزرسانی شد.")
-                clear_user_state(message.from_user.id)
-                await show_main_menu(message)
-            else:
-                c.execute("INSERT OR REPLACE INTO users (user_id, first_name, registered_at) VALUES (?, ?, ?)",
-                    (message.from_user.id, first_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-                conn.commit()
-                await message.reply("📝 لطفاً نام خانوادگی خود را وارد کنید:")
-                set_user_state(message.from_user.id, "waiting_for_last_name")
+        if edit_mode:
+            await db.write(
+                "UPDATE users SET first_name = ? WHERE user_id = ?",
+                (first_name, message.from_user.id))
+            await message.reply("✅ نام شما با موفقیت به‌روزرسانی شد.")
+            clear_user_state(message.from_user.id)
+            await show_main_menu(message)
+        else:
+            await db.write("INSERT OR REPLACE INTO users (user_id, first_name, registered_at) VALUES (?, ?, ?)",
+                (message.from_user.id, first_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            await message.reply("📝 لطفاً نام خانوادگی خود را وارد کنید:")
+            set_user_state(message.from_user.id, "waiting_for_last_name")
                 
     except sqlite3.Error as e:
-        logger.error(f"Database error in first name: {e}")
+        logger.error("Database error in first name: %s", e)
         await message.reply("❌ خطای پایگاه داده.")
 
 async def handle_last_name(message, edit_mode=False):
@@ -1038,27 +1812,20 @@ async def handle_last_name(message, edit_mode=False):
         return
     
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            
-            if edit_mode:
-                c.execute(
-                    "UPDATE users SET last_name = ? WHERE user_id = ?",
-                    (last_name, message.from_user.id))
-                conn.commit()
-                await message.reply("✅ نام خانوادگی شما با موفقیت به‌روزرسانی شد.")
-                clear_user_state(message.from_user.id)
-                await show_main_menu(message)
-            else:
-                c.execute(
-                    "UPDATE users SET last_name = ? WHERE user_id = ?",
-                    (last_name, message.from_user.id))
-                conn.commit()
-                await message.reply("👤 لطفاً نام سرگروه خود را وارد کنید:")
-                set_user_state(message.from_user.id, "waiting_for_group_leader")
+        await db.write(
+            "UPDATE users SET last_name = ? WHERE user_id = ?",
+            (last_name, message.from_user.id))
+        
+        if edit_mode:
+            await message.reply("✅ نام خانوادگی شما با موفقیت به‌روزرسانی شد.")
+            clear_user_state(message.from_user.id)
+            await show_main_menu(message)
+        else:
+            await message.reply("👤 لطفاً نام سرگروه خود را وارد کنید:")
+            set_user_state(message.from_user.id, "waiting_for_group_leader")
                 
     except sqlite3.Error as e:
-        logger.error(f"Database error in last name: {e}")
+        logger.error("Database error in last name: %s", e)
         await message.reply("❌ خطای پایگاه داده.")
 
 async def handle_group_leader(message, edit_mode=False):
@@ -1069,40 +1836,30 @@ async def handle_group_leader(message, edit_mode=False):
     
     user_id = message.from_user.id
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            
-            # بررسی وجود کاربر
-            c.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-            if not c.fetchone():
-                await message.reply("❌ کاربر یافت نشد. لطفاً ابتدا ثبت‌نام کنید.")
-                clear_user_state(user_id)
-                logger.error(f"User {user_id} not found in database for group_leader update")
-                return
-            
-            if edit_mode:
-                c.execute(
-                    "UPDATE users SET group_leader_name = ? WHERE user_id = ?",
-                    (group_leader_name, user_id)
-                )
-                conn.commit()
-                await message.reply("✅ نام سرگروه شما با موفقیت به‌روزرسانی شد.")
-                clear_user_state(user_id)
-                await show_main_menu(message)
-            else:
-                c.execute(
-                    "UPDATE users SET group_leader_name = ? WHERE user_id = ?",
-                    (group_leader_name, user_id)
-                )
-                conn.commit()
-                await message.reply("💳 لطفاً شماره کارت یا آدرس کیف پول خود را وارد کنید:")
-                set_user_state(user_id, "waiting_for_card_or_wallet")
+        # به‌روزرسانی و بررسی وجود کاربر در یک کوئری
+        _, updated = await db.execute(
+            "UPDATE users SET group_leader_name = ? WHERE user_id = ?",
+            (group_leader_name, user_id)
+        )
+        if not updated:
+            await message.reply("❌ کاربر یافت نشد. لطفاً ابتدا ثبت‌نام کنید.")
+            clear_user_state(user_id)
+            logger.error("User %s not found in database for group_leader update", user_id)
+            return
+        
+        if edit_mode:
+            await message.reply("✅ نام سرگروه شما با موفقیت به‌روزرسانی شد.")
+            clear_user_state(user_id)
+            await show_main_menu(message)
+        else:
+            await message.reply("💳 لطفاً شماره کارت یا آدرس کیف پول خود را وارد کنید:")
+            set_user_state(user_id, "waiting_for_card_or_wallet")
                 
     except sqlite3.Error as e:
-        logger.error(f"Database error in group_leader for user {user_id}: {e}")
+        logger.error("Database error in group_leader for user %s: %s", user_id, e)
         await message.reply("❌ خطای پایگاه داده رخ داد. لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید.")
     except Exception as e:
-        logger.error(f"Unexpected error in group_leader for user {user_id}: {e}")
+        logger.error("Unexpected error in group_leader for user %s: %s", user_id, e)
         await message.reply("❌ خطای غیرمنتظره‌ای رخ داد. لطفاً دوباره تلاش کنید.")
 
 async def handle_card_or_wallet(message, edit_mode=False):
@@ -1112,32 +1869,24 @@ async def handle_card_or_wallet(message, edit_mode=False):
         return
     
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            
-            if edit_mode:
-                c.execute(
-                    "UPDATE users SET card_or_wallet = ? WHERE user_id = ?",
-                    (card_or_wallet, message.from_user.id)
-                )
-                conn.commit()
-                await message.reply("✅ شماره کارت یا آدرس کیف پول شما با موفقیت به‌روزرسانی شد.")
-                clear_user_state(message.from_user.id)
-                await show_main_menu(message)
-            else:
-                c.execute(
-                    "UPDATE users SET card_or_wallet = ? WHERE user_id = ?",
-                    (card_or_wallet, message.from_user.id)
-                )
-                conn.commit()
-                await message.reply("🏦 لطفاً شماره شبا خود را وارد کنید:")
-                set_user_state(message.from_user.id, "waiting_for_sheba")
+        await db.write(
+            "UPDATE users SET card_or_wallet = ? WHERE user_id = ?",
+            (card_or_wallet, message.from_user.id)
+        )
+        
+        if edit_mode:
+            await message.reply("✅ شماره کارت یا آدرس کیف پول شما با موفقیت به‌روزرسانی شد.")
+            clear_user_state(message.from_user.id)
+            await show_main_menu(message)
+        else:
+            await message.reply("🏦 لطفاً شماره شبا خود را وارد کنید:")
+            set_user_state(message.from_user.id, "waiting_for_sheba")
                 
     except sqlite3.Error as e:
-        logger.error(f"Database error in card_or_wallet for user {message.from_user.id}: {e}")
+        logger.error("Database error in card_or_wallet for user %s: %s", message.from_user.id, e)
         await message.reply("❌ خطای پایگاه داده.")
     except Exception as e:
-        logger.error(f"Unexpected error in card_or_wallet for user {message.from_user.id}: {e}")
+        logger.error("Unexpected error in card_or_wallet for user %s: %s", message.from_user.id, e)
         await message.reply("❌ خطای غیرمنتظره‌ای رخ داد. لطفاً دوباره تلاش کنید.")
 
 async def handle_sheba_number(message, edit_mode=False):
@@ -1147,33 +1896,23 @@ async def handle_sheba_number(message, edit_mode=False):
         return
     
     try:
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            
-            if edit_mode:
-                c.execute(
-                    "UPDATE users SET sheba_number = ? WHERE user_id = ?",
-                    (sheba_number, message.from_user.id)
-                )
-                conn.commit()
-                await message.reply("✅ شماره شبا شما با موفقیت به‌روزرسانی شد.")
-                clear_user_state(message.from_user.id)
-                await show_main_menu(message)
-            else:
-                c.execute(
-                    "UPDATE users SET sheba_number = ? WHERE user_id = ?",
-                    (sheba_number, message.from_user.id)
-                )
-                conn.commit()
-                await message.reply("✅ ثبت نام شما با موفقیت انجام شد!")
-                clear_user_state(message.from_user.id)
-                await show_main_menu(message)
+        await db.write(
+            "UPDATE users SET sheba_number = ? WHERE user_id = ?",
+            (sheba_number, message.from_user.id)
+        )
+        
+        if edit_mode:
+            await message.reply("✅ شماره شبا شما با موفقیت به‌روزرسانی شد.")
+        else:
+            await message.reply("✅ ثبت نام شما با موفقیت انجام شد!")
+        clear_user_state(message.from_user.id)
+        await show_main_menu(message)
                 
     except sqlite3.Error as e:
-        logger.error(f"Database error in sheba_number for user {message.from_user.id}: {e}")
+        logger.error("Database error in sheba_number for user %s: %s", message.from_user.id, e)
         await message.reply("❌ خطای پایگاه داده.")
     except Exception as e:
-        logger.error(f"Unexpected error in sheba_number for user {message.from_user.id}: {e}")
+        logger.error("Unexpected error in sheba_number for user %s: %s", message.from_user.id, e)
         await message.reply("❌ خطای غیرمنتظره‌ای رخ داد. لطفاً دوباره تلاش کنید.")
 
 # Content submission handler
@@ -1191,79 +1930,107 @@ async def handle_content_submission(client, message):
             content_type = "text"
             if not content:
                 await message.reply("❌ متن نمی‌تواند خالی باشد. لطفاً لیست خود را وارد کنید:")
-                logger.warning(f"Empty text content attempt by user {user_id}")
+                logger.warning("Empty text content attempt by user %s", user_id)
                 return
         elif message.photo:
             content = message.photo.file_id
             content_type = "photo"
         else:
             await message.reply("❌ نوع لیست ارسالی پشتیبانی نمی‌شود. لطفاً متن یا عکس ارسال کنید.")
-            logger.warning(f"Unsupported content type by user {user_id}")
+            logger.warning("Unsupported content type by user %s", user_id)
             return
 
-        # ثبت شماره در پایگاه داده
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO submissions (user_id, content, content_type, submitted_at, status) VALUES (?, ?, ?, ?, ?)",
-                (user_id, content, content_type, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "pending")
-            )
-            submission_id = c.lastrowid
-            conn.commit()
-            logger.info(f"Content submission {submission_id} from user {user_id} stored")
+        # اعتبارسنجی شماره‌های لیست متنی قبل از ثبت و اطلاع به ادمین
+        check = None
+        if content_type == "text":
+            check = check_list(content)
+            if not MIN_LIST_NUMBERS <= check["valid"] <= MAX_LIST_NUMBERS:
+                await message.reply(
+                    f"❌ لیست شما {check['valid']} شماره معتبر دارد "
+                    f"(نامعتبر: {check['invalid']}، تکراری: {check['duplicates']}).\n"
+                    f"هر لیست باید بین {MIN_LIST_NUMBERS} تا {MAX_LIST_NUMBERS} شماره سالم داشته باشد. "
+                    "لطفاً لیست اصلاح‌شده را ارسال کنید:"
+                )
+                logger.info("List from user %s rejected on submit: %s valid numbers", user_id, check['valid'])
+                return
+
+        # ثبت شماره در پایگاه داده (همراه با ایندکس شماره‌ها و شمارش تکراری‌ها)
+        submission_id, stats = await db.run(
+            store_submission, user_id, content, content_type, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), check
+        )
+        logger.info("Content submission %s from user %s stored", submission_id, user_id)
 
         # پاسخ به کاربر
         await message.reply("✅ لیست شما با موفقیت ارسال شد و در انتظار تأیید است.")
         clear_user_state(user_id)
 
         # دریافت نام کاربر برای نمایش در پیام ادمین
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT first_name, last_name FROM users WHERE user_id = ?", (user_id,))
-            user = c.fetchone()
-            user_name = f"{user[0]} {user[1]}" if user else "ناشناس"
+        user = await db.fetchone("SELECT first_name, last_name FROM users WHERE user_id = ?", (user_id,))
+        user_name = f"{user[0]} {user[1]}" if user else "ناشناس"
+
+        # در حالت صف بررسی (یا وقتی سقف اعلان‌های ادمین پر است) لیست در صف
+        # می‌ماند و فقط اعلان تجمیعی ارسال می‌شود
+        if REVIEW_QUEUE_MODE or not flood_guard.allow_admin_notification():
+            try:
+                await notify_review_queue(client)
+            except Exception as e:
+                logger.error("Failed to notify admin of review queue: %s", e)
+            return
+
+        # ارسال به ادمین بدون صبر برای صف خروجی (سهمیه هر چت ADMIN_ID را در
+        # بار زیاد چند ثانیه عقب می‌اندازد)؛ اگر ارسال نهایتاً شکست بخورد و لیست
+        # در این فاصله (مثلاً از صف بررسی) بررسی نشده باشد، حذف و به کاربر
+        # اطلاع داده می‌شود
+        async def admin_notification_failed(error):
+            logger.error("Failed to send content to admin: %s", error)
+            if not await db.run(delete_submission, submission_id):
+                logger.info("Submission %s already reviewed; kept despite admin notification failure", submission_id)
+                return
+            logger.info("Submission %s deleted due to admin notification failure", submission_id)
+            await outbox.send_message(user_id, "❌ خطا در ارسال شماره به ادمین. لطفاً دوباره تلاش کنید.",
+                                      priority=PRIORITY_NOTICE, wait=False)
 
-        # ارسال به ادمین
         try:
             if content_type == "text":
-                await client.send_message(
+                await outbox.send_message(
                     ADMIN_ID,
-                    f"📨 لیست جدید از کاربر {user_name} (ID: {user_id}, Submission ID: {submission_id}):\n\n{content}",
+                    f"📨 لیست جدید از کاربر {user_name} (ID: {user_id}, Submission ID: {submission_id}):\n"
+                    f"{format_duplicate_stats(stats)}\n\n{content}",
                     reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("✅ تأیید", callback_data=f"approve_{submission_id}")],
+                        [InlineKeyboardButton(f"✅ تأیید با {stats['suggested']}", callback_data=f"accept_{submission_id}"),
+                        InlineKeyboardButton("✏️ تأیید با عدد دیگر", callback_data=f"approve_{submission_id}")],
                         [InlineKeyboardButton("❌ رد", callback_data=f"reject_{submission_id}")]
-                    ])
+                    ]),
+                    priority=PRIORITY_NOTICE,
+                    wait=False,
+                    on_failure=admin_notification_failed
                 )
             else:
-                await client.send_photo(
+                await outbox.send_photo(
                     ADMIN_ID,
                     photo=content,
                     caption=f"📸 عکس جدید از کاربر {user_name} (ID: {user_id}, Submission ID: {submission_id})",
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("✅ تأیید", callback_data=f"approve_{submission_id}")],
                         [InlineKeyboardButton("❌ رد", callback_data=f"reject_{submission_id}")]
-                    ])
+                    ]),
+                    priority=PRIORITY_NOTICE,
+                    wait=False,
+                    on_failure=admin_notification_failed
                 )
-            logger.info(f"Content submission {submission_id} sent to admin")
+            logger.info("Content submission %s queued for admin", submission_id)
         except Exception as e:
-            logger.error(f"Failed to send content to admin: {e}")
-            await client.send_message(user_id, "❌ خطا در ارسال شماره به ادمین. لطفاً دوباره تلاش کنید.")
-            with sqlite3.connect('bot_db.db') as conn:
-                c = conn.cursor()
-                c.execute("DELETE FROM submissions WHERE id = ?", (submission_id,))
-                conn.commit()
-                logger.info(f"Submission {submission_id} deleted due to admin notification failure")
-            return
+            await admin_notification_failed(e)
 
     except sqlite3.Error as e:
-        logger.error(f"Database error in content submission: {e}")
+        logger.error("Database error in content submission: %s", e)
         await message.reply("❌ خطای پایگاه داده. لطفاً دوباره تلاش کنید.")
     except Exception as e:
-        logger.error(f"Error in content submission: {e}")
+        logger.error("Error in content submission: %s", e)
         await message.reply("❌ خطا در ارسال شماره.")
 
 # Support message handler
-@app.on_message(filters.private & filters.text & ~filters.command(["start", "admin"]))
+@app.on_message(filters.private & filters.text & ~filters.command(["start", "admin", "export", "rate", "balance_at", "payout", "limits", "profile"]))
 async def handle_support_message(client, message):
     user_id = message.from_user.id
     if get_user_state(user_id) != "waiting_for_support":
@@ -1273,46 +2040,56 @@ async def handle_support_message(client, message):
         message_text = message.text.strip()
         if not message_text:
             await message.reply("❌ پیام نمی‌تواند خالی باشد. لطفاً پیام خود را وارد کنید:")
-            logger.warning(f"Empty support message attempt by user {user_id}")
+            logger.warning("Empty support message attempt by user %s", user_id)
             return
 
-        # ثبت پیام در پایگاه داده
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO support_messages (user_id, message, direction, created_at) VALUES (?, ?, ?, ?)",
-                (user_id, message_text, "user_to_admin", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            )
-            conn.commit()
-            logger.info(f"Support message from user {user_id} stored")
+        # ثبت پیام در تیکت باز کاربر (یا تیکت جدید)
+        ticket_id = await db.run(add_message, user_id, message_text, "user_to_admin")
+        logger.info("Support message from user %s stored in ticket %s", user_id, ticket_id)
 
-        # ارسال پیام به ادمین
-        try:
-            await client.send_message(
+        # ارسال پیام به ادمین (اگر سقف اعلان‌ها پر باشد پیام فقط در پیام‌های
+        # پشتیبانی پنل ادمین دیده می‌شود)
+        if not flood_guard.allow_admin_notification():
+            logger.warning("Admin notification cap reached; support message from %s not forwarded", user_id)
+        else:
+            # بدون صبر برای صف خروجی؛ پیام در تیکت ثبت شده است و اگر اعلان به
+            # ادمین نرسد همچنان در پیام‌های پشتیبانی پنل ادمین دیده می‌شود
+            async def admin_notification_failed(error):
+                logger.error("Failed to send support message to admin (kept in ticket #%s): %s", ticket_id, error)
+
+            await outbox.send_message(
                 ADMIN_ID,
-                f"📩 پیام پشتیبانی جدید از کاربر {user_id}:\n\n{message_text}",
+                f"📩 پیام پشتیبانی جدید از کاربر {user_id} (تیکت #{ticket_id}):\n\n{message_text}",
                 reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("💬 پاسخ", callback_data=f"reply_{user_id}")]
-                ])
+                    [InlineKeyboardButton("💬 پاسخ", callback_data=f"reply_{user_id}"),
+                    InlineKeyboardButton("📜 گفتگو", callback_data=f"thread_{user_id}_0")]
+                ]),
+                priority=PRIORITY_NOTICE,
+                wait=False,
+                on_failure=admin_notification_failed
             )
-            logger.info(f"Support message sent to admin from user {user_id}")
-        except Exception as e:
-            logger.error(f"Failed to send support message to admin: {e}")
-            await message.reply("❌ خطا در ارسال پیام به ادمین. لطفاً بعداً تلاش کنید.")
-            return
+            logger.info("Support message from user %s queued for admin", user_id)
 
         # پاسخ به کاربر
         await message.reply("✅ پیام شما با موفقیت به پشتیبانی ارسال شد.")
         clear_user_state(user_id)
 
     except sqlite3.Error as e:
-        logger.error(f"Database error in support message: {e}")
+        logger.error("Database error in support message: %s", e)
         await message.reply("❌ خطای پایگاه داده. لطفاً دوباره تلاش کنید.")
     except Exception as e:
-        logger.error(f"Error in support message: {e}")
+        logger.error("Error in support message: %s", e)
         await message.reply("❌ خطا در پردازش پیام پشتیبانی.")
 
 # Admin balance update handler
+def _update_balance(conn, user_id, new_balance, admin_id):
+    # تغییر دستی به صورت تراکنش اصلاحی در دفتر ثبت می‌شود
+    delta = set_balance(conn, user_id, new_balance, admin_id)
+    # اگر موجودی صفر شود، تعداد تأیید شده‌ها نیز صفر شود
+    if delta is not None and new_balance == 0:
+        conn.execute("UPDATE users SET approved_count = 0 WHERE user_id = ?", (user_id,))
+    return delta is not None
+
 async def handle_balance_update(client, message):
     try:
         parts = message.text.strip().split()
@@ -1322,27 +2099,12 @@ async def handle_balance_update(client, message):
         target_user_id = int(parts[0])
         new_balance = float(parts[1])
         
-        with sqlite3.connect('bot_db.db') as conn:
-            c = conn.cursor()
-            
-            # بررسی وجود کاربر
-            c.execute("SELECT user_id FROM users WHERE user_id = ?", (target_user_id,))
-            if not c.fetchone():
-                await message.reply(f"❌ کاربر با شناسه {target_user_id} یافت نشد.")
-                return
-            
-            # اگر موجودی صفر شود، تعداد تأیید شده‌ها نیز صفر شود
-            if new_balance == 0:
-                c.execute(
-                    "UPDATE users SET balance = ?, approved_count = 0 WHERE user_id = ?",
-                    (new_balance, target_user_id)
-                )
-            else:
-                c.execute(
-                    "UPDATE users SET balance = ? WHERE user_id = ?",
-                    (new_balance, target_user_id)
-                )
-            conn.commit()
+        updated = await db.run(_update_balance, target_user_id, new_balance, message.from_user.id)
+        
+        # بررسی وجود کاربر
+        if not updated:
+            await message.reply(f"❌ کاربر با شناسه {target_user_id} یافت نشد.")
+            return
         
         balance_message = f"✅ موجودی کاربر {target_user_id} به {new_balance:,.0f} تومان به‌روزرسانی شد."
         if new_balance == 0:
@@ -1355,22 +2117,30 @@ async def handle_balance_update(client, message):
             user_message = f"💰 موجودی حساب شما به {new_balance:,.0f} تومان به‌روزرسانی شد."
             if new_balance == 0:
                 user_message += "\n🔄 تعداد تأیید شده‌های شما نیز صفر شد."
-            await client.send_message(target_user_id, user_message)
-            logger.info(f"User {target_user_id} notified of balance update")
+            await outbox.send_message(target_user_id, user_message, priority=PRIORITY_ADMIN, wait=False)
+            logger.info("User %s notified of balance update", target_user_id)
         except Exception as e:
-            logger.error(f"Error notifying user {target_user_id}: {e}")
+            logger.error("Error notifying user %s: %s", target_user_id, e)
             await message.reply(f"❌ خطا در ارسال پیام به کاربر {target_user_id}: {str(e)}")
         
     except ValueError:
         await message.reply("❌ فرمت نامعتبر. لطفاً به این فرمت وارد کنید:\nشناسه_کاربر مبلغ\nمثال: 12345 100000")
     except sqlite3.Error as e:
-        logger.error(f"Database error in balance update: {e}")
+        logger.error("Database error in balance update: %s", e)
         await message.reply("❌ خطای پایگاه داده.")
     except Exception as e:
-        logger.error(f"Error in balance update: {e}")
+        logger.error("Error in balance update: %s", e)
         await message.reply("❌ خطایی در به‌روزرسانی موجودی رخ داد.")
 
 # Admin reply handler
+def _store_admin_reply(conn, user_id, reply_text):
+    c = conn.cursor()
+    c.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
+    if not c.fetchone():
+        return False
+    add_message(conn, user_id, reply_text, "admin_to_user")
+    return True
+
 async def handle_admin_reply(client, message):
     state = get_user_state(message.from_user.id)
     state_data = get_state_data(message.from_user.id)
@@ -1382,51 +2152,154 @@ async def handle_admin_reply(client, message):
 
             if not reply_text:
                 await message.reply("❌ پیام پاسخ نمی‌تواند خالی باشد. لطفاً دوباره وارد کنید:")
-                logger.warning(f"Empty reply attempt by admin for user {user_id}")
+                logger.warning("Empty reply attempt by admin for user %s", user_id)
                 return
 
-            # Verify user exists
-            with sqlite3.connect('bot_db.db') as conn:
-                c = conn.cursor()
-                c.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-                if not c.fetchone():
-                    await message.reply(f"❌ کاربر با شناسه {user_id} یافت نشد.")
-                    clear_user_state(message.from_user.id)
-                    logger.error(f"User {user_id} not found for reply")
-                    return
-
-                # Store reply in database
-                c.execute(
-                    "INSERT INTO support_messages (user_id, message, direction, created_at) VALUES (?, ?, ?, ?)",
-                    (user_id, reply_text, "admin_to_user", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                )
-                conn.commit()
-                logger.info(f"Support reply stored for user {user_id}")
+            # Verify user exists and store reply in database
+            stored = await db.run(_store_admin_reply, user_id, reply_text)
+            if not stored:
+                await message.reply(f"❌ کاربر با شناسه {user_id} یافت نشد.")
+                clear_user_state(message.from_user.id)
+                logger.error("User %s not found for reply", user_id)
+                return
+            logger.info("Support reply stored for user %s", user_id)
 
             # Send reply to user
             try:
-                await client.send_message(user_id, f"📩 پاسخ پشتیبانی:\n\n{reply_text}")
+                await outbox.send_message(user_id, f"📩 پاسخ پشتیبانی:\n\n{reply_text}", priority=PRIORITY_ADMIN)
                 await message.reply(f"✅ پاسخ شما به کاربر {user_id} ارسال شد.")
-                logger.info(f"Reply sent to user {user_id}")
+                logger.info("Reply sent to user %s", user_id)
             except Exception as e:
-                logger.error(f"Error sending message to user {user_id}: {e}")
+                logger.error("Error sending message to user %s: %s", user_id, e)
                 await message.reply(f"❌ خطا در ارسال پیام به کاربر {user_id}: {str(e)}")
 
             clear_user_state(message.from_user.id)
 
         except sqlite3.Error as e:
-            logger.error(f"Database error in admin reply: {e}")
+            logger.error("Database error in admin reply: %s", e)
             await message.reply("❌ خطای پایگاه داده.")
             clear_user_state(message.from_user.id)
         except Exception as e:
-            logger.error(f"Error in admin reply: {e}")
+            logger.error("Error in admin reply: %s", e)
             await message.reply("❌ خطا در ارسال پاسخ.")
             clear_user_state(message.from_user.id)
 
+# Routing tables for handle_callback (callback_data) and handle_message (user state)
+def prompt_edit(prompt, state):
+    async def handler(client, callback_query):
+        await callback_query.message.reply(prompt)
+        set_user_state(callback_query.from_user.id, state)
+    return handler
+
+callback_router = Router([ADMIN_ID])
+callback_router.add("register", lambda client, cq: handle_register(cq))
+callback_router.add("check_membership", handle_check_membership, answers=True)
+callback_router.add("submit_content", handle_submit_content, answers=True)
+callback_router.add("my_profile", lambda client, cq: handle_my_profile(cq))
+callback_router.add("edit_profile", handle_edit_profile)
+callback_router.add("back_to_main", lambda client, cq: show_main_menu(cq.message))
+callback_router.add("support", handle_support_callback, answers=True)
+callback_router.add("check_balance", handle_check_balance)
+callback_router.add("cancel_reply", handle_cancel_reply)
+callback_router.add("edit_first_name", prompt_edit("✏️ لطفاً نام جدید خود را وارد کنید:", "editing_first_name"))
+callback_router.add("edit_last_name", prompt_edit("✏️ لطفاً نام خانوادگی جدید خود را وارد کنید:", "editing_last_name"))
+callback_router.add("edit_group_leader", prompt_edit("✏️ لطفاً نام سرگروه جدید خود را وارد کنید:", "editing_group_leader"))
+callback_router.add("edit_card_or_wallet", prompt_edit("💳 لطفاً شماره کارت یا آدرس کیف پول جدید خود را وارد کنید:", "editing_card_or_wallet"))
+callback_router.add("edit_sheba", prompt_edit("🏦 لطفاً شماره شبا جدید خود را وارد کنید:", "editing_sheba"))
+# Admin callbacks
+callback_router.add("toggle_bot", handle_toggle_bot, admin=True, offline=True)
+callback_router.add("view_users", handle_view_users, admin=True)
+callback_router.add("users_csv", handle_users_csv, admin=True)
+callback_router.add_prefix("users_page_", handle_users_page, admin=True, answers=True)
+callback_router.add_prefix("users_prev_", handle_users_page, admin=True, answers=True)
+callback_router.add("manage_balances", handle_manage_balances, admin=True)
+callback_router.add("view_support", handle_view_support, admin=True)
+callback_router.add_prefix("tickets_", handle_tickets_page, admin=True, answers=True)
+callback_router.add_prefix("thread_", handle_thread, admin=True, answers=True)
+callback_router.add_prefix("ticket_close_", handle_ticket_close, admin=True, answers=True)
+callback_router.add("broadcast_message", handle_broadcast_message, admin=True)
+callback_router.add("private_message", handle_private_message, admin=True)
+callback_router.add("reset_approved_count", handle_reset_approved_count, admin=True)
+callback_router.add("job_list", handle_view_jobs, admin=True, offline=True)
+callback_router.add_prefix("job_status_", handle_job_status, admin=True, offline=True, answers=True)
+callback_router.add_prefix("job_cancel_", handle_job_cancel, admin=True, offline=True, answers=True)
+callback_router.add_prefix("job_list_cancel_", handle_job_list_cancel, admin=True, offline=True, answers=True)
+callback_router.add_prefix("reply_", handle_reply_callback, admin=True, answers=True)
+callback_router.add_prefix("approve_", handle_content_approval, admin=True, answers=True)
+callback_router.add_prefix("reject_", handle_content_approval, admin=True, answers=True)
+callback_router.add_prefix("accept_", handle_content_approval, admin=True, answers=True)
+callback_router.add("review_queue", handle_review_queue, admin=True)
+callback_router.add("profile_toggle", handle_profile_toggle, admin=True, offline=True)
+callback_router.add("rq_first", handle_review_action, admin=True, answers=True)
+callback_router.add("rq_approve", handle_review_action, admin=True, answers=True)
+callback_router.add("rq_reject", handle_review_action, admin=True, answers=True)
+callback_router.add_prefix("rq_toggle_", handle_review_action, admin=True, answers=True)
+callback_router.add_prefix("rq_next_", handle_review_action, admin=True, answers=True)
+callback_router.add_prefix("rq_view_", handle_review_action, admin=True, answers=True)
+
+state_router = Router([ADMIN_ID])
+# Registration states
+state_router.add("waiting_for_first_name", lambda client, message: handle_first_name(message))
+state_router.add("waiting_for_last_name", lambda client, message: handle_last_name(message))
+state_router.add("waiting_for_group_leader", lambda client, message: handle_group_leader(message))
+state_router.add("waiting_for_card_or_wallet", lambda client, message: handle_card_or_wallet(message))
+state_router.add("waiting_for_sheba", lambda client, message: handle_sheba_number(message))
+# Edit states
+state_router.add("editing_first_name", lambda client, message: handle_first_name(message, edit_mode=True))
+state_router.add("editing_last_name", lambda client, message: handle_last_name(message, edit_mode=True))
+state_router.add("editing_group_leader", lambda client, message: handle_group_leader(message, edit_mode=True))
+state_router.add("editing_card_or_wallet", lambda client, message: handle_card_or_wallet(message, edit_mode=True))
+state_router.add("editing_sheba", lambda client, message: handle_sheba_number(message, edit_mode=True))
+# Content submission and support messages
+state_router.add("waiting_for_content", handle_content_submission)
+state_router.add("waiting_for_support", handle_support_message)
+# Admin states
+state_router.add("waiting_for_balance_update", handle_balance_update, admin=True)
+state_router.add("waiting_for_reply", handle_admin_reply, admin=True)
+state_router.add("waiting_for_broadcast", handle_broadcast, admin=True)
+state_router.add("waiting_for_private_user", handle_private_user, admin=True)
+state_router.add("waiting_for_private_message", handle_private_message_send, admin=True)
+state_router.add("waiting_for_approval_details", handle_approval_details, admin=True)
+state_router.add("waiting_for_reset_approved", handle_reset_approved_count_process, admin=True)
+state_router.add("waiting_for_bulk_approval", handle_bulk_approval, admin=True)
+
 # Run the bot
+async def main():
+    await app.start()
+    if WATCHDOG_THRESHOLD:
+        watchdog.start()
+    state_store.start()
+    if METRICS_PORT:
+        await serve_metrics(METRICS_HOST, METRICS_PORT)
+    # پیام‌های صف‌شده قبل از ری‌استارت (در حالت پایدار) همین‌جا دوباره صف می‌شوند
+    await outbox.start()
+    if BOT_STATUS_REFRESH_INTERVAL:
+        asyncio.ensure_future(bot_status.refresh_loop(BOT_STATUS_REFRESH_INTERVAL))
+    if BALANCE_RECONCILE_INTERVAL:
+        asyncio.ensure_future(reconcile_loop(db, BALANCE_RECONCILE_INTERVAL))
+    if BALANCE_SNAPSHOT_INTERVAL:
+        asyncio.ensure_future(snapshot_loop(db, BALANCE_SNAPSHOT_INTERVAL))
+    # ادامه تسویه نیمه‌تمام قبل از ری‌استارت
+    run = await db.fetchone("SELECT id, created_by FROM payout_runs WHERE status = 'running' ORDER BY id LIMIT 1")
+    if run:
+        logger.info("Resuming payout run %s", run[0])
+        # created_by شناسه ادمین است که در چت خصوصی همان شناسه چت اوست
+        spawn_payout(app, run[1], run[0], admin_id=run[1])
+    # ادامه ارسال‌های همگانی نیمه‌تمام قبل از ری‌استارت
+    await broadcaster.resume()
+    await idle()
+    await outbox.stop()
+    watchdog.stop()
+    await app.stop()
+    if isinstance(state_store, SQLiteStateStore):
+        await state_store.flush()
+
 if __name__ == "__main__":
     init_db()
     signal.signal(signal.SIGINT, lambda signum, frame: sys.exit(0))
     signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     logger.info("Starting bot...")
-    app.run()
\ No newline at end of file
+    try:
+        app.run(main())
+    finally:
+        db.close()
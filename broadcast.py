@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from pyrogram.errors import FloodWait
+from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from logs import LogSampler
+from outbox import PRIORITY_ADMIN, PRIORITY_BROADCAST
+from ratelimit import SendRateLimiter
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT DEFAULT 'broadcast',
+        text TEXT,
+        status TEXT DEFAULT 'running',  -- running, done, failed, cancelled
+        created_by INTEGER,
+        progress_chat_id INTEGER,
+        progress_message_id INTEGER,
+        last_user_id INTEGER DEFAULT 0,  -- کرسر keyset روی users.user_id
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        created_at TEXT,
+        finished_at TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        job_id INTEGER,
+        user_id INTEGER,
+        status TEXT,  -- sent, failed
+        error TEXT,
+        delivered_at TEXT,
+        PRIMARY KEY(job_id, user_id),
+        FOREIGN KEY(job_id) REFERENCES broadcast_jobs(id)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status)',
+]
+
+
+def init_broadcast_tables(c):
+    for statement in BROADCAST_SCHEMA:
+        c.execute(statement)
+
+
+class JobStats:
+    # شمارنده‌های زنده یک job برای نمایش وضعیت و نرخ ارسال
+
+    def __init__(self, sent=0, failed=0, total=0):
+        self.sent = sent
+        self.failed = failed
+        self.total = total
+        self.processed_since_start = 0
+        self.started = time.monotonic()
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.processed_since_start / elapsed if elapsed > 0 else 0.0
+
+
+class BroadcastManager:
+    # ارسال همگانی به صورت job: کاربران به ترتیب user_id در قطعه‌های chunk_size
+    # خوانده می‌شوند، با حداکثر concurrency ارسال همزمان و زیر محدودیت نرخ
+    # تلگرام فرستاده می‌شوند و نتیجه هر قطعه در یک تراکنش ثبت می‌شود تا بعد از
+    # ری‌استارت از همان‌جا ادامه پیدا کند.
+    # اگر outbox داده شود ارسال‌ها با پایین‌ترین اولویت از صف مرکزی می‌گذرند تا
+    # پاسخ‌های ادمین و اطلاع‌رسانی‌ها پشت ارسال همگانی نمانند.
+    # لاگ نتیجه هر گیرنده فقط برای یک مورد از هر log_sample مورد نوشته می‌شود.
+
+    def __init__(self, client, db, global_rate=25, per_chat_rate=1, concurrency=8,
+                 chunk_size=200, progress_interval=5.0, max_retries=3, outbox=None, log_sample=1):
+        self.client = client
+        self.db = db
+        self.outbox = outbox
+        self._sent_log = LogSampler(logger, log_sample)
+        self._failed_log = LogSampler(logger, log_sample)
+        self.limiter = SendRateLimiter(global_rate, per_chat_rate)
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.max_retries = max_retries
+        self._tasks = {}
+        self._stats = {}
+
+    async def start_job(self, admin_chat_id, text, kind="broadcast"):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        job_id = await self.db.run(_create_job, kind, text, admin_chat_id, now)
+
+        try:
+            text = f"📢 ارسال همگانی #{job_id} در حال شروع..."
+            if self.outbox is not None:
+                # durable=False چون شناسه پیام پیشرفت لازم است و ارسال دوباره آن
+                # بعد از ری‌استارت به job وصل نمی‌شود
+                progress = await self.outbox.send_message(
+                    admin_chat_id, text, PRIORITY_ADMIN, durable=False, reply_markup=_job_keyboard(job_id)
+                )
+            else:
+                progress = await self.client.send_message(admin_chat_id, text, reply_markup=_job_keyboard(job_id))
+            await self.db.execute(
+                "UPDATE broadcast_jobs SET progress_chat_id = ?, progress_message_id = ? WHERE id = ?",
+                (progress.chat.id, progress.id, job_id)
+            )
+        except Exception as e:
+            logger.error("Failed to send progress message for broadcast %s: %s", job_id, e)
+
+        self._spawn(job_id)
+        logger.info("Broadcast job %s (%s) started by %s", job_id, kind, admin_chat_id)
+        return job_id
+
+    async def resume(self):
+        rows = await self.db.fetchall("SELECT id FROM broadcast_jobs WHERE status = 'running'")
+        for (job_id,) in rows:
+            if job_id not in self._tasks:
+                logger.info("Resuming broadcast job %s", job_id)
+                self._spawn(job_id)
+
+    def _spawn(self, job_id):
+        task = asyncio.ensure_future(self._run(job_id))
+        self._tasks[job_id] = task
+
+        def _done(_):
+            self._tasks.pop(job_id, None)
+            self._stats.pop(job_id, None)
+
+        task.add_done_callback(_done)
+
+    async def cancel_job(self, job_id):
+        _, updated = await self.db.execute(
+            "UPDATE broadcast_jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'running'",
+            (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id)
+        )
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        if updated:
+            logger.info("Broadcast job %s cancelled", job_id)
+        return bool(updated)
+
+    async def cancel_kind(self, kind):
+        # لغو همه jobهای در حال اجرای یک نوع (مثلاً اطلاعیه قبلی وضعیت ربات)
+        rows = await self.db.fetchall(
+            "SELECT id FROM broadcast_jobs WHERE kind = ? AND status = 'running'",
+            (kind,)
+        )
+        for (job_id,) in rows:
+            await self.cancel_job(job_id)
+
+    async def job_status(self, job_id):
+        row = await self.db.fetchone(
+            "SELECT kind, status, sent, failed, total, created_at, finished_at FROM broadcast_jobs WHERE id = ?",
+            (job_id,)
+        )
+        if not row:
+            return None
+        kind, status, sent, failed, total, created_at, finished_at = row
+        stats = self._stats.get(job_id)
+        if stats is not None:
+            sent, failed = stats.sent, stats.failed
+        return {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "sent": sent,
+            "failed": failed,
+            "total": total,
+            "throughput": stats.throughput() if stats is not None else 0.0,
+            "created_at": created_at,
+            "finished_at": finished_at,
+        }
+
+    async def _run(self, job_id):
+        try:
+            job = await self.db.fetchone(
+                "SELECT text, progress_chat_id, progress_message_id, last_user_id, total, sent, failed "
+                "FROM broadcast_jobs WHERE id = ?",
+                (job_id,)
+            )
+            if not job:
+                return
+            text, chat_id, message_id, last_user_id, total, sent, failed = job
+            stats = self._stats[job_id] = JobStats(sent, failed, total)
+            last_edit = 0.0
+
+            while True:
+                user_ids = await self.db.run(_next_chunk, job_id, last_user_id, self.chunk_size)
+                if not user_ids:
+                    break
+
+                results = await self._send_chunk(text, user_ids, stats)
+                last_user_id = user_ids[-1]
+                await self.db.run(_record_chunk, job_id, last_user_id, results)
+
+                if chat_id and time.monotonic() - last_edit >= self.progress_interval:
+                    last_edit = time.monotonic()
+                    await self.update_progress(job_id, chat_id, message_id)
+
+            await self.db.execute(
+                "UPDATE broadcast_jobs SET status = 'done', finished_at = ? WHERE id = ? AND status = 'running'",
+                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job_id)
+            )
+            self._stats.pop(job_id, None)
+            if chat_id:
+                await self.update_progress(job_id, chat_id, message_id)
+            logger.info("Broadcast job %s finished: %s sent, %s failed", job_id, stats.sent, stats.failed)
+
+        except asyncio.CancelledError:
+            # وضعیت cancelled را cancel_job ثبت کرده است؛ نتایج قطعه جاری ثبت نمی‌شود
+            # و در صورت ادامه دستی دوباره ارسال خواهد شد
+            logger.info("Broadcast job %s stopped", job_id)
+            raise
+        except Exception as e:
+            logger.error("Broadcast job %s failed: %s", job_id, e)
+            try:
+                await self.db.execute("UPDATE broadcast_jobs SET status = 'failed' WHERE id = ? AND status = 'running'", (job_id,))
+            except Exception as db_e:
+                logger.error("Failed to mark broadcast job %s as failed: %s", job_id, db_e)
+
+    async def _send_chunk(self, text, user_ids, stats):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(user_id):
+            async with semaphore:
+                result = await self._send_one(user_id, text)
+            if result[1] is None:
+                stats.sent += 1
+            else:
+                stats.failed += 1
+            stats.processed_since_start += 1
+            return result
+
+        return await asyncio.gather(*(send(user_id) for user_id in user_ids))
+
+    async def _send_one(self, user_id, text):
+        if self.outbox is not None:
+            # FloodWait و محدودیت نرخ را outbox مدیریت می‌کند؛ durable=False چون
+            # خود job بعد از ری‌استارت قطعه ثبت‌نشده را دوباره می‌فرستد
+            try:
+                await self.outbox.send_message(user_id, text, PRIORITY_BROADCAST, durable=False)
+                self._sent_log.log(logging.INFO, "Broadcast sent to user %s", user_id)
+                return user_id, None
+            except Exception as e:
+                self._failed_log.log(logging.ERROR, "Failed to send broadcast to user %s: %s", user_id, e)
+                return user_id, str(e)
+
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(user_id)
+            try:
+                await self.client.send_message(user_id, text)
+                self._sent_log.log(logging.INFO, "Broadcast sent to user %s", user_id)
+                return user_id, None
+            except FloodWait as e:
+                # کل ارسال‌ها را به اندازه FloodWait متوقف می‌کنیم و دوباره تلاش می‌کنیم
+                logger.warning("FloodWait %ss while broadcasting to %s (attempt %s)", e.value, user_id, attempt + 1)
+                self.limiter.pause(e.value)
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                self._failed_log.log(logging.ERROR, "Failed to send broadcast to user %s: %s", user_id, e)
+                return user_id, str(e)
+        return user_id, "FloodWait retries exhausted"
+
+    async def update_progress(self, job_id, chat_id, message_id):
+        status = await self.job_status(job_id)
+        if status is None:
+            return
+        try:
+            await self.client.edit_message_text(
+                chat_id,
+                message_id,
+                format_job_status(status),
+                reply_markup=_job_keyboard(job_id) if status["status"] == "running" else None
+            )
+        except Exception as e:
+            logger.error("Failed to update progress for broadcast %s: %s", job_id, e)
+
+
+JOB_STATUS_LABELS = {
+    "running": "📢 در حال انجام...",
+    "done": "✅ به پایان رسید.",
+    "failed": "❌ با خطا متوقف شد.",
+    "cancelled": "⛔ لغو شد.",
+}
+
+
+def format_job_status(status):
+    text = (
+        f"ارسال همگانی #{status['id']} {JOB_STATUS_LABELS.get(status['status'], status['status'])}\n\n"
+        f"✅ ارسال‌شده: {status['sent']}\n"
+        f"❌ ناموفق: {status['failed']}\n"
+        f"👥 کل: {status['total']}"
+    )
+    if status["status"] == "running":
+        text += f"\n⚡️ سرعت: {status['throughput']:.1f} پیام در ثانیه"
+    return text
+
+
+def _job_keyboard(job_id):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 وضعیت", callback_data=f"job_status_{job_id}"),
+        InlineKeyboardButton("⛔ لغو", callback_data=f"job_cancel_{job_id}")]
+    ])
+
+
+def _create_job(conn, kind, text, admin_chat_id, now):
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM users")
+    total = c.fetchone()[0]
+    c.execute(
+        "INSERT INTO broadcast_jobs (kind, text, created_by, total, created_at) VALUES (?, ?, ?, ?, ?)",
+        (kind, text, admin_chat_id, total, now)
+    )
+    return c.lastrowid
+
+
+def _next_chunk(conn, job_id, last_user_id, limit):
+    # کاربرانی که برای این job هنوز تحویلی ثبت نشده است
+    rows = conn.execute(
+        "SELECT u.user_id FROM users u "
+        "LEFT JOIN broadcast_deliveries d ON d.job_id = ? AND d.user_id = u.user_id "
+        "WHERE u.user_id > ? AND d.user_id IS NULL "
+        "ORDER BY u.user_id LIMIT ?",
+        (job_id, last_user_id, limit)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _record_chunk(conn, job_id, last_user_id, results):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany(
+        "INSERT OR IGNORE INTO broadcast_deliveries (job_id, user_id, status, error, delivered_at) VALUES (?, ?, ?, ?, ?)",
+        [(job_id, user_id, "failed" if error else "sent", error, now) for user_id, error in results]
+    )
+    sent = sum(1 for _, error in results if error is None)
+    conn.execute(
+        "UPDATE broadcast_jobs SET sent = sent + ?, failed = failed + ?, last_user_id = ? WHERE id = ?",
+        (sent, len(results) - sent, last_user_id, job_id)
+    )
@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# زمان اجرای هر کوئری روی thread پایگاه داده (شامل commit)؛ برچسب query متن
+# SQL برای متدهای کمکی و نام تابع برای run(fn) است
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_seconds", "Time spent executing SQL statements and transactions", ["query"]
+)
+SYNC_ON_LOOP = REGISTRY.counter(
+    "db_sync_on_loop_total", "Synchronous Database.connection() uses on the event loop thread"
+)
+
+
+class BlockingCallError(RuntimeError):
+    # دسترسی همزمان (sync) به پایگاه داده از thread event loop در حالت strict
+    pass
+
+
+class Database:
+    # لایه دسترسی به پایگاه داده: یک استخر محدود از اتصال‌های ماندگار که
+    # کوئری‌ها را روی threadهای جداگانه (خارج از event loop) اجرا می‌کند.
+    # هر اتصال کش statementهای آماده خودش را نگه می‌دارد، پس یک کوئری
+    # تکراری فقط یک بار prepare می‌شود.
+
+    # حالت WAL و pragmaها اختیاری هستند؛ مقدار None یعنی پیش‌فرض SQLite.
+    # با batch_writes=True نوشتن‌های write() در یک thread جداگانه صف می‌شوند و
+    # هر batch_window ثانیه (یا هر batch_size مورد) با یک commit ثبت می‌شوند.
+    # connection() روی thread event loop کل loop را متوقف می‌کند؛ چنین
+    # استفاده‌ای لاگ و شمرده می‌شود و با strict=True خطای BlockingCallError می‌دهد.
+
+    def __init__(self, path, pool_size=4, timeout=30.0, cached_statements=256,
+                 wal=False, synchronous=None, cache_size=None, mmap_size=None,
+                 batch_writes=False, batch_window=0.005, batch_size=256, strict=False):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.wal = wal
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.strict = strict
+        self.sync_on_loop = 0
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
+        self._closed = False
+
+        self._write_queue = None
+        self._writer = None
+        if batch_writes:
+            self._write_queue = queue.Queue()
+            self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+            self._writer.start()
+
+    def _connect(self, isolation_level=""):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            isolation_level=isolation_level
+        )
+        if self.wal:
+            conn.execute("PRAGMA journal_mode = WAL")
+        if self.synchronous is not None:
+            conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        if self.cache_size is not None:
+            conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        if self.mmap_size is not None:
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._connections) < self.pool_size:
+                conn = self._connect()
+                self._connections.append(conn)
+                return conn
+
+        # استخر پر است؛ منتظر آزاد شدن یک اتصال می‌مانیم
+        return self._pool.get()
+
+    def _release(self, conn):
+        self._pool.put(conn)
+
+    @contextmanager
+    def connection(self):
+        # استفاده همزمان (sync) از استخر، برای کدهای خارج از event loop مثل init_db
+        self._check_loop_thread()
+        with self._connection() as conn:
+            yield conn
+
+    def _check_loop_thread(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.sync_on_loop += 1
+        SYNC_ON_LOOP.inc()
+        message = "Synchronous database access on the event loop thread"
+        if self.strict:
+            raise BlockingCallError(message)
+        logger.warning("%s:\n%s", message, "".join(traceback.format_stack(limit=8)[:-3]))
+
+    @contextmanager
+    def _connection(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Database is closed")
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._release(conn)
+
+    def _run_sync(self, label, fn, args):
+        start = time.perf_counter()
+        try:
+            with self._connection() as conn:
+                return fn(conn, *args)
+        finally:
+            DB_QUERY_SECONDS.labels(label).observe(time.perf_counter() - start)
+
+    async def _submit(self, label, fn, args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_sync, label, fn, args)
+
+    async def run(self, fn, *args):
+        # fn(conn, *args) در یک تراکنش روی thread پایگاه داده اجرا می‌شود؛
+        # در صورت خطا rollback و در غیر این صورت commit می‌شود.
+        return await self._submit(fn.__name__, fn, args)
+
+    async def transaction(self, fn, *args):
+        return await self.run(fn, *args)
+
+    async def fetchone(self, sql, params=()):
+        return await self._submit(_query_label(sql), _fetchone, (sql, params))
+
+    async def fetchall(self, sql, params=()):
+        return await self._submit(_query_label(sql), _fetchall, (sql, params))
+
+    async def execute(self, sql, params=()):
+        # نتیجه: (lastrowid, rowcount)
+        return await self._submit(_query_label(sql), _execute, (sql, params))
+
+    async def executemany(self, sql, seq_of_params):
+        return await self._submit(_query_label(sql), _executemany, (sql, seq_of_params))
+
+    async def write(self, sql, params=()):
+        # یک INSERT/UPDATE تکی؛ نتیجه lastrowid پس از commit پایدار است.
+        # بدون batch_writes معادل execute است.
+        if self._write_queue is None:
+            lastrowid, _ = await self.execute(sql, params)
+            return lastrowid
+
+        if self._closed:
+            raise sqlite3.ProgrammingError("Database is closed")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._write_queue.put((sql, params, future, loop))
+        return await future
+
+    def _writer_loop(self):
+        conn = self._connect(isolation_level=None)
+        try:
+            while True:
+                item = self._write_queue.get()
+                if item is None:
+                    return
+
+                batch = [item]
+                stop = False
+                deadline = time.monotonic() + self.batch_window
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._write_queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+
+                self._commit_batch(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch):
+        # هر نوشتن در یک savepoint اجرا می‌شود تا خطای یک مورد کل batch را باطل نکند
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for sql, params, future, loop in batch:
+                start = time.perf_counter()
+                try:
+                    conn.execute("SAVEPOINT write_item")
+                    lastrowid = conn.execute(sql, params).lastrowid
+                    conn.execute("RELEASE write_item")
+                    results.append((future, loop, lastrowid, None))
+                    DB_QUERY_SECONDS.labels(_query_label(sql)).observe(time.perf_counter() - start)
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO write_item")
+                    conn.execute("RELEASE write_item")
+                    results.append((future, loop, None, e))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error("Batch commit of %s writes failed: %s", len(batch), e)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(future, loop, None, e) for _, _, future, loop in batch]
+
+        for future, loop, lastrowid, error in results:
+            try:
+                loop.call_soon_threadsafe(_resolve, future, lastrowid, error)
+            except RuntimeError:
+                # event loop فراخوان بسته شده است
+                pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None:
+            self._write_queue.put(None)
+            self._writer.join()
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.error("Error closing database connection: %s", e)
+            self._connections.clear()
+
+
+def _resolve(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+_labels = {}
+
+
+def _query_label(sql):
+    # متن SQL با فاصله‌های یکسان‌شده؛ نتیجه برای هر رشته SQL یک بار محاسبه می‌شود
+    label = _labels.get(sql)
+    if label is None:
+        label = " ".join(sql.split())
+        # SQLهای ساخته‌شده پویا نباید کش را بی‌نهایت بزرگ کنند
+        if len(_labels) < 4096:
+            _labels[sql] = label
+    return label
+
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+
+def _execute(conn, sql, params):
+    c = conn.execute(sql, params)
+    return c.lastrowid, c.rowcount
+
+
+def _executemany(conn, sql, seq_of_params):
+    return conn.executemany(sql, seq_of_params).rowcount
+
+
+def ensure_column(conn, table, column, definition):
+    # مهاجرت ساده: اضافه کردن ستون به جدول موجود اگر هنوز وجود ندارد
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
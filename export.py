@@ -0,0 +1,66 @@
+import csv
+import gzip
+import os
+import tempfile
+
+# داده‌های قابل خروجی گرفتن: نام -> (کوئری، سرستون‌ها)
+EXPORTS = {
+    "users": (
+        "SELECT user_id, first_name, last_name, group_leader_name, card_or_wallet, sheba_number, "
+        "approved_count, balance, registered_at FROM users ORDER BY user_id",
+        ["user_id", "first_name", "last_name", "group_leader_name", "card_or_wallet",
+         "sheba_number", "approved_count", "balance", "registered_at"],
+    ),
+    "submissions": (
+        "SELECT s.id, s.user_id, u.first_name, u.last_name, s.content_type, s.content, s.status, "
+        "d.approved_items, s.submitted_at FROM submissions s "
+        "LEFT JOIN submission_details d ON d.submission_id = s.id "
+        "LEFT JOIN users u ON u.user_id = s.user_id ORDER BY s.id",
+        ["submission_id", "user_id", "first_name", "last_name", "content_type", "content",
+         "status", "approved_items", "submitted_at"],
+    ),
+    "support": (
+        "SELECT id, ticket_id, user_id, direction, message, created_at FROM support_messages ORDER BY id",
+        ["id", "ticket_id", "user_id", "direction", "message", "created_at"],
+    ),
+}
+
+
+def iter_rows(conn, sql, params=(), batch_size=1000):
+    # خواندن نتیجه کوئری به صورت جریانی با fetchmany تا حافظه ثابت بماند
+    c = conn.execute(sql, params)
+    while True:
+        rows = c.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def write_csv(path, header, rows, compress=False):
+    # utf-8-sig تا اکسل حروف فارسی را درست نمایش دهد
+    count = 0
+    opener = gzip.open if compress else open
+    with opener(path, "wt", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def export_query_csv(conn, sql, header, params=(), prefix="export_", compress=False):
+    # روی thread پایگاه داده اجرا می‌شود؛ مسیر فایل موقت و تعداد ردیف‌ها را برمی‌گرداند
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=".csv.gz" if compress else ".csv")
+    os.close(fd)
+    try:
+        count = write_csv(path, header, iter_rows(conn, sql, params), compress)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
+
+
+def export_table(conn, name, compress=False):
+    sql, header = EXPORTS[name]
+    return export_query_csv(conn, sql, header, prefix=f"{name}_", compress=compress)
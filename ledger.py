@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from db import ensure_column
+
+logger = logging.getLogger(__name__)
+
+# نرخ هر آیتم تأییدشده؛ ردیف با group_leader_name خالی ('') نرخ پیش‌فرض است
+# و ردیف‌های دیگر نرخ اختصاصی زیرمجموعه‌های یک سرگروه.
+# balance_ledger فقط قابل افزودن است (triggerها ویرایش و حذف را رد می‌کنند) و
+# users.balance جمع تجمعی آن است. balance_snapshots موجودی هر کاربر را در یک
+# ledger_id نگه می‌دارد تا موجودی در یک تاریخ از آخرین snapshot به اضافه
+# تراکنش‌های بعد از آن محاسبه شود، نه از کل تاریخچه.
+LEDGER_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS item_rates (
+        group_leader_name TEXT PRIMARY KEY,
+        rate REAL NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS balance_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        delta REAL NOT NULL,
+        reason TEXT,  -- opening, approval, manual, payout
+        submission_id INTEGER,
+        admin_id INTEGER,
+        created_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(user_id)
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_balance_ledger_user ON balance_ledger(user_id, id)',
+    '''CREATE TRIGGER IF NOT EXISTS balance_ledger_no_update BEFORE UPDATE ON balance_ledger
+    BEGIN SELECT RAISE(ABORT, 'balance_ledger is append-only'); END''',
+    '''CREATE TRIGGER IF NOT EXISTS balance_ledger_no_delete BEFORE DELETE ON balance_ledger
+    BEGIN SELECT RAISE(ABORT, 'balance_ledger is append-only'); END''',
+    '''CREATE TABLE IF NOT EXISTS balance_snapshots (
+        user_id INTEGER,
+        ledger_id INTEGER,  -- آخرین تراکنش لحاظ‌شده
+        balance REAL,
+        taken_at TEXT,
+        PRIMARY KEY(user_id, ledger_id)
+    ) WITHOUT ROWID''',
+]
+
+# اختلاف قابل چشم‌پوشی بین users.balance و جمع دفتر (خطای ممیز شناور)
+BALANCE_EPSILON = 0.005
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def init_ledger_tables(c, default_rate=0):
+    c.execute(LEDGER_SCHEMA[0])
+    c.execute(LEDGER_SCHEMA[1])
+    # دفترهای ساخته‌شده قبل از ستون admin_id
+    ensure_column(c.connection, "balance_ledger", "admin_id", "INTEGER")
+    for statement in LEDGER_SCHEMA[2:]:
+        c.execute(statement)
+    c.execute("INSERT OR IGNORE INTO item_rates (group_leader_name, rate) VALUES ('', ?)", (default_rate,))
+    # موجودی‌های قبل از وجود دفتر به صورت یک ردیف افتتاحیه وارد می‌شوند
+    # تا جمع دفتر از ابتدا با users.balance برابر باشد
+    c.execute(
+        "INSERT INTO balance_ledger (user_id, delta, reason, created_at) "
+        "SELECT user_id, balance, 'opening', ? FROM users u "
+        "WHERE balance != 0 AND NOT EXISTS (SELECT 1 FROM balance_ledger l WHERE l.user_id = u.user_id)",
+        (_now(),)
+    )
+
+
+def record(conn, user_id, delta, reason, submission_id=None, admin_id=None):
+    # ثبت تراکنش و به‌روزرسانی افزایشی users.balance در همان تراکنش فراخواننده
+    conn.execute(
+        "INSERT INTO balance_ledger (user_id, delta, reason, submission_id, admin_id, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, delta, reason, submission_id, admin_id, _now())
+    )
+    conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (delta, user_id))
+
+
+def record_many(conn, entries, reason, admin_id=None):
+    # نسخه دسته‌ای record برای لیست (user_id, delta)
+    now = _now()
+    conn.executemany(
+        "INSERT INTO balance_ledger (user_id, delta, reason, admin_id, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(user_id, delta, reason, admin_id, now) for user_id, delta in entries]
+    )
+    conn.executemany(
+        "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+        [(delta, user_id) for user_id, delta in entries]
+    )
+
+
+def item_rate(conn, user_id):
+    row = conn.execute(
+        "SELECT COALESCE("
+        "(SELECT rate FROM item_rates r WHERE r.group_leader_name = u.group_leader_name), "
+        "(SELECT rate FROM item_rates WHERE group_leader_name = ''), 0) "
+        "FROM users u WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def accrue(conn, user_id, submission_id, approved_items, admin_id=None):
+    # اعتبار تأیید یک شماره بر اساس جدول نرخ؛ مبلغ ثبت‌شده برگردانده می‌شود
+    amount = approved_items * item_rate(conn, user_id)
+    if amount:
+        record(conn, user_id, amount, "approval", submission_id, admin_id)
+    return amount
+
+
+def set_balance(conn, user_id, new_balance, admin_id=None):
+    # تعیین دستی موجودی به صورت یک تراکنش اصلاحی؛ None اگر کاربر وجود ندارد.
+    # قفل نوشتن قبل از خواندن موجودی گرفته می‌شود تا تأییدی که بین خواندن و
+    # نوشتن commit شود delta را کهنه نکند (اتصال‌های pool در حالت autocommit
+    # تا اولین نوشتن هستند)
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        return None
+    delta = new_balance - row[0]
+    if delta:
+        record(conn, user_id, delta, "manual", admin_id=admin_id)
+    return delta
+
+
+def set_rate(conn, rate, group_leader_name=""):
+    conn.execute(
+        "INSERT OR REPLACE INTO item_rates (group_leader_name, rate) VALUES (?, ?)",
+        (group_leader_name, rate)
+    )
+
+
+def take_snapshots(conn):
+    # یک snapshot برای هر کاربری که از آخرین snapshot تراکنش جدید دارد؛
+    # تعداد snapshotهای ثبت‌شده برگردانده می‌شود
+    return conn.execute(
+        "INSERT INTO balance_snapshots (user_id, ledger_id, balance, taken_at) "
+        "SELECT l.user_id, MAX(l.id), COALESCE(s.balance, 0) + SUM(l.delta), ? "
+        "FROM balance_ledger l "
+        "LEFT JOIN balance_snapshots s ON s.user_id = l.user_id AND s.ledger_id = "
+        "(SELECT MAX(ledger_id) FROM balance_snapshots WHERE user_id = l.user_id) "
+        "WHERE l.id > COALESCE(s.ledger_id, 0) "
+        "GROUP BY l.user_id",
+        (_now(),)
+    ).rowcount
+
+
+def balance_as_of(conn, user_id, when):
+    # موجودی در زمان when (رشته "%Y-%m-%d %H:%M:%S"): آخرین snapshot قبل از
+    # when به اضافه تراکنش‌های بعد از آن تا when
+    row = conn.execute(
+        "SELECT ledger_id, balance FROM balance_snapshots "
+        "WHERE user_id = ? AND taken_at <= ? ORDER BY ledger_id DESC LIMIT 1",
+        (user_id, when)
+    ).fetchone()
+    ledger_id, balance = row if row else (0, 0)
+    tail = conn.execute(
+        "SELECT COALESCE(SUM(delta), 0) FROM balance_ledger WHERE user_id = ? AND id > ? AND created_at <= ?",
+        (user_id, ledger_id, when)
+    ).fetchone()[0]
+    return balance + tail
+
+
+async def snapshot_loop(db, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            taken = await db.run(take_snapshots)
+            logger.info("Took %s balance snapshots", taken)
+        except Exception as e:
+            logger.error("Balance snapshot failed: %s", e)
+
+
+def reconcile(conn, repair=True):
+    # مقایسه users.balance با جمع دفتر؛ لیست (user_id, balance, ledger_total)
+    # مغایرت‌ها، و در صورت repair اصلاح موجودی بر اساس دفتر
+    mismatches = conn.execute(
+        "SELECT u.user_id, u.balance, COALESCE(l.total, 0) FROM users u "
+        "LEFT JOIN (SELECT user_id, SUM(delta) AS total FROM balance_ledger GROUP BY user_id) l "
+        "ON l.user_id = u.user_id "
+        "WHERE ABS(u.balance - COALESCE(l.total, 0)) > ?",
+        (BALANCE_EPSILON,)
+    ).fetchall()
+    if repair and mismatches:
+        conn.executemany(
+            "UPDATE users SET balance = ? WHERE user_id = ?",
+            [(total, user_id) for user_id, _, total in mismatches]
+        )
+    return mismatches
+
+
+async def reconcile_loop(db, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mismatches = await db.run(reconcile)
+        except Exception as e:
+            logger.error("Balance reconciliation failed: %s", e)
+            continue
+        for user_id, balance, total in mismatches:
+            logger.error("Balance mismatch for user %s: balance=%s ledger=%s; repaired", user_id, balance, total)
+        if not mismatches:
+            logger.debug("Balance reconciliation: no mismatches")
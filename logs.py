@@ -0,0 +1,133 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class LazyQueueHandler(QueueHandler):
+    # QueueHandler پیش‌فرض پیام را در thread فراخوان قالب‌بندی می‌کند؛ این‌جا
+    # رکورد همان‌طور که هست در صف می‌رود و قالب‌بندی (پیام، زمان، traceback)
+    # در thread listener انجام می‌شود. فقط traceback که به وضعیت لحظه خطا
+    # وابسته است همین‌جا به متن تبدیل می‌شود. آرگومان‌های پیام باید پس از
+    # لاگ کردن تغییر نکنند (مثل همه مقادیر معمول: عدد، رشته، tuple).
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_exception_formatter = logging.Formatter()
+
+
+class SizeRotatingFileHandler(RotatingFileHandler):
+    # RotatingFileHandler هر رکورد را برای سنجش حجم یک بار اضافه قالب‌بندی
+    # می‌کند؛ این‌جا فقط موقعیت فعلی فایل بررسی می‌شود، پس فایل حداکثر به
+    # اندازه یک رکورد از max_bytes بزرگ‌تر می‌شود
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        return self.maxBytes > 0 and self.stream.tell() >= self.maxBytes
+
+
+class _DeferredFlush:
+    # در حالت صف، handler بعد از هر رکورد flush نمی‌کند؛ listener هر بار که
+    # صف خالی می‌شود flush_pending را صدا می‌زند
+
+    def flush(self):
+        pass
+
+    def flush_pending(self):
+        super().flush()
+
+    def close(self):
+        self.flush_pending()
+        super().close()
+
+
+class _QueuedFileHandler(_DeferredFlush, SizeRotatingFileHandler):
+    pass
+
+
+class _QueuedStreamHandler(_DeferredFlush, logging.StreamHandler):
+    pass
+
+
+class _Listener(QueueListener):
+
+    def dequeue(self, block):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            for handler in self.handlers:
+                handler.flush_pending()
+            return self.queue.get(block)
+
+    def stop(self):
+        super().stop()
+        for handler in self.handlers:
+            handler.flush_pending()
+
+
+def setup_logging(level=logging.INFO, path="bot.log", max_bytes=10 * 1024 * 1024, backup_count=5,
+                  use_queue=True, fmt=LOG_FORMAT):
+    # فایل با چرخش بر اساس حجم و کنسول. با use_queue=True نوشتن روی دیسک و
+    # کنسول در یک thread جداگانه انجام می‌شود و event loop فقط رکورد را در صف
+    # می‌گذارد. نتیجه: QueueListener یا None
+    formatter = logging.Formatter(fmt)
+    file_class, stream_class = (
+        (_QueuedFileHandler, _QueuedStreamHandler) if use_queue else (SizeRotatingFileHandler, logging.StreamHandler)
+    )
+    handlers = [
+        file_class(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'),
+        stream_class(),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if not use_queue:
+        for handler in handlers:
+            root.addHandler(handler)
+        return None
+
+    records = queue.SimpleQueue()
+    root.addHandler(LazyQueueHandler(records))
+    listener = _Listener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # رکوردهای باقی‌مانده در صف هنگام خروج نوشته می‌شوند
+    atexit.register(stop_listener, listener)
+    return listener
+
+
+def stop_listener(listener):
+    # نوشتن رکوردهای باقی‌مانده و توقف thread؛ فراخوانی دوباره بی‌اثر است
+    if listener._thread is not None:
+        listener.stop()
+
+
+class LogSampler:
+    # لاگ کردن یک مورد از هر every مورد (مثلاً نتیجه ارسال به هر گیرنده در
+    # ارسال همگانی)؛ every=1 همه موارد را لاگ می‌کند
+
+    def __init__(self, logger, every=1):
+        self.logger = logger
+        self.every = max(1, every)
+        self._seen = 0
+
+    def log(self, level, msg, *args):
+        if self.every == 1:
+            self.logger.log(level, msg, *args)
+            return
+        # اولین مورد و سپس هر every مورد یک بار
+        self._seen += 1
+        if self._seen % self.every == 1:
+            self.logger.log(level, msg + " (1 of every %d logged)", *args, self.every)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds", "Delay of the watchdog heartbeat past its schedule", buckets=_LAG_BUCKETS
+)
+LOOP_BLOCKS = REGISTRY.counter("event_loop_blocked_total", "Event loop stalls longer than the watchdog threshold")
+LOOP_BLOCK_SECONDS = REGISTRY.histogram(
+    "event_loop_block_seconds", "Duration of event loop stalls longer than the watchdog threshold",
+    buckets=_LAG_BUCKETS
+)
+
+
+class LoopWatchdog:
+    # پایش مداوم event loop:
+    # - یک task هر interval ثانیه بیدار می‌شود و تأخیرش نسبت به زمان‌بندی
+    #   (lag) در event_loop_lag_seconds ثبت می‌شود
+    # - یک thread جداگانه اگر ضربان task بیش از threshold ثانیه عقب بیفتد
+    #   (loop مسدود است) stack همان لحظه thread event loop را لاگ می‌کند؛ پس از
+    #   آزاد شدن loop مدت کل توقف ثبت می‌شود. آخرین توقف‌ها در blocks می‌مانند.
+
+    def __init__(self, interval=0.1, threshold=0.5, history=20):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocks = deque(maxlen=history)
+        self.stalls = 0
+        self._beat = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._loop_thread_id = None
+
+    def start(self):
+        # باید داخل event loop صدا زده شود
+        asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.observe(max(0.0, now - start - self.interval))
+            self._beat = now
+
+    def _monitor(self):
+        stalled_beat = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            if stalled_beat is not None and beat != stalled_beat:
+                # loop دوباره آزاد شد؛ مدت توقف تا ضربان بعدی
+                duration = max(0.0, beat - stalled_beat - self.interval)
+                LOOP_BLOCK_SECONDS.observe(duration)
+                self.blocks[-1]["duration"] = duration
+                logger.warning("Event loop was blocked for %.2fs", duration)
+                stalled_beat = None
+            if stalled_beat is None and time.monotonic() - beat > self.interval + self.threshold:
+                stalled_beat = beat
+                self._report(time.monotonic() - beat - self.interval)
+
+    def _report(self, blocked_for):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        self.stalls += 1
+        LOOP_BLOCKS.inc()
+        self.blocks.append({"at": time.time(), "duration": blocked_for, "stack": stack})
+        logger.warning("Event loop blocked for %.2fs so far; event loop thread stack:\n%s", blocked_for, stack)
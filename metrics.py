@@ -0,0 +1,280 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# رجیستری ساده متریک‌ها با خروجی متنی Prometheus. ثبت هر نمونه فقط یک
+# جستجوی dict برای برچسب‌ها (که می‌شود نتیجه‌اش را نگه داشت)، یک bisect روی
+# مرزهای histogram و دو جمع است؛ جمع تجمعی bucketها و قالب‌بندی فقط هنگام
+# خواندن /metrics انجام می‌شود. شمارنده‌ها بدون قفل به‌روز می‌شوند (قفل چند
+# برابر خود ثبت هزینه دارد)؛ با threadهای پایگاه داده ممکن است به ندرت یک
+# افزایش همزمان گم شود که برای پایش قابل قبول است.
+
+# مرزهای پیش‌فرض histogram (ثانیه)، از ۱۰۰ میکروثانیه تا ۳۰ ثانیه
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0)
+
+# سقف ترکیب‌های برچسب هر متریک؛ بقیه در برچسب "other" جمع می‌شوند
+MAX_LABEL_SETS = 1000
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ("_bounds", "_counts", "sum")
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return list(self._counts), self.sum
+
+
+class _Metric:
+    kind = None
+    _child_class = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return self._child_class()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    if len(self._children) >= MAX_LABEL_SETS:
+                        values = ("other",) * len(self.labelnames)
+                        child = self._children.get(values)
+                    if child is None:
+                        child = self._children[values] = self._new_child()
+        return child
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, values), child.value
+
+    def _function_samples(self, function):
+        # مقدار از تابعی خوانده می‌شود که هنگام خواندن /metrics صدا زده می‌شود:
+        # یک عدد، یا برای متریک برچسب‌دار یک dict از tuple برچسب‌ها به عدد
+        try:
+            value = function()
+        except Exception as e:
+            logger.error("Failed to collect metric %s: %s", self.name, e)
+            return
+        if isinstance(value, dict):
+            for values, item in value.items():
+                yield self.name, _format_labels(self.labelnames, values), item
+        else:
+            yield self.name, "", value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _child_class = _CounterChild
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        # شمارنده‌ای که جای دیگری نگه داشته می‌شود (مثلاً آمار یک کش)؛ مثل Gauge
+        self.function = function
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        return self._function_samples(self.function)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    _child_class = _GaugeChild
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        # تابعی که هنگام خواندن /metrics صدا زده می‌شود: یک عدد، یا برای گیج
+        # برچسب‌دار یک dict از tuple برچسب‌ها به عدد
+        self.function = function
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        return self._function_samples(self.function)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self, *values):
+        # دکوراتور برای توابع async: زمان هر فراخوانی با این برچسب‌ها ثبت می‌شود
+        child = self.labels(*values)
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def collect(self):
+        # {tuple برچسب‌ها: (تعداد نمونه‌ها، جمع)}؛ برای مقایسه دو لحظه (مثلاً پروفایل)
+        result = {}
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            result[values] = (sum(counts), total)
+        return result
+
+    def samples(self):
+        bounds = [*self.buckets, float("inf")]
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       _format_labels(self.labelnames, values, [("le", _format_value(bound))]), cumulative)
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self._register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+async def _handle_request(reader, writer, registry):
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        # بقیه هدرها خوانده و نادیده گرفته می‌شوند
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=9108, registry=REGISTRY):
+    # سرور HTTP حداقلی روی همان event loop؛ فقط GET /metrics
+    server = await asyncio.start_server(lambda r, w: _handle_request(r, w, registry), host, port)
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
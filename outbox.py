@@ -0,0 +1,285 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from pyrogram.errors import FloodWait, InternalServerError
+from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from metrics import REGISTRY
+from ratelimit import SendRateLimiter
+
+logger = logging.getLogger(__name__)
+
+SEND_SECONDS = REGISTRY.histogram("outbound_send_seconds", "Latency of each Telegram send call", ["method"])
+QUEUE_SECONDS = REGISTRY.histogram(
+    "outbound_queue_seconds", "Time from enqueue to delivery or final failure", ["priority"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+)
+MESSAGES = REGISTRY.counter("outbound_messages_total", "Outbound messages by final result", ["result"])
+RETRIES = REGISTRY.counter("outbound_retries_total", "Retries after transient send errors")
+FLOOD_WAITS = REGISTRY.counter("outbound_flood_waits_total", "FloodWait errors received while sending")
+FLOOD_WAIT_SECONDS = REGISTRY.counter("outbound_flood_wait_seconds_total", "Seconds requested by FloodWait errors")
+
+# اولویت‌ها: عدد کوچک‌تر زودتر ارسال می‌شود
+PRIORITY_ADMIN = 0       # پیام‌ها و پاسخ‌های ادمین به کاربر
+PRIORITY_NOTICE = 1      # اطلاع‌رسانی تأیید/رد، اعلان‌های ادمین
+PRIORITY_BROADCAST = 2   # ارسال همگانی
+
+OUTBOX_SCHEMA = '''CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER,
+    method TEXT,
+    kwargs TEXT,
+    priority INTEGER,
+    created_at TEXT
+)'''
+
+# خطاهای گذرا که با back-off دوباره امتحان می‌شوند؛ بقیه (مثلاً کاربری که ربات
+# را بلاک کرده) بلافاصله شکست می‌خورند
+RETRYABLE_ERRORS = (InternalServerError, OSError, asyncio.TimeoutError)
+
+
+def init_outbox_tables(c):
+    c.execute(OUTBOX_SCHEMA)
+
+
+class OutboundMessage:
+    __slots__ = ("seq", "chat_id", "method", "kwargs", "priority", "future", "row_id", "attempts", "queued_at",
+                 "on_failure")
+
+    def __init__(self, seq, chat_id, method, kwargs, priority, future=None, row_id=None, on_failure=None):
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.row_id = row_id
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        self.on_failure = on_failure
+
+
+class Outbox:
+    # صف مرکزی پیام‌های خروجی:
+    # - پیام‌های هر چت در یک صف FIFO جداگانه‌اند و در هر لحظه حداکثر یک پیام از
+    #   هر چت در حال ارسال است، پس ترتیب پیام‌های یک چت حفظ می‌شود
+    # - چت‌های آماده در یک heap بر اساس اولویت پیام سر صفشان هستند و workerها
+    #   همیشه پراولویت‌ترین چت را برمی‌دارند
+    # - FloodWait کل ارسال‌ها را به همان مدت متوقف می‌کند و پیام دوباره ارسال
+    #   می‌شود؛ خطاهای گذرا با back-off نمایی تکرار می‌شوند
+    # - با durable=True پیام‌ها تا ارسال در جدول outbox هم نگه داشته می‌شوند و
+    #   بعد از ری‌استارت ارسال می‌شوند
+
+    def __init__(self, client, db=None, durable=False, global_rate=25, per_chat_rate=1, workers=4,
+                 max_retries=5, base_backoff=1.0, max_backoff=60.0, max_flood_waits=10):
+        self.client = client
+        self.db = db
+        self.durable = durable and db is not None
+        self.limiter = SendRateLimiter(global_rate, per_chat_rate)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_flood_waits = max_flood_waits
+        self._seq = itertools.count()
+        self._chats = {}
+        self._ready = []
+        self._active = set()
+        self._wake = None
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        if self.durable:
+            rows = await self.db.fetchall("SELECT id, chat_id, method, kwargs, priority FROM outbox ORDER BY id")
+            # پیام‌هایی که قبل از start در همین پروسه صف شده‌اند دوباره اضافه نمی‌شوند
+            queued = {item.row_id for queue in self._chats.values() for item in queue}
+            rows = [row for row in rows if row[0] not in queued]
+            for row_id, chat_id, method, kwargs, priority in rows:
+                self._enqueue(OutboundMessage(next(self._seq), chat_id, method, _load_kwargs(kwargs), priority,
+                                              row_id=row_id))
+            if rows:
+                logger.info("Loaded %s queued outbound messages", len(rows))
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def send(self, method, chat_id, priority=PRIORITY_NOTICE, durable=None, wait=True, on_failure=None,
+                   **kwargs):
+        # صف کردن پیام؛ با wait=True تا ارسال صبر می‌کند و نتیجه متد Pyrogram یا
+        # خطای نهایی را برمی‌گرداند، با wait=False بلافاصله برمی‌گردد و شکست
+        # نهایی فقط لاگ می‌شود (برای اطلاع‌رسانی‌هایی که handler منتظرشان نیست).
+        # on_failure(error) اختیاری پس از شکست نهایی صدا زده می‌شود (coroutine
+        # function)؛ برای پیام‌های بازیابی‌شده از جدول outbox بعد از ری‌استارت وجود ندارد
+        future = asyncio.get_running_loop().create_future() if wait else None
+        item = OutboundMessage(next(self._seq), chat_id, method, kwargs, priority, future, on_failure=on_failure)
+        if durable is None:
+            durable = self.durable
+        if durable and self.db is not None:
+            payload = _dump_kwargs(kwargs)
+            if payload is not None:
+                item.row_id = await self.db.write(
+                    "INSERT INTO outbox (chat_id, method, kwargs, priority, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, method, payload, priority, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+        self._enqueue(item)
+        if future is not None:
+            return await future
+
+    async def send_message(self, chat_id, text, priority=PRIORITY_NOTICE, **kwargs):
+        return await self.send("send_message", chat_id, priority, text=text, **kwargs)
+
+    async def send_photo(self, chat_id, photo, priority=PRIORITY_NOTICE, **kwargs):
+        return await self.send("send_photo", chat_id, priority, photo=photo, **kwargs)
+
+    def _enqueue(self, item):
+        queue = self._chats.get(item.chat_id)
+        if queue is None:
+            queue = self._chats[item.chat_id] = deque()
+        queue.append(item)
+        if item.chat_id not in self._active:
+            self._schedule(item.chat_id)
+
+    def _schedule(self, chat_id):
+        head = self._chats[chat_id][0]
+        heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._active.add(chat_id)
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _worker(self):
+        while True:
+            while not self._ready:
+                self._wake.clear()
+                await self._wake.wait()
+            _, _, chat_id = heapq.heappop(self._ready)
+            queue = self._chats[chat_id]
+            try:
+                await self._deliver(queue[0])
+            finally:
+                queue.popleft()
+                if queue:
+                    self._schedule(chat_id)
+                else:
+                    del self._chats[chat_id]
+                    self._active.discard(chat_id)
+
+    async def _deliver(self, item):
+        flood_waits = 0
+        while True:
+            await self.limiter.acquire(item.chat_id)
+            try:
+                result = await self._call(item)
+            except FloodWait as e:
+                flood_waits += 1
+                self.flood_waits += 1
+                self.flood_wait_seconds += e.value
+                FLOOD_WAITS.inc()
+                FLOOD_WAIT_SECONDS.inc(e.value)
+                logger.warning("FloodWait %ss sending to %s (wait %s)", e.value, item.chat_id, flood_waits)
+                self.limiter.pause(e.value)
+                if flood_waits > self.max_flood_waits:
+                    await self._finish(item, error=e)
+                    return
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                item.attempts += 1
+                if not isinstance(e, RETRYABLE_ERRORS) or item.attempts > self.max_retries:
+                    await self._finish(item, error=e)
+                    return
+                self.retries += 1
+                RETRIES.inc()
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (item.attempts - 1))
+                logger.warning("Send to %s failed (%s); retry %s in %.0fs", item.chat_id, e, item.attempts, delay)
+                await asyncio.sleep(delay)
+            else:
+                await self._finish(item, result=result)
+                return
+
+    async def _call(self, item):
+        start = time.perf_counter()
+        try:
+            return await getattr(self.client, item.method)(item.chat_id, **item.kwargs)
+        finally:
+            SEND_SECONDS.labels(item.method).observe(time.perf_counter() - start)
+
+    async def _finish(self, item, result=None, error=None):
+        QUEUE_SECONDS.labels(item.priority).observe(time.monotonic() - item.queued_at)
+        if error is None:
+            self.sent += 1
+            MESSAGES.labels("sent").inc()
+        else:
+            self.failed += 1
+            MESSAGES.labels("failed").inc()
+            # خطای ارسال‌هایی که فراخوان منتظرشان است را خود فراخوان لاگ می‌کند
+            if item.future is None:
+                logger.error("Giving up sending %s to %s: %s", item.method, item.chat_id, error)
+            if item.on_failure is not None:
+                try:
+                    await item.on_failure(error)
+                except Exception as e:
+                    logger.error("Failure callback for %s to %s failed: %s", item.method, item.chat_id, e)
+        if item.row_id is not None:
+            try:
+                await self.db.write("DELETE FROM outbox WHERE id = ?", (item.row_id,))
+            except Exception as e:
+                logger.error("Failed to remove outbound message %s from outbox: %s", item.row_id, e)
+        if item.future is not None and not item.future.done():
+            if error is None:
+                item.future.set_result(result)
+            else:
+                item.future.set_exception(error)
+
+    def stats(self):
+        return {
+            "queued": sum(len(queue) for queue in self._chats.values()),
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+        }
+
+
+def _dump_kwargs(kwargs):
+    # JSON پارامترها برای جدول outbox؛ None اگر قابل ذخیره نیست (مثلاً فایل محلی)
+    kwargs = dict(kwargs)
+    markup = kwargs.get("reply_markup")
+    if markup is not None:
+        if not isinstance(markup, InlineKeyboardMarkup):
+            return None
+        kwargs["reply_markup"] = [
+            [[button.text, button.callback_data, button.url] for button in row]
+            for row in markup.inline_keyboard
+        ]
+    try:
+        return json.dumps(kwargs, ensure_ascii=False)
+    except TypeError:
+        return None
+
+
+def _load_kwargs(payload):
+    kwargs = json.loads(payload)
+    rows = kwargs.get("reply_markup")
+    if rows is not None:
+        kwargs["reply_markup"] = InlineKeyboardMarkup([
+            [InlineKeyboardButton(text, callback_data=callback_data, url=url) for text, callback_data, url in row]
+            for row in rows
+        ])
+    return kwargs
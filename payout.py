@@ -0,0 +1,177 @@
+import logging
+import os
+from datetime import datetime
+
+from export import iter_rows, write_csv
+from ledger import record_many
+
+logger = logging.getLogger(__name__)
+
+# تسویه حساب به صورت run: کاربران دارای موجودی به ترتیب user_id در دسته‌های
+# batch_size خوانده می‌شوند. برای هر دسته در یک تراکنش ردیف‌های payout_items،
+# تراکنش‌های payout در دفتر (صفر کردن موجودی) و کرسر run ثبت و فایل بانکی دسته
+# نوشته می‌شود؛ پس بعد از کرش، run از اولین دسته ثبت‌نشده ادامه پیدا می‌کند و
+# هیچ کاربری دو بار پرداخت نمی‌شود. ارسال موفق فایل هر دسته در payout_batches
+# ثبت می‌شود تا بعد از کرش فقط فایل‌های ارسال‌نشده دوباره فرستاده شوند.
+PAYOUT_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS payout_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT DEFAULT 'running',  -- running, done
+        batch_size INTEGER,
+        created_by INTEGER,
+        last_user_id INTEGER DEFAULT 0,  -- کرسر keyset روی users.user_id
+        batches INTEGER DEFAULT 0,
+        users INTEGER DEFAULT 0,
+        amount REAL DEFAULT 0,
+        created_at TEXT,
+        finished_at TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS payout_items (
+        run_id INTEGER,
+        user_id INTEGER,
+        batch_no INTEGER,
+        amount REAL,
+        first_name TEXT,
+        last_name TEXT,
+        card_or_wallet TEXT,
+        sheba_number TEXT,
+        PRIMARY KEY(run_id, user_id),
+        FOREIGN KEY(run_id) REFERENCES payout_runs(id)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_payout_items_batch ON payout_items(run_id, batch_no)',
+    '''CREATE TABLE IF NOT EXISTS payout_batches (
+        run_id INTEGER,
+        batch_no INTEGER,
+        sent_at TEXT,
+        PRIMARY KEY(run_id, batch_no),
+        FOREIGN KEY(run_id) REFERENCES payout_runs(id)
+    ) WITHOUT ROWID''',
+    # ایندکس جزئی: فقط کاربران دارای موجودی، به ترتیب user_id برای کرسر keyset
+    'CREATE INDEX IF NOT EXISTS idx_users_payable ON users(user_id) WHERE balance > 0',
+]
+
+PAYOUT_HEADER = ["user_id", "first_name", "last_name", "card_or_wallet", "sheba_number", "amount"]
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def init_payout_tables(c):
+    for statement in PAYOUT_SCHEMA:
+        c.execute(statement)
+
+
+def start_run(conn, admin_id, batch_size):
+    # اگر run نیمه‌تمامی وجود دارد همان ادامه پیدا می‌کند؛ (run_id, created)
+    row = conn.execute("SELECT id FROM payout_runs WHERE status = 'running' ORDER BY id LIMIT 1").fetchone()
+    if row:
+        return row[0], False
+    c = conn.execute(
+        "INSERT INTO payout_runs (batch_size, created_by, created_at) VALUES (?, ?, ?)",
+        (batch_size, admin_id, _now())
+    )
+    return c.lastrowid, True
+
+
+def batch_path(directory, run_id, batch_no):
+    return os.path.join(directory, f"payout_{run_id}_{batch_no:04d}.csv")
+
+
+def write_batch_file(conn, run_id, batch_no, path):
+    # فایل موقت و سپس rename تا فایل نیمه‌کاره هیچ‌وقت با نام نهایی دیده نشود
+    tmp_path = path + ".tmp"
+    count = write_csv(tmp_path, PAYOUT_HEADER, iter_rows(
+        conn,
+        "SELECT user_id, first_name, last_name, card_or_wallet, sheba_number, amount "
+        "FROM payout_items WHERE run_id = ? AND batch_no = ? ORDER BY user_id",
+        (run_id, batch_no)
+    ))
+    os.replace(tmp_path, path)
+    return count
+
+
+def run_batch(conn, run_id, directory, admin_id=None):
+    # یک دسته در یک تراکنش (داخل db.run)؛ (batch_no, path, users, amount)
+    # یا None اگر کاربر دیگری برای پرداخت نمانده و run تمام شده است
+    batch_size, last_user_id, batches = conn.execute(
+        "SELECT batch_size, last_user_id, batches FROM payout_runs WHERE id = ?",
+        (run_id,)
+    ).fetchone()
+    rows = conn.execute(
+        "SELECT user_id, first_name, last_name, card_or_wallet, sheba_number, balance FROM users "
+        "WHERE balance > 0 AND user_id > ? ORDER BY user_id LIMIT ?",
+        (last_user_id, batch_size)
+    ).fetchall()
+    if not rows:
+        conn.execute(
+            "UPDATE payout_runs SET status = 'done', finished_at = ? WHERE id = ?",
+            (_now(), run_id)
+        )
+        return None
+
+    batch_no = batches + 1
+    amount = sum(row[5] for row in rows)
+    conn.executemany(
+        "INSERT INTO payout_items (run_id, user_id, batch_no, amount, first_name, last_name, "
+        "card_or_wallet, sheba_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(run_id, user_id, batch_no, balance, first_name, last_name, card, sheba)
+         for user_id, first_name, last_name, card, sheba, balance in rows]
+    )
+    record_many(conn, [(row[0], -row[5]) for row in rows], "payout", admin_id)
+    conn.execute(
+        "UPDATE payout_runs SET last_user_id = ?, batches = ?, users = users + ?, amount = amount + ? WHERE id = ?",
+        (rows[-1][0], batch_no, len(rows), amount, run_id)
+    )
+    # اگر نوشتن فایل خطا بدهد کل تراکنش دسته برگردانده می‌شود
+    path = batch_path(directory, run_id, batch_no)
+    write_batch_file(conn, run_id, batch_no, path)
+    return batch_no, path, len(rows), amount
+
+
+def restore_batch_files(conn, run_id, directory):
+    # دسته‌های ثبت‌شده‌ای که فایلشان هنوز ارسال نشده است: [(batch_no, path)]. بعد
+    # از کرش بین commit و ارسال، فایل‌هایی که روی دیسک نیستند دوباره از
+    # payout_items ساخته می‌شوند
+    batches = conn.execute("SELECT batches FROM payout_runs WHERE id = ?", (run_id,)).fetchone()[0]
+    sent = {row[0] for row in conn.execute("SELECT batch_no FROM payout_batches WHERE run_id = ?", (run_id,))}
+    pending = []
+    for batch_no in range(1, batches + 1):
+        if batch_no in sent:
+            continue
+        path = batch_path(directory, run_id, batch_no)
+        if not os.path.exists(path):
+            write_batch_file(conn, run_id, batch_no, path)
+        pending.append((batch_no, path))
+    return pending
+
+
+def mark_batch_sent(conn, run_id, batch_no):
+    conn.execute(
+        "INSERT OR REPLACE INTO payout_batches (run_id, batch_no, sent_at) VALUES (?, ?, ?)",
+        (run_id, batch_no, _now())
+    )
+
+
+async def _deliver(db, run_id, batch_no, path, deliver):
+    if deliver is not None:
+        await deliver(batch_no, path)
+        await db.run(mark_batch_sent, run_id, batch_no)
+
+
+async def process_run(db, run_id, directory, admin_id=None, deliver=None):
+    # همه دسته‌های باقی‌مانده؛ (تعداد دسته‌ها، جمع کاربران، جمع مبالغ run).
+    # deliver(batch_no, path) اختیاری فایل هر دسته را بلافاصله بعد از ثبت ارسال
+    # می‌کند (اول دسته‌های ارسال‌نشده پیش از کرش)؛ اگر خطا بدهد run متوقف می‌شود
+    # و ادامه آن از همان دسته است
+    os.makedirs(directory, exist_ok=True)
+    for batch_no, path in await db.run(restore_batch_files, run_id, directory):
+        await _deliver(db, run_id, batch_no, path, deliver)
+    while True:
+        result = await db.run(run_batch, run_id, directory, admin_id)
+        if result is None:
+            break
+        batch_no, path, users, amount = result
+        logger.info("Payout run %s batch %s: %s users, %.0f", run_id, batch_no, users, amount)
+        await _deliver(db, run_id, batch_no, path, deliver)
+    return await db.fetchone("SELECT batches, users, amount FROM payout_runs WHERE id = ?", (run_id,))
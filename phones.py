@@ -0,0 +1,148 @@
+import re
+
+# شماره‌های هر لیست متنی به صورت نرمال‌شده (عدد صحیح با کد کشور، مثلاً
+# 989121234567) در submission_numbers نگه داشته می‌شوند. کلید اصلی
+# (number, submission_id) روی جدول WITHOUT ROWID است، پس جستجوی یک شماره
+# حتی با میلیون‌ها ردیف فقط یک پیمایش B-tree است.
+SUBMISSION_NUMBERS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS submission_numbers (
+        number INTEGER,
+        submission_id INTEGER,
+        user_id INTEGER,
+        PRIMARY KEY(number, submission_id)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_submission_numbers_submission ON submission_numbers(submission_id)',
+]
+
+DEFAULT_COUNTRY_CODE = "98"
+
+# جداکننده‌های مجاز داخل یک شماره (فاصله، فاصله نشکن، نیم‌فاصله، خط تیره، پرانتز)
+_SEPARATORS = re.compile(r"[ \t\r\u00a0\u200c\-().]+")
+
+
+def _digits(text):
+    # الگوی رقم‌به‌رقم که ارقام فارسی و عربی را هم می‌پذیرد (int() هر دو را می‌فهمد)
+    return "".join(f"[{d}{chr(0x06F0 + int(d))}{chr(0x0660 + int(d))}]" for d in text)
+
+
+# یک شماره موبایل در هر خط: پیش‌شماره اختیاری (+98، 0098، 98 یا 0) و 10 رقم
+# که با 9 شروع می‌شود؛ \d در الگوهای str ارقام یونیکد را هم شامل می‌شود
+_MOBILE_LINE = re.compile(
+    rf"^(?:\+?{_digits(DEFAULT_COUNTRY_CODE)}|{_digits('00' + DEFAULT_COUNTRY_CODE)}|{_digits('0')})?"
+    rf"({_digits('9')}\d{{9}})$",
+    re.M
+)
+_COUNTRY_OFFSET = int(DEFAULT_COUNTRY_CODE) * 10 ** 10
+
+# حداکثر پارامتر در هر کوئری IN
+_CHUNK = 500
+
+
+def check_list(text):
+    # اعتبارسنجی کل لیست در چند پیمایش سطح C روی متن به جای حلقه روی خطوط:
+    # حذف جداکننده‌ها روی کل متن، یک findall برای خطوط معتبر و حذف تکراری‌ها
+    # با set (ابتدا روی رشته‌ها، سپس روی اعداد برای ارقام فارسی/لاتین یکسان)
+    cleaned = _SEPARATORS.sub("", text)
+    # بعد از حذف جداکننده‌ها هر خط غیرخالی دقیقاً یک کلمه است
+    lines = len(cleaned.split())
+    matches = _MOBILE_LINE.findall(cleaned)
+    numbers = {number + _COUNTRY_OFFSET for number in map(int, set(matches))}
+    return {
+        "lines": lines,
+        "valid": len(numbers),
+        "duplicates": len(matches) - len(numbers),
+        "invalid": lines - len(matches),
+        "numbers": numbers,
+    }
+
+
+def extract_numbers(text):
+    return check_list(text)["numbers"]
+
+
+def init_number_tables(c):
+    for statement in SUBMISSION_NUMBERS_SCHEMA:
+        c.execute(statement)
+    backfill(c.connection)
+
+
+def backfill(conn):
+    # لیست‌های متنی ثبت‌شده بعد از آخرین لیست ایندکس‌شده (اولین بار: همه لیست‌ها)
+    last = conn.execute("SELECT COALESCE(MAX(submission_id), 0) FROM submission_numbers").fetchone()[0]
+    rows = conn.execute(
+        "SELECT id, user_id, content FROM submissions WHERE content_type = 'text' AND id > ? ORDER BY id",
+        (last,)
+    )
+    for submission_id, user_id, content in rows.fetchall():
+        index_numbers(conn, submission_id, user_id, extract_numbers(content or ""))
+
+
+def index_numbers(conn, submission_id, user_id, numbers):
+    conn.executemany(
+        "INSERT OR IGNORE INTO submission_numbers (number, submission_id, user_id) VALUES (?, ?, ?)",
+        [(number, submission_id, user_id) for number in numbers]
+    )
+
+
+def duplicate_stats(conn, user_id, numbers, exclude_submission_id=0):
+    # شمارش شماره‌هایی که قبلاً در لیست‌های دیگر (به جز لیست‌های ردشده) آمده‌اند:
+    # کل تکراری‌ها، تکراری‌های همین کاربر و شماره‌هایی که قبلاً تأیید شده‌اند
+    duplicates = own = approved = 0
+    numbers = list(numbers)
+    for start in range(0, len(numbers), _CHUNK):
+        chunk = numbers[start:start + _CHUNK]
+        rows = conn.execute(
+            "SELECT MAX(n.user_id = ?), MAX(s.status = 'approved') "
+            "FROM submission_numbers n JOIN submissions s ON s.id = n.submission_id "
+            f"WHERE n.number IN ({','.join('?' * len(chunk))}) AND n.submission_id != ? "
+            "AND s.status != 'rejected' GROUP BY n.number",
+            (user_id, *chunk, exclude_submission_id)
+        ).fetchall()
+        duplicates += len(rows)
+        own += sum(1 for is_own, _ in rows if is_own)
+        approved += sum(1 for _, is_approved in rows if is_approved)
+    return {"numbers": len(numbers), "duplicates": duplicates, "own": own, "approved": approved}
+
+
+def store_submission(conn, user_id, content, content_type, submitted_at, check=None):
+    # ثبت لیست و شماره‌هایش در یک تراکنش؛ (submission_id, آمار یا None برای عکس).
+    # check نتیجه check_list است اگر فراخواننده قبلاً لیست را اعتبارسنجی کرده باشد
+    if content_type != "text":
+        c = conn.execute(
+            "INSERT INTO submissions (user_id, content, content_type, submitted_at, status) VALUES (?, ?, ?, ?, 'pending')",
+            (user_id, content, content_type, submitted_at)
+        )
+        return c.lastrowid, None
+    check = check or check_list(content)
+    stats = duplicate_stats(conn, user_id, check["numbers"])
+    stats["invalid"] = check["invalid"]
+    stats["in_list"] = check["duplicates"]
+    # تعداد پیشنهادی برای تأیید: شماره‌های معتبری که قبلاً تأیید نشده‌اند
+    stats["suggested"] = stats["numbers"] - stats["approved"]
+    c = conn.execute(
+        "INSERT INTO submissions (user_id, content, content_type, submitted_at, status, suggested_items) "
+        "VALUES (?, ?, ?, ?, 'pending', ?)",
+        (user_id, content, content_type, submitted_at, stats["suggested"])
+    )
+    submission_id = c.lastrowid
+    index_numbers(conn, submission_id, user_id, check["numbers"])
+    return submission_id, stats
+
+
+def delete_submission(conn, submission_id):
+    # فقط شماره‌ای که هنوز بررسی نشده حذف می‌شود؛ تعداد ردیف‌های حذف‌شده (۰ یا ۱)
+    deleted = conn.execute(
+        "DELETE FROM submissions WHERE id = ? AND status = 'pending'", (submission_id,)
+    ).rowcount
+    if deleted:
+        conn.execute("DELETE FROM submission_numbers WHERE submission_id = ?", (submission_id,))
+    return deleted
+
+
+def format_duplicate_stats(stats):
+    return (
+        f"🔢 شماره‌های معتبر: {stats['numbers']} (نامعتبر: {stats['invalid']}، تکراری در لیست: {stats['in_list']})\n"
+        f"💡 پیشنهاد تأیید: {stats['suggested']} | "
+        f"🔁 تکراری: {stats['duplicates']} (از همین کاربر: {stats['own']}) | "
+        f"✅ قبلاً تأییدشده: {stats['approved']}"
+    )
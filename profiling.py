@@ -0,0 +1,171 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import time
+from datetime import datetime
+
+from db import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class _SlowCallbacks(logging.Handler):
+    # جمع‌آوری هشدارهای «Executing <handle> took X seconds» که asyncio در حالت
+    # debug برای callbackهای کندتر از slow_callback_duration لاگ می‌کند
+
+    def __init__(self, limit=1000):
+        super().__init__(logging.WARNING)
+        self.limit = limit
+        self.items = []
+        self.dropped = 0
+
+    def emit(self, record):
+        if not str(record.msg).startswith("Executing") or len(record.args or ()) != 2:
+            return
+        if len(self.items) < self.limit:
+            self.items.append((record.args[1], str(record.args[0])))
+        else:
+            self.dropped += 1
+
+
+class Profiler:
+    # پروفایل‌گیری موقت از event loop به درخواست ادمین: cProfile روی thread
+    # event loop، حالت debug در asyncio برای تشخیص callbackهای کند، نمونه‌برداری
+    # از تأخیر loop و مقایسه db_query_seconds در ابتدا و انتهای جلسه. تا وقتی
+    # جلسه‌ای در جریان نیست هیچ hook یا taskی فعال نیست.
+    # count_updates: تابعی که تعداد کل آپدیت‌های پردازش‌شده تا این لحظه را می‌دهد
+    # watchdog: LoopWatchdog اختیاری؛ توقف‌های loop در طول جلسه در گزارش می‌آیند
+
+    def __init__(self, count_updates=None, slow_callback=0.1, lag_interval=0.1, top=25, watchdog=None):
+        self.count_updates = count_updates
+        self.watchdog = watchdog
+        self.slow_callback = slow_callback
+        self.lag_interval = lag_interval
+        self.top = top
+        self._stop = None
+
+    @property
+    def active(self):
+        return self._stop is not None
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run(self, seconds, updates=None):
+        # جلسه تا seconds ثانیه یا پردازش updates آپدیت (هر کدام زودتر) یا
+        # stop() ادامه دارد؛ نتیجه: (متن گزارش، خلاصه یک‌خطی)
+        if self._stop is not None:
+            raise RuntimeError("A profiling session is already running")
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        debug, slow_callback = loop.get_debug(), loop.slow_callback_duration
+        slow = _SlowCallbacks()
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.addHandler(slow)
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.slow_callback
+
+        lags = []
+        lag_task = asyncio.ensure_future(self._sample_lag(lags))
+        sql_before = DB_QUERY_SECONDS.collect()
+        updates_before = self.count_updates() if self.count_updates else 0
+        handled = 0
+        reason = "time"
+        profile = cProfile.Profile()
+        started_at = time.time()
+        started = time.monotonic()
+        profile.enable()
+        try:
+            deadline = started + seconds
+            while True:
+                if self.count_updates:
+                    handled = self.count_updates() - updates_before
+                if updates and handled >= updates:
+                    reason = "updates"
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=min(0.5, remaining))
+                    reason = "stopped"
+                    break
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            profile.disable()
+            elapsed = time.monotonic() - started
+            lag_task.cancel()
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_callback
+            asyncio_logger.removeHandler(slow)
+            self._stop = None
+
+        sql = _diff_queries(sql_before, DB_QUERY_SECONDS.collect())
+        blocks = [block for block in self.watchdog.blocks if block["at"] >= started_at] if self.watchdog else []
+        report = self._format(elapsed, handled, reason, lags, slow, sql, profile, blocks)
+        summary = (
+            f"⏱ پروفایل {elapsed:.0f} ثانیه: {handled} آپدیت، "
+            f"تأخیر loop حداکثر {max(lags, default=0) * 1000:.0f}ms، "
+            f"{len(slow.items) + slow.dropped} callback کند"
+        )
+        logger.info("Profiling session finished after %.1fs (%s, %s updates)", elapsed, reason, handled)
+        return report, summary
+
+    async def _sample_lag(self, lags):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lags.append(max(0.0, time.perf_counter() - start - self.lag_interval))
+
+    def _format(self, elapsed, handled, reason, lags, slow, sql, profile, blocks):
+        out = io.StringIO()
+        out.write(f"Profile taken {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        out.write(f"Duration: {elapsed:.1f}s (ended by {reason}), updates handled: {handled}\n\n")
+
+        out.write(f"== Event loop lag (sampled every {self.lag_interval * 1000:.0f}ms) ==\n")
+        if lags:
+            ordered = sorted(lags)
+            out.write(
+                f"samples={len(lags)} mean={sum(lags) / len(lags) * 1000:.1f}ms "
+                f"p95={ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000:.1f}ms "
+                f"max={ordered[-1] * 1000:.1f}ms\n"
+            )
+        out.write("\n")
+
+        if self.watchdog is not None:
+            out.write(f"== Event loop stalls (> {self.watchdog.threshold * 1000:.0f}ms): {len(blocks)} ==\n")
+            for block in blocks:
+                out.write(f"-- {datetime.fromtimestamp(block['at']).strftime('%H:%M:%S')} "
+                          f"blocked {block['duration'] * 1000:.0f}ms\n{block['stack']}\n")
+            out.write("\n")
+
+        out.write(f"== Slow callbacks (> {self.slow_callback * 1000:.0f}ms): {len(slow.items) + slow.dropped} ==\n")
+        for duration, handle in sorted(slow.items, reverse=True)[:self.top]:
+            out.write(f"{duration * 1000:9.1f}ms  {handle}\n")
+        out.write("\n")
+
+        out.write("== Slowest SQL (mean time on the DB thread) ==\n")
+        out.write(f"{'count':>8} {'total':>10} {'mean':>10}  query\n")
+        for label, count, total in sql[:self.top]:
+            out.write(f"{count:>8} {total * 1000:>8.1f}ms {total / count * 1000:>8.2f}ms  {label[:300]}\n")
+        out.write("\n")
+
+        for title, key in (("cumulative time", "cumulative"), ("own time", "tottime")):
+            out.write(f"== Top functions by {title} (event loop thread) ==\n")
+            pstats.Stats(profile, stream=out).sort_stats(key).print_stats(self.top)
+        return out.getvalue()
+
+
+def _diff_queries(before, after):
+    # (برچسب، تعداد، زمان کل) کوئری‌های اجراشده در جلسه، از کندترین میانگین
+    rows = []
+    for values, (count, total) in after.items():
+        old_count, old_total = before.get(values, (0, 0.0))
+        if count > old_count:
+            rows.append((values[0], count - old_count, total - old_total))
+    rows.sort(key=lambda row: row[2] / row[1], reverse=True)
+    return rows
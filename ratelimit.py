@@ -0,0 +1,189 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    # سطل توکن کلاسیک: rate توکن در ثانیه، حداکثر capacity توکن ذخیره
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_acquire(self, tokens=1):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1):
+        # زمان انتظار تا در دسترس بودن tokens (بدون مصرف)
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self, tokens=1):
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+    def pause(self, seconds):
+        # مثلاً بعد از FloodWait: تا پایان زمان تعیین‌شده توکنی داده نمی‌شود
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class SendRateLimiter:
+    # محدودیت‌های تلگرام برای ربات‌ها: حدود ۳۰ پیام در ثانیه در کل و
+    # حدود ۱ پیام در ثانیه برای هر چت. سطل‌های هر چت در یک LRU محدود نگه داشته می‌شوند.
+
+    def __init__(self, global_rate=25, per_chat_rate=1, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, capacity=1)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id):
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def pause(self, seconds):
+        self.global_bucket.pause(seconds)
+
+
+class KeyedBuckets:
+    # یک سطل توکن برای هر کلید (مثلاً user_id) به صورت فشرده: فقط (tokens, updated)
+    # در یک OrderedDict به ترتیب آخرین استفاده. سطلی که idle_after ثانیه استفاده
+    # نشده دوباره پر شده و با نبودنش فرقی ندارد، پس در هر فراخوانی از ابتدای
+    # OrderedDict حذف می‌شود (هزینه سرشکن O(1)).
+
+    def __init__(self, rate, capacity, max_keys=100000):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.idle_after = self.capacity / self.rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+        self.expired = 0
+
+    def _expire(self, now):
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if now - updated < self.idle_after:
+                break
+            del buckets[key]
+            self.expired += 1
+
+    def try_acquire(self, key, tokens=1):
+        now = time.monotonic()
+        self._expire(now)
+        bucket = self._buckets.pop(key, None)
+        level = self.capacity if bucket is None else min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        allowed = level >= tokens
+        if allowed:
+            level -= tokens
+            self.allowed += 1
+        else:
+            self.limited += 1
+        self._buckets[key] = (level, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def retry_after(self, key, tokens=1):
+        # ثانیه تا در دسترس بودن tokens برای این کلید
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return 0.0
+        level = min(self.capacity, bucket[0] + (time.monotonic() - bucket[1]) * self.rate)
+        return max(0.0, (tokens - level) / self.rate)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def stats(self):
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "expired": self.expired,
+        }
+
+
+class FloodGuard:
+    # محدودیت آپدیت‌های ورودی: یک سطل عمومی برای هر کاربر، سهمیه جداگانه برای
+    # هر عمل (مثلاً {"submission": (20, 3600)} یعنی ۲۰ لیست در ساعت) و سقف
+    # سراسری اعلان‌های ارسالی به ادمین
+
+    def __init__(self, user_rate=1, user_burst=10, quotas=None, admin_notify_rate=1,
+                 admin_notify_burst=20, warn_interval=30, max_keys=100000):
+        self.users = KeyedBuckets(user_rate, user_burst, max_keys)
+        self.actions = {
+            action: KeyedBuckets(limit / period, limit, max_keys)
+            for action, (limit, period) in (quotas or {}).items()
+        }
+        self.admin_notifications = TokenBucket(admin_notify_rate, admin_notify_burst)
+        self.admin_notifications_sent = 0
+        self.admin_notifications_dropped = 0
+        # حداکثر یک هشدار محدودیت به هر کاربر در هر warn_interval ثانیه
+        self._warnings = KeyedBuckets(1.0 / warn_interval, 1, max_keys)
+
+    def allow(self, user_id, action=None):
+        if not self.users.try_acquire(user_id):
+            return False
+        quota = self.actions.get(action)
+        return quota is None or quota.try_acquire(user_id)
+
+    def retry_after(self, user_id, action=None):
+        quota = self.actions.get(action)
+        wait = self.users.retry_after(user_id)
+        if quota is not None:
+            wait = max(wait, quota.retry_after(user_id))
+        return wait
+
+    def should_warn(self, user_id):
+        return self._warnings.try_acquire(user_id)
+
+    def allow_admin_notification(self):
+        if self.admin_notifications.try_acquire():
+            self.admin_notifications_sent += 1
+            return True
+        self.admin_notifications_dropped += 1
+        return False
+
+    def stats(self):
+        stats = {"users": self.users.stats()}
+        for action, quota in self.actions.items():
+            stats[action] = quota.stats()
+        stats["admin_notifications"] = {
+            "sent": self.admin_notifications_sent,
+            "dropped": self.admin_notifications_dropped,
+        }
+        return stats
@@ -0,0 +1,50 @@
+class Route:
+    __slots__ = ("key", "handler", "admin_only", "offline", "answers")
+
+    def __init__(self, key, handler, admin_only, offline, answers=False):
+        # کلید یا پیشوند ثبت‌شده؛ برچسب متریک‌های handler
+        self.key = key
+        self.handler = handler
+        self.admin_only = admin_only
+        # مسیرهایی که وقتی ربات غیرفعال است هم اجرا می‌شوند
+        self.offline = offline
+        # handlerهایی که خودشان به callback پاسخ می‌دهند (مثلاً با alert)؛ تلگرام
+        # پاسخ دوم به یک callback را رد می‌کند، پس پاسخ پیش‌فرض برای آن‌ها داده نمی‌شود
+        self.answers = answers
+
+
+class Router:
+    # مسیریابی با جستجوی dict: کلیدهای دقیق (callback_data یا state) در یک dict و
+    # پیشوندها (مثل approve_) در dict دیگری بر اساس خود پیشوند. برای پیشوندها فقط
+    # طول‌های متمایز ثبت‌شده امتحان می‌شوند، پس هزینه مستقل از تعداد مسیرهاست.
+
+    def __init__(self, admin_ids):
+        self.admin_ids = frozenset(admin_ids)
+        self._exact = {}
+        self._prefixes = {}
+        self._prefix_lengths = ()
+
+    def add(self, key, handler, admin=False, offline=False, answers=False):
+        self._exact[key] = Route(key, handler, admin, offline, answers)
+
+    def add_prefix(self, prefix, handler, admin=False, offline=False, answers=False):
+        self._prefixes[prefix] = Route(prefix, handler, admin, offline, answers)
+        # پیشوندهای بلندتر اول بررسی می‌شوند (مثلاً job_status_ قبل از job_)
+        self._prefix_lengths = tuple(sorted({len(p) for p in self._prefixes}, reverse=True))
+
+    def match(self, key):
+        route = self._exact.get(key)
+        if route is not None:
+            return route
+        for length in self._prefix_lengths:
+            route = self._prefixes.get(key[:length])
+            if route is not None:
+                return route
+        return None
+
+    def resolve(self, key, user_id):
+        # مسیر، یا None اگر مسیری نیست یا کاربر اجازه ندارد
+        route = self.match(key)
+        if route is None or (route.admin_only and user_id not in self.admin_ids):
+            return None
+        return route
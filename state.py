@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class StateEntry:
+    __slots__ = ("state", "data", "expires")
+
+    def __init__(self, state, data, expires):
+        self.state = state
+        self.data = data
+        self.expires = expires
+
+
+class MemoryStateStore:
+    # وضعیت گفتگوی کاربران در حافظه:
+    # - انقضا با یک heap از (زمان انقضا، user_id) که sweeper به صورت دوره‌ای خالی می‌کند
+    #   (ورودی‌های قدیمی heap به صورت تنبل نادیده گرفته می‌شوند)
+    # - سقف max_entries؛ در صورت پر شدن قدیمی‌ترین وضعیت (بر اساس آخرین set) حذف می‌شود
+
+    def __init__(self, ttl=3600, max_entries=100000, sweep_interval=60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()
+        self._heap = []
+        self._sweeper = None
+        self.expired = 0
+        self.evicted = 0
+
+    def set(self, user_id, state, data=None, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self._entries[user_id] = StateEntry(state, data or {}, expires)
+        self._entries.move_to_end(user_id)
+        heapq.heappush(self._heap, (expires, user_id))
+
+        while len(self._entries) > self.max_entries:
+            evicted_id, _ = self._entries.popitem(last=False)
+            self.evicted += 1
+            self._on_remove(evicted_id)
+
+        # جلوگیری از رشد heap با ورودی‌های قدیمی
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = [(entry.expires, uid) for uid, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry.expires <= time.time():
+            del self._entries[user_id]
+            self.expired += 1
+            self._on_remove(user_id)
+            return None
+        return entry
+
+    def clear(self, user_id):
+        if self._entries.pop(user_id, None) is not None:
+            self._on_remove(user_id)
+            return True
+        return False
+
+    def sweep(self):
+        now = time.time()
+        removed = 0
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, user_id = heapq.heappop(heap)
+            entry = self._entries.get(user_id)
+            # فقط اگر این ورودی heap هنوز با وضعیت فعلی کاربر مطابقت دارد
+            if entry is not None and entry.expires == expires:
+                del self._entries[user_id]
+                self.expired += 1
+                removed += 1
+                self._on_remove(user_id)
+        return removed
+
+    def _on_remove(self, user_id):
+        pass
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep_loop())
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.info("Expired %s user states", removed)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        # تخمین حافظه: اندازه ساختارها و ورودی‌ها (بدون محتوای تو در تو)
+        approx_bytes = sys.getsizeof(self._entries) + sys.getsizeof(self._heap)
+        for entry in self._entries.values():
+            approx_bytes += sys.getsizeof(entry) + sys.getsizeof(entry.data)
+        return {
+            "size": len(self._entries),
+            "heap_size": len(self._heap),
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "approx_bytes": approx_bytes,
+        }
+
+
+USER_STATES_SCHEMA = '''CREATE TABLE IF NOT EXISTS user_states (
+    user_id INTEGER PRIMARY KEY,
+    state TEXT,
+    data TEXT,
+    expires_at REAL
+)'''
+
+
+class SQLiteStateStore(MemoryStateStore):
+    # همان کش حافظه، به علاوه ذخیره در جدول user_states تا وضعیت‌ها بعد از
+    # ری‌استارت باقی بمانند. خواندن فقط از حافظه است؛ هر تغییر بلافاصله برای
+    # نوشتن صف می‌شود و تغییرات پشت سر هم یک کاربر در یک تراکنش ادغام می‌شوند.
+    # اگر نوشتن شکست بخورد تغییرات در صف می‌مانند و با تأخیر نمایی (از
+    # retry_delay تا max_retry_delay ثانیه) دوباره نوشته می‌شوند.
+
+    def __init__(self, db, ttl=3600, max_entries=100000, sweep_interval=60, retry_delay=1, max_retry_delay=60):
+        super().__init__(ttl, max_entries, sweep_interval)
+        self.db = db
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._pending = {}
+        self._wake = None
+        self._flusher = None
+        self.writes = 0
+        self.write_errors = 0
+
+    def load(self, conn):
+        # در init_db (قبل از شروع event loop) صدا زده می‌شود
+        conn.execute(USER_STATES_SCHEMA)
+        now = time.time()
+        conn.execute("DELETE FROM user_states WHERE expires_at <= ?", (now,))
+        rows = conn.execute(
+            "SELECT user_id, state, data, expires_at FROM user_states ORDER BY expires_at"
+        ).fetchall()
+        for user_id, state, data, expires in rows:
+            super().set(user_id, state, json.loads(data) if data else {}, ttl=expires - now)
+        logger.info("Loaded %s user states from database", len(rows))
+
+    def set(self, user_id, state, data=None, ttl=None):
+        super().set(user_id, state, data, ttl)
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._queue(user_id, entry)
+
+    def _on_remove(self, user_id):
+        self._queue(user_id, None)
+
+    def _queue(self, user_id, entry):
+        self._pending[user_id] = entry
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        super().start()
+        if self._flusher is None:
+            self._wake = asyncio.Event()
+            if self._pending:
+                self._wake.set()
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self):
+        delay = self.retry_delay
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            if await self.flush():
+                delay = self.retry_delay
+                continue
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+            self._wake.set()
+
+    async def flush(self):
+        # True اگر همه تغییرات صف‌شده نوشته شدند
+        if not self._pending:
+            return True
+        pending, self._pending = self._pending, {}
+        upserts = []
+        deletes = []
+        for user_id, entry in pending.items():
+            if entry is None:
+                deletes.append((user_id,))
+            else:
+                upserts.append((user_id, entry.state, json.dumps(entry.data), entry.expires))
+        try:
+            await self.db.run(_write_states, upserts, deletes)
+            self.writes += len(pending)
+            return True
+        except sqlite3.Error as e:
+            self.write_errors += 1
+            logger.error("Failed to persist %s user states: %s", len(pending), e)
+            # تلاش دوباره در نوبت بعد، مگر اینکه در این فاصله تغییر جدیدتری آمده باشد
+            for user_id, entry in pending.items():
+                self._pending.setdefault(user_id, entry)
+            return False
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            "pending_writes": len(self._pending),
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+        })
+        return stats
+
+
+def _write_states(conn, upserts, deletes):
+    if upserts:
+        conn.executemany(
+            "INSERT OR REPLACE INTO user_states (user_id, state, data, expires_at) VALUES (?, ?, ?, ?)",
+            upserts
+        )
+    if deletes:
+        conn.executemany("DELETE FROM user_states WHERE user_id = ?", deletes)
@@ -0,0 +1,63 @@
+from ledger import accrue
+
+# تغییر وضعیت شماره‌ها. هر تابع داخل db.run و در یک تراکنش اجرا می‌شود و فقط
+# شماره‌ای را تغییر می‌دهد که هنوز pending است؛ پس دو تأیید همزمان یک شماره
+# هرگز دو بار در approved_count یا موجودی شمرده نمی‌شوند.
+
+
+def approve_submission(conn, submission_id, approved_items, admin_id=None):
+    # user_id صاحب شماره، یا None اگر شماره قبلاً بررسی شده است
+    c = conn.cursor()
+    c.execute(
+        "UPDATE submissions SET status = 'approved' WHERE id = ? AND status = 'pending' RETURNING user_id",
+        (submission_id,)
+    )
+    row = c.fetchone()
+    if row is None:
+        return None
+    user_id = row[0]
+    c.execute(
+        "INSERT INTO submission_details (submission_id, approved_items) VALUES (?, ?)",
+        (submission_id, approved_items)
+    )
+    c.execute(
+        "UPDATE users SET approved_count = approved_count + ? WHERE user_id = ?",
+        (approved_items, user_id)
+    )
+    accrue(conn, user_id, submission_id, approved_items, admin_id)
+    return user_id
+
+
+def reject_submission(conn, submission_id):
+    row = conn.execute(
+        "UPDATE submissions SET status = 'rejected' WHERE id = ? AND status = 'pending' RETURNING user_id",
+        (submission_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def review_batch(conn, submission_ids, status, approved_items, admin_id=None):
+    # لیست (submission_id, user_id) شماره‌هایی که واقعاً تغییر کردند
+    processed = []
+    c = conn.cursor()
+    for submission_id in submission_ids:
+        c.execute(
+            "UPDATE submissions SET status = ? WHERE id = ? AND status = 'pending' RETURNING user_id",
+            (status, submission_id)
+        )
+        row = c.fetchone()
+        if row:
+            processed.append((submission_id, row[0]))
+
+    if status == "approved" and processed:
+        c.executemany(
+            "INSERT INTO submission_details (submission_id, approved_items) VALUES (?, ?)",
+            [(submission_id, approved_items) for submission_id, _ in processed]
+        )
+        c.executemany(
+            "UPDATE users SET approved_count = approved_count + ? WHERE user_id = ?",
+            [(approved_items, user_id) for _, user_id in processed]
+        )
+        for submission_id, user_id in processed:
+            accrue(conn, user_id, submission_id, approved_items, admin_id)
+    return processed
@@ -0,0 +1,144 @@
+from datetime import datetime
+
+from db import ensure_column
+
+# هر گفتگوی پشتیبانی یک تیکت است؛ پیام‌ها همچنان در support_messages ثبت
+# می‌شوند و ticket_id تیکتشان را نگه می‌دارد. هر کاربر حداکثر یک تیکت باز
+# دارد (ایندکس یکتای جزئی) و پیام جدید کاربر بعد از بسته شدن تیکت، تیکت
+# تازه‌ای باز می‌کند. پاسخ ادمین هیچ‌وقت تیکتی باز نمی‌کند.
+SUPPORT_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS support_tickets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        status TEXT DEFAULT 'open',  -- open, closed
+        messages INTEGER DEFAULT 0,
+        created_at TEXT,
+        last_activity TEXT,
+        closed_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(user_id)
+    )''',
+    # فهرست تیکت‌های باز به ترتیب آخرین فعالیت
+    'CREATE INDEX IF NOT EXISTS idx_support_tickets_status_activity ON support_tickets(status, last_activity)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_support_tickets_open_user ON support_tickets(user_id) WHERE status = \'open\'',
+    # گفتگوی یک کاربر به ترتیب زمان با پیمایش بازه‌ای؛ جایگزین ایندکس تک‌ستونی user_id
+    'CREATE INDEX IF NOT EXISTS idx_support_user_created ON support_messages(user_id, created_at)',
+    'DROP INDEX IF EXISTS idx_support_user_id',
+]
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def init_support_tables(c):
+    ensure_column(c.connection, "support_messages", "ticket_id", "INTEGER")
+    for statement in SUPPORT_SCHEMA:
+        c.execute(statement)
+    backfill_tickets(c.connection)
+
+
+def backfill_tickets(conn):
+    # پیام‌های قبل از وجود تیکت‌ها: یک تیکت برای هر کاربر، باز اگر آخرین پیام
+    # از طرف کاربر بوده (هنوز پاسخ نگرفته) و در غیر این صورت بسته
+    conn.execute(
+        "INSERT INTO support_tickets (user_id, status, messages, created_at, last_activity, closed_at) "
+        "SELECT user_id, CASE WHEN last_direction = 'user_to_admin' THEN 'open' ELSE 'closed' END, "
+        "messages, first_at, last_at, CASE WHEN last_direction = 'user_to_admin' THEN NULL ELSE last_at END "
+        "FROM (SELECT m.user_id, COUNT(*) AS messages, MIN(m.created_at) AS first_at, MAX(m.created_at) AS last_at, "
+        "(SELECT direction FROM support_messages l WHERE l.user_id = m.user_id AND l.ticket_id IS NULL "
+        "ORDER BY l.created_at DESC, l.id DESC LIMIT 1) AS last_direction "
+        "FROM support_messages m WHERE m.ticket_id IS NULL GROUP BY m.user_id) p "
+        "WHERE NOT EXISTS (SELECT 1 FROM support_tickets t WHERE t.user_id = p.user_id AND t.status = 'open')"
+    )
+    conn.execute(
+        "UPDATE support_messages SET ticket_id = "
+        "(SELECT MAX(id) FROM support_tickets t WHERE t.user_id = support_messages.user_id) "
+        "WHERE ticket_id IS NULL"
+    )
+
+
+def add_message(conn, user_id, text, direction):
+    # ثبت پیام در تیکت باز کاربر (یا تیکت تازه برای پیام کاربر)؛ شناسه تیکت.
+    # پاسخ ادمین وقتی تیکت بازی نیست به آخرین تیکت کاربر بدون باز کردن دوباره
+    # آن اضافه می‌شود، یا اگر کاربر تیکتی ندارد بدون تیکت (None) ثبت می‌شود
+    now = _now()
+    row = conn.execute(
+        "UPDATE support_tickets SET messages = messages + 1, last_activity = ? "
+        "WHERE user_id = ? AND status = 'open' RETURNING id",
+        (now, user_id)
+    ).fetchone()
+    if row is None and direction != "user_to_admin":
+        row = conn.execute(
+            "UPDATE support_tickets SET messages = messages + 1, last_activity = ? "
+            "WHERE id = (SELECT MAX(id) FROM support_tickets WHERE user_id = ?) RETURNING id",
+            (now, user_id)
+        ).fetchone()
+        ticket_id = row[0] if row else None
+    elif row is None:
+        ticket_id = conn.execute(
+            "INSERT INTO support_tickets (user_id, status, messages, created_at, last_activity) "
+            "VALUES (?, 'open', 1, ?, ?)",
+            (user_id, now, now)
+        ).lastrowid
+    else:
+        ticket_id = row[0]
+    conn.execute(
+        "INSERT INTO support_messages (user_id, message, direction, created_at, ticket_id) VALUES (?, ?, ?, ?, ?)",
+        (user_id, text, direction, now, ticket_id)
+    )
+    return ticket_id
+
+
+def close_ticket(conn, ticket_id):
+    # user_id صاحب تیکت، یا None اگر تیکت قبلاً بسته شده است
+    row = conn.execute(
+        "UPDATE support_tickets SET status = 'closed', closed_at = ? WHERE id = ? AND status = 'open' RETURNING user_id",
+        (_now(), ticket_id)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def fetch_tickets(conn, status, after_id=0, limit=10):
+    # صفحه‌بندی keyset روی (last_activity, id) از جدیدترین به قدیمی‌ترین با
+    # ایندکس support_tickets(status, last_activity)؛ یک ردیف اضافه برای صفحه بعد
+    if after_id:
+        rows = conn.execute(
+            "SELECT t.id, t.user_id, u.first_name, u.last_name, t.messages, t.last_activity "
+            "FROM support_tickets t LEFT JOIN users u ON u.user_id = t.user_id "
+            "WHERE t.status = ? AND (t.last_activity, t.id) < "
+            "(SELECT last_activity, id FROM support_tickets WHERE id = ?) "
+            "ORDER BY t.last_activity DESC, t.id DESC LIMIT ?",
+            (status, after_id, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT t.id, t.user_id, u.first_name, u.last_name, t.messages, t.last_activity "
+            "FROM support_tickets t LEFT JOIN users u ON u.user_id = t.user_id "
+            "WHERE t.status = ? ORDER BY t.last_activity DESC, t.id DESC LIMIT ?",
+            (status, limit + 1)
+        ).fetchall()
+    total = conn.execute("SELECT COUNT(*) FROM support_tickets WHERE status = ?", (status,)).fetchone()[0]
+    return rows[:limit], len(rows) > limit, total
+
+
+def fetch_thread(conn, user_id, before_id=None, limit=10):
+    # پیام‌های یک کاربر از جدیدترین به قدیمی‌ترین، پیمایش بازه‌ای روی
+    # support_messages(user_id, created_at)؛ before_id شناسه آخرین پیام صفحه قبل.
+    # نتیجه: (پیام‌ها به ترتیب زمانی، وجود پیام قدیمی‌تر، تیکت باز یا None)
+    if before_id:
+        rows = conn.execute(
+            "SELECT id, message, direction, created_at FROM support_messages "
+            "WHERE user_id = ? AND (created_at, id) < (SELECT created_at, id FROM support_messages WHERE id = ?) "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, before_id, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, message, direction, created_at FROM support_messages "
+            "WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, limit + 1)
+        ).fetchall()
+    ticket = conn.execute(
+        "SELECT id FROM support_tickets WHERE user_id = ? AND status = 'open'", (user_id,)
+    ).fetchone()
+    return rows[:limit][::-1], len(rows) > limit, ticket[0] if ticket else None